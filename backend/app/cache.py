@@ -0,0 +1,112 @@
+# Jakob Balkovec
+# cache.py
+# Write-through latest-reading cache
+
+import logging
+import threading
+import time
+
+from app.config import LATEST_CACHE_TTL_S
+from app.utils.time_utils import to_utc
+
+log = logging.getLogger(__name__)
+
+# Expiry used instead of "never" when other processes write readings
+# (INGEST_MODE=sharded), so rows the relay never saw, e.g. bulk imports
+# or readings a worker rejected, are corrected from the database.
+SHARED_WRITER_TTL_S = 30.0
+
+
+def reading_to_dict(r) -> dict:
+    # A SensorReading row as a dict, timestamp as an aware UTC datetime.
+    # FastAPI encodes that as ISO 8601 with "+00:00", like reading_json().
+    return {
+        "id": r.id,
+        "dev_eui": r.dev_eui,
+        "timestamp": to_utc(r.timestamp),
+        "latitude": r.latitude,
+        "longitude": r.longitude,
+        "raw_value": r.raw_value,
+        "moisture_pct": r.moisture_pct,
+    }
+
+
+def reading_json(r) -> dict:
+    # A SensorReading row as the read endpoints return it, timestamp
+    # already encoded as ISO 8601 UTC with "+00:00".
+    reading = reading_to_dict(r)
+    if reading["timestamp"] is not None:
+        reading["timestamp"] = reading["timestamp"].isoformat()
+    return reading
+
+
+class LatestReadingCache:
+    """
+    Newest reading per device, kept in memory.
+
+    Staleness contract:
+      - Ingest writes through after its batch commits, so for readings
+        stored by this process the cache is never behind the database.
+      - Entries only move forward: an older, late-arriving reading never
+        replaces a newer one.
+      - Readings written by another process are not seen until the entry
+        is older than `ttl_s`, at which point the next lookup is a miss and
+        the caller refreshes from the DB. `ttl_s=0` means entries never
+        expire (single-process ingest).
+    """
+
+    def __init__(self, ttl_s: float = LATEST_CACHE_TTL_S):
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict[str, tuple[dict, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, dev_eui: str) -> dict | None:
+        entry = self._entries.get(dev_eui)
+        if entry is not None:
+            reading, stored_at = entry
+            if not self.ttl_s or time.monotonic() - stored_at < self.ttl_s:
+                self.hits += 1
+                return reading
+        self.misses += 1
+        return None
+
+    def put(self, reading: dict):
+        now = time.monotonic()
+        dev_eui = reading["dev_eui"]
+        with self._lock:
+            current = self._entries.get(dev_eui)
+            if current is not None and current[0]["timestamp"] > reading["timestamp"]:
+                return
+            self._entries[dev_eui] = (reading, now)
+
+    def update_many(self, readings):
+        newest: dict[str, dict] = {}
+        for r in readings:
+            seen = newest.get(r["dev_eui"])
+            if seen is None or r["timestamp"] >= seen["timestamp"]:
+                newest[r["dev_eui"]] = r
+        for r in newest.values():
+            self.put(r)
+
+    def invalidate(self, dev_eui: str):
+        with self._lock:
+            self._entries.pop(dev_eui, None)
+
+    def warm(self, readings):
+        self.update_many(readings)
+        log.info("Warmed latest readings for %d devices", len(self._entries))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "ttl_s": self.ttl_s,
+        }
+
+
+latest_cache = LatestReadingCache()
@@ -0,0 +1,177 @@
+# Jakob Balkovec
+# capture.py
+# Raw MQTT traffic capture to rotating files, for offline replay
+#
+# With MQTT_CAPTURE_PATH set, every uplink the API process receives is
+# appended as (arrival time, topic, payload) before parsing, so a capture
+# holds exactly what the broker sent, invalid messages included.
+# app.replay feeds captures back through the pipeline.
+#
+# File layout: MAGIC, then one record after another:
+#   <d H I>  arrival (unix seconds, float64), topic length, payload length
+#   topic bytes, payload bytes
+# 14 bytes of framing per uplink. When a file would grow past
+# MQTT_CAPTURE_MAX_MB it is rotated (path -> path.1 -> path.2 ...),
+# keeping MQTT_CAPTURE_BACKUPS old files.
+
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+from typing import Iterator
+
+from app.config import (
+    MQTT_CAPTURE_BACKUPS,
+    MQTT_CAPTURE_MAX_MB,
+    MQTT_CAPTURE_PATH,
+    MQTT_CAPTURE_QUEUE_SIZE,
+)
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"MDRCAP1\n"
+_HEADER = struct.Struct("<dHI")
+_STOP = object()
+
+
+class CaptureWriter:
+    """
+    Appends uplinks from paho's network thread without touching the
+    disk there: record() only enqueues, and one writer thread encodes,
+    writes and rotates. A full queue drops (and counts) records rather
+    than stall the MQTT client.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = MQTT_CAPTURE_MAX_MB * 2**20,
+        backups: int = MQTT_CAPTURE_BACKUPS,
+        queue_size: int = MQTT_CAPTURE_QUEUE_SIZE,
+    ):
+        self.path = path
+        self.max_bytes = max(len(MAGIC) + _HEADER.size, max_bytes)
+        self.backups = max(0, backups)
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: threading.Thread | None = None
+
+        self.records = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.rotations = 0
+
+    def record(self, topic: str, payload: bytes, arrival: float | None = None):
+        try:
+            self.queue.put_nowait((time.time() if arrival is None else arrival, topic, payload))
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="mqtt-capture", daemon=True)
+        self._thread.start()
+        log.info("Capturing MQTT traffic to %s", self.path, extra={"path": self.path})
+
+    def stop(self, timeout: float = 10.0):
+        """Write what's queued, then close the file."""
+        if self._thread and self._thread.is_alive():
+            self.queue.put(_STOP)
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _open(self):
+        f = open(self.path, "ab")
+        if f.tell() == 0:
+            f.write(MAGIC)
+        return f
+
+    def _rotate(self, f):
+        f.close()
+        if self.backups:
+            for i in range(self.backups - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+        return self._open()
+
+    def _run(self):
+        f = self._open()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is _STOP:
+                    break
+                arrival, topic, payload = item
+                topic_b = topic.encode()
+                size = _HEADER.size + len(topic_b) + len(payload)
+                if f.tell() + size > self.max_bytes and f.tell() > len(MAGIC):
+                    f = self._rotate(f)
+                f.write(_HEADER.pack(arrival, len(topic_b), len(payload)))
+                f.write(topic_b)
+                f.write(payload)
+                self.records += 1
+                self.bytes += size
+                # Flush whenever we catch up, so a crash loses little.
+                if self.queue.empty():
+                    f.flush()
+        except Exception:
+            log.exception("MQTT capture stopped", extra={"path": self.path})
+        finally:
+            f.close()
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "records": self.records,
+            "bytes": self.bytes,
+            "dropped": self.dropped,
+            "rotations": self.rotations,
+            "queue_depth": self.queue.qsize(),
+        }
+
+
+def capture_files(path: str) -> list[str]:
+    """A capture and its rotated backups, oldest first."""
+    files = []
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        files.append(f"{path}.{i}")
+        i += 1
+    files.reverse()
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def read_capture(paths: list[str]) -> Iterator[tuple[float, str, bytes]]:
+    """
+    (arrival, topic, payload) for every record, in file order. A record
+    cut short at the end of a file (the process died mid-write) ends
+    that file.
+    """
+    for path in paths:
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path}: not an MQTT capture")
+            while True:
+                head = f.read(_HEADER.size)
+                if len(head) < _HEADER.size:
+                    if head:
+                        log.warning("Truncated record at end of %s", path, extra={"path": path})
+                    break
+                arrival, topic_len, payload_len = _HEADER.unpack(head)
+                body = f.read(topic_len + payload_len)
+                if len(body) < topic_len + payload_len:
+                    log.warning("Truncated record at end of %s", path, extra={"path": path})
+                    break
+                yield arrival, body[:topic_len].decode(), body[topic_len:]
+
+
+mqtt_capture = CaptureWriter(MQTT_CAPTURE_PATH) if MQTT_CAPTURE_PATH else None
@@ -0,0 +1,131 @@
+# Jakob Balkovec
+# columnar.py
+# Arrow IPC / Parquet export of readings for many devices
+#
+# Served as GET /api/export?dev_eui=...&format=arrow|parquet. Rows come
+# from the same chunked cursor as the CSV export, one device after
+# another, and each chunk becomes one typed record batch:
+#   dev_eui       dictionary<int32, string>  (one entry per requested device)
+#   timestamp     timestamp[ms, UTC]         (int64 epoch milliseconds)
+#   moisture_pct  float32
+#   raw_value     int32
+#
+# Arrow IPC is written uncompressed by default, so pyarrow, pandas
+# (types_mapper / ArrowDtype) and polars map the buffers without copying;
+# `compression` trades that for size. Parquet is zstd-compressed, with
+# batches gathered into row groups of PARQUET_ROW_GROUP_ROWS.
+#
+# pyarrow is optional (pip install pyarrow); without it the endpoint
+# answers 501.
+
+import io
+import itertools
+
+import numpy as np
+
+from app.crud import iter_readings
+from app.utils.time_utils import to_utc
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+FORMATS = {
+    # format -> (media type, file extension)
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+IPC_COMPRESSION = ("none", "lz4", "zstd")
+PARQUET_ROW_GROUP_ROWS = 128 * 1024
+
+
+def available() -> bool:
+    return pa is not None
+
+
+def schema(dev_euis: list[str]):
+    return pa.schema(
+        [
+            pa.field("dev_eui", pa.dictionary(pa.int32(), pa.string()), nullable=False),
+            pa.field("timestamp", pa.timestamp("ms", tz="UTC"), nullable=False),
+            pa.field("moisture_pct", pa.float32(), nullable=False),
+            pa.field("raw_value", pa.int32(), nullable=False),
+        ],
+        metadata={"dev_euis": ",".join(dev_euis)},
+    )
+
+
+def _epoch_ms(timestamps) -> np.ndarray:
+    # SQLite hands back naive datetimes (stored as UTC), Postgres aware ones.
+    seconds = np.fromiter((to_utc(t).timestamp() for t in timestamps), np.float64, len(timestamps))
+    return np.rint(seconds * 1000).astype(np.int64)
+
+
+def record_batches(db, dev_euis: list[str], start=None, end=None, chunk_size: int = 5000):
+    """One record batch per cursor chunk, device by device, oldest first."""
+    dictionary = pa.array(dev_euis, pa.string())
+    out_schema = schema(dev_euis)
+    for index, eui in enumerate(dev_euis):
+        for chunk in iter_readings(db, eui, start=start, end=end, chunk_size=chunk_size):
+            n = len(chunk)
+            timestamps, pct, raw = zip(*chunk)
+            yield pa.RecordBatch.from_arrays(
+                [
+                    pa.DictionaryArray.from_arrays(
+                        pa.array(np.full(n, index, np.int32)), dictionary
+                    ),
+                    pa.array(_epoch_ms(timestamps), pa.timestamp("ms", tz="UTC")),
+                    pa.array(np.fromiter(pct, np.float32, n)),
+                    pa.array(np.fromiter(raw, np.int32, n)),
+                ],
+                schema=out_schema,
+            )
+
+
+class _Sink(io.RawIOBase):
+    # Write target that hands back what was written since the last take().
+    def __init__(self):
+        self._buf = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buf += data
+        return len(data)
+
+    def take(self) -> bytes:
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+
+def ipc_stream(batches, out_schema, compression: str = "none"):
+    """Arrow IPC stream format, yielded one record batch at a time."""
+    sink = _Sink()
+    options = pa.ipc.IpcWriteOptions(compression=None if compression == "none" else compression)
+    with pa.ipc.new_stream(sink, out_schema, options=options) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            yield sink.take()
+    yield sink.take()
+
+
+def parquet_stream(batches, out_schema, row_group_rows: int = PARQUET_ROW_GROUP_ROWS):
+    """Parquet, yielded a row group at a time (the footer comes last)."""
+    sink = _Sink()
+    with pq.ParquetWriter(sink, out_schema, compression="zstd") as writer:
+        pending, rows = [], 0
+        for batch in itertools.chain(batches, [None]):
+            if batch is not None:
+                pending.append(batch)
+                rows += batch.num_rows
+                if rows < row_group_rows:
+                    continue
+            if pending:
+                writer.write_table(pa.Table.from_batches(pending, out_schema), row_group_size=rows)
+                pending, rows = [], 0
+                yield sink.take()
+    yield sink.take()
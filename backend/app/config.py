@@ -10,15 +10,74 @@ class Settings(BaseSettings):
     MQTT_BROKER: str = "mqtt.loralab.org"
     MQTT_PORT: int = 1883
     MQTT_TOPIC: str = "application/soilmoisture/device/+/rx"
+    # Append every raw uplink to this file for app.replay ("" = off),
+    # rotated at MAX_MB with BACKUPS old files kept (see app.capture)
+    MQTT_CAPTURE_PATH: str = ""
+    MQTT_CAPTURE_MAX_MB: int = 64
+    MQTT_CAPTURE_BACKUPS: int = 5
+    MQTT_CAPTURE_QUEUE_SIZE: int = 10000
 
     # DB
     DATABASE_URL: str = "sqlite:///./mdr_api.db"
+    # Read API: async session on aiosqlite/asyncpg, or false for sync
+    # sessions in the threadpool; async pool size 0 = auto (1 for SQLite, 10 otherwise)
+    ASYNC_READS: bool = True
+    ASYNC_DB_POOL_SIZE: int = 0
+
+    # Ingest (MQTT -> DB batching)
+    INGEST_BATCH_SIZE: int = 500
+    INGEST_MAX_LATENCY_MS: int = 250
+    INGEST_QUEUE_SIZE: int = 10000
+    # Raw uplinks between paho's network thread and the parse workers;
+    # when full: "drop_oldest", "drop_newest" or "block" (stalls paho)
+    INGEST_PARSE_WORKERS: int = 2
+    INGEST_RAW_QUEUE_SIZE: int = 10000
+    INGEST_OVERFLOW_POLICY: str = "drop_oldest"
+    # Failed batch commits are retried with backoff before being dropped
+    INGEST_FLUSH_RETRIES: int = 3
+    # "local": the API process ingests; "sharded": app.ingest_workers does
+    # (0 workers = one per core) and the API only relays
+    INGEST_MODE: str = "local"
+    INGEST_SHARE_GROUP: str = "mdr-ingest"
+    INGEST_SHARD_WORKERS: int = 0
+    # How uplinks reach the workers: "partition" (each worker subscribes to
+    # every uplink and keeps its dev_eui partition) or "broker_hash" (shared
+    # subscription; only for brokers that route shared messages by topic
+    # hash). Across hosts, TOTAL is the worker count of all hosts and
+    # OFFSET this host's first worker index (TOTAL 0 = this host's workers).
+    INGEST_SHARD_ROUTING: str = "partition"
+    INGEST_SHARD_TOTAL: int = 0
+    INGEST_SHARD_OFFSET: int = 0
+    # Packed multi-sample uplinks: "app_or_topic_filter=layout,..." (see
+    # app.payloads.LAYOUTS); unlisted applications are single-value
+    PAYLOAD_DECODERS: str = ""
+
+    # Rows fetched per round trip when streaming exports
+    EXPORT_CHUNK_SIZE: int = 5000
+    # Bulk import (app.importer): rows per transaction, row errors kept per report
+    IMPORT_BATCH_SIZE: int = 5000
+    IMPORT_MAX_ERRORS: int = 1000
+
+    # Latest-reading cache; 0 = entries never expire (single ingest process)
+    LATEST_CACHE_TTL_S: float = 0
 
     # Calibration
     # WET: 10660, 10661, 10656, 10651, 10652 | avg = 10656
     # DRY: 12382, 12354, 12352, 12332, 12402 | avg = 12364
     DRY_VALUE: int = 12364
     WET_VALUE: int = 10656
+    # Per-device profiles (calibration_profiles) override the two above.
+    # Reload interval for profiles in processes that don't serve the API
+    # (app.ingest_workers); 0 = auto (30 s there, never in the API process)
+    CALIBRATION_REFRESH_S: float = 0
+    # Readings rewritten per transaction when a profile changes
+    RECOMPUTE_CHUNK_SIZE: int = 2000
+
+    # WebSocket fan-out: per-client queue, "drop_oldest" or "disconnect" when full
+    WS_QUEUE_SIZE: int = 256
+    WS_SLOW_CLIENT_POLICY: str = "drop_oldest"
+    # > 0: batch readings within this window into one JSON array frame
+    WS_COALESCE_MS: int = 0
 
     # WebSocket Authentication (dashboard)
     WS_API_KEY: str = "unauthorized"
@@ -34,6 +93,20 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "CHANGE_ME_NOW"
     TOKEN_EXPIRE_MINUTES: int = 60
 
+    # Verified-token cache: entries live until min(TTL, token exp)
+    AUTH_CACHE_SIZE: int = 4096
+    AUTH_CACHE_TTL_S: float = 300
+
+    # Logging: root level, per-logger overrides ("app.mqtt=DEBUG,app.ingest.events=WARNING"),
+    # "json" or "text" lines, and the queue in front of the writer thread
+    LOG_LEVEL: str = "INFO"
+    LOG_LEVELS: str = ""
+    LOG_FORMAT: str = "json"
+    LOG_QUEUE_SIZE: int = 10000
+    # Per-message event loggers (<module>.events): records/s and burst per message
+    LOG_EVENT_RATE: float = 10
+    LOG_EVENT_BURST: int = 20
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
 
@@ -48,25 +121,73 @@ settings = get_settings()
 MQTT_BROKER = settings.MQTT_BROKER
 MQTT_PORT = settings.MQTT_PORT
 MQTT_TOPIC = settings.MQTT_TOPIC
+MQTT_CAPTURE_PATH = settings.MQTT_CAPTURE_PATH
+MQTT_CAPTURE_MAX_MB = settings.MQTT_CAPTURE_MAX_MB
+MQTT_CAPTURE_BACKUPS = settings.MQTT_CAPTURE_BACKUPS
+MQTT_CAPTURE_QUEUE_SIZE = settings.MQTT_CAPTURE_QUEUE_SIZE
 
 DATABASE_URL = settings.DATABASE_URL
+ASYNC_READS = settings.ASYNC_READS
+ASYNC_DB_POOL_SIZE = settings.ASYNC_DB_POOL_SIZE
+
+INGEST_BATCH_SIZE = settings.INGEST_BATCH_SIZE
+INGEST_MAX_LATENCY_MS = settings.INGEST_MAX_LATENCY_MS
+INGEST_QUEUE_SIZE = settings.INGEST_QUEUE_SIZE
+INGEST_PARSE_WORKERS = settings.INGEST_PARSE_WORKERS
+INGEST_RAW_QUEUE_SIZE = settings.INGEST_RAW_QUEUE_SIZE
+INGEST_OVERFLOW_POLICY = settings.INGEST_OVERFLOW_POLICY
+INGEST_FLUSH_RETRIES = settings.INGEST_FLUSH_RETRIES
+INGEST_MODE = settings.INGEST_MODE
+INGEST_SHARE_GROUP = settings.INGEST_SHARE_GROUP
+INGEST_SHARD_WORKERS = settings.INGEST_SHARD_WORKERS
+INGEST_SHARD_ROUTING = settings.INGEST_SHARD_ROUTING
+INGEST_SHARD_TOTAL = settings.INGEST_SHARD_TOTAL
+INGEST_SHARD_OFFSET = settings.INGEST_SHARD_OFFSET
+
+LATEST_CACHE_TTL_S = settings.LATEST_CACHE_TTL_S
+EXPORT_CHUNK_SIZE = settings.EXPORT_CHUNK_SIZE
+IMPORT_BATCH_SIZE = settings.IMPORT_BATCH_SIZE
+IMPORT_MAX_ERRORS = settings.IMPORT_MAX_ERRORS
 
 DRY_VALUE = settings.DRY_VALUE
 WET_VALUE = settings.WET_VALUE
+CALIBRATION_REFRESH_S = settings.CALIBRATION_REFRESH_S
+RECOMPUTE_CHUNK_SIZE = settings.RECOMPUTE_CHUNK_SIZE
+
+WS_QUEUE_SIZE = settings.WS_QUEUE_SIZE
+WS_SLOW_CLIENT_POLICY = settings.WS_SLOW_CLIENT_POLICY
+WS_COALESCE_MS = settings.WS_COALESCE_MS
 
 WS_API_KEY = settings.WS_API_KEY
 ADMIN_API_KEY = settings.ADMIN_API_KEY
 GOOGLE_CLIENT_ID = settings.GOOGLE_CLIENT_ID
+SECRET_KEY = settings.SECRET_KEY
+AUTH_CACHE_SIZE = settings.AUTH_CACHE_SIZE
+AUTH_CACHE_TTL_S = settings.AUTH_CACHE_TTL_S
+
+LOG_LEVEL = settings.LOG_LEVEL
+LOG_FORMAT = settings.LOG_FORMAT
+LOG_QUEUE_SIZE = settings.LOG_QUEUE_SIZE
+LOG_EVENT_RATE = settings.LOG_EVENT_RATE
+LOG_EVENT_BURST = settings.LOG_EVENT_BURST
+
+# "soilmoisture-v2=packed_u16,application/+/device/+/rx=..." -> dict
+PAYLOAD_DECODERS = {
+    key.strip(): layout.strip()
+    for key, layout in (
+        entry.rsplit("=", 1) for entry in settings.PAYLOAD_DECODERS.split(",") if "=" in entry
+    )
+}
+
+# "app.mqtt=DEBUG,uvicorn.access=WARNING" -> dict
+LOG_LEVELS = {
+    name.strip(): level.strip()
+    for name, level in (
+        entry.rsplit("=", 1) for entry in settings.LOG_LEVELS.split(",") if "=" in entry
+    )
+}
 
 # Parse comma-separated admin list -> Python list
 ADMIN_EMAILS = [
     e.strip() for e in settings.ADMIN_EMAILS.split(",") if e.strip()
 ]
-
-def compute_moisture_pct(raw_value: int) -> float:
-    if raw_value is None:
-        return 0.0
-
-    pct = (raw_value - DRY_VALUE) / (WET_VALUE - DRY_VALUE)
-    pct = max(0.0, min(1.0, pct))
-    return round(pct * 100, 2)
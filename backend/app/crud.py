@@ -6,11 +6,25 @@
 # Updated Device CRUD (metadata support)
 # crud.py
 
+import logging
+
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import datetime, timezone
 
-from app.db.models import SensorReading, Device, DeviceStatus
+from app.db.models import (
+    SensorReading,
+    Device,
+    DeviceStatus,
+    CalibrationProfile,
+    DeviceCalibration,
+)
 from app.db.device_schema import DeviceCreate
+from app.metrics import DB_INSERT_ROWS, DB_INSERT_SECONDS
+from app.utils.time_utils import to_utc
+
+log = logging.getLogger(__name__)
 
 # -----------------------------
 #   SENSOR READING FUNCTIONS
@@ -39,11 +53,49 @@ def store_sensor_reading(
     return reading
 
 
+def store_sensor_readings(db: Session, rows: list[dict], return_ids: bool = True) -> int:
+    # Multi-row insert for the batched ingest path.
+    # Caller owns the transaction (one commit per batch).
+    # Generated ids are written back into `rows` when the backend can
+    # return them from a multi-row insert. return_ids=False is a plain
+    # executemany on the table (bulk import): SQLite otherwise returns
+    # ids one INSERT per row.
+    if not rows:
+        return 0
+    stmt = insert(SensorReading)
+    with DB_INSERT_SECONDS.time():
+        if not return_ids:
+            db.execute(insert(SensorReading.__table__), rows)
+        elif db.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+            result = db.execute(
+                stmt.returning(SensorReading.id, sort_by_parameter_order=True), rows
+            )
+            for row, reading_id in zip(rows, result.scalars()):
+                row["id"] = reading_id
+        else:
+            db.execute(stmt, rows)
+    DB_INSERT_ROWS.inc(len(rows))
+    return len(rows)
+
+
+def existing_reading_keys(db: Session, dev_euis, start, end) -> set[tuple[str, datetime]]:
+    # (dev_eui, UTC timestamp) of stored readings in [start, end], for
+    # skipping re-imported rows.
+    rows = db.execute(
+        select(SensorReading.dev_eui, SensorReading.timestamp).where(
+            SensorReading.dev_eui.in_(list(dev_euis)),
+            SensorReading.timestamp >= start,
+            SensorReading.timestamp <= end,
+        )
+    )
+    return {(eui, to_utc(ts)) for eui, ts in rows}
+
+
 def get_latest_reading(db: Session, dev_eui: str):
     return (
         db.query(SensorReading)
         .filter(SensorReading.dev_eui == dev_eui)
-        .order_by(SensorReading.timestamp.desc())
+        .order_by(SensorReading.timestamp.desc(), SensorReading.id.desc())
         .first()
     )
 
@@ -58,6 +110,98 @@ def get_recent_readings(db: Session, dev_eui: str, limit: int = 100):
     )
 
 
+def _readings_page_stmt(dev_eui, start, end, before, limit):
+    # Newest-first page inside [start, end], continuing strictly after the
+    # keyset `before` = (timestamp, id). Served by the (dev_eui, timestamp)
+    # index, so the cost per page does not grow with depth.
+    stmt = select(SensorReading).where(SensorReading.dev_eui == dev_eui)
+    if start is not None:
+        stmt = stmt.where(SensorReading.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(SensorReading.timestamp <= end)
+    if before is not None:
+        ts, reading_id = before
+        stmt = stmt.where(
+            or_(
+                SensorReading.timestamp < ts,
+                and_(SensorReading.timestamp == ts, SensorReading.id < reading_id),
+            )
+        )
+    return stmt.order_by(SensorReading.timestamp.desc(), SensorReading.id.desc()).limit(limit)
+
+
+def get_readings_page(
+    db: Session,
+    dev_eui: str,
+    *,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    before: tuple[datetime, int] | None = None,
+    limit: int = 100,
+):
+    stmt = _readings_page_stmt(dev_eui, start, end, before, limit)
+    return db.execute(stmt).scalars().all()
+
+
+def count_readings(
+    db: Session,
+    dev_eui: str,
+    *,
+    start: datetime | None = None,
+    end: datetime | None = None,
+) -> int:
+    q = db.query(func.count(SensorReading.id)).filter(SensorReading.dev_eui == dev_eui)
+    if start is not None:
+        q = q.filter(SensorReading.timestamp >= start)
+    if end is not None:
+        q = q.filter(SensorReading.timestamp <= end)
+    return q.scalar()
+
+
+def iter_readings(
+    db: Session,
+    dev_eui: str,
+    *,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    columns=None,
+    chunk_size: int = 5000,
+):
+    # Oldest-first stream of row chunks from a server-side cursor; only one
+    # chunk is held in memory at a time.
+    columns = columns or (
+        SensorReading.timestamp,
+        SensorReading.moisture_pct,
+        SensorReading.raw_value,
+    )
+    stmt = select(*columns).where(SensorReading.dev_eui == dev_eui)
+    if start is not None:
+        stmt = stmt.where(SensorReading.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(SensorReading.timestamp <= end)
+    stmt = stmt.order_by(SensorReading.timestamp, SensorReading.id).execution_options(
+        yield_per=chunk_size
+    )
+    yield from db.execute(stmt).partitions()
+
+
+def get_rollups(
+    db: Session,
+    model,
+    dev_eui: str,
+    *,
+    start: datetime | None = None,
+    end: datetime | None = None,
+):
+    # `model` is one of the rollup tables (see app.rollups.BUCKETS).
+    q = db.query(model).filter(model.dev_eui == dev_eui)
+    if start is not None:
+        q = q.filter(model.bucket_start >= start)
+    if end is not None:
+        q = q.filter(model.bucket_start <= end)
+    return q.order_by(model.bucket_start).all()
+
+
 # -----------------------------
 #   DEVICE FUNCTIONS
 # -----------------------------
@@ -113,7 +257,7 @@ def create_device_if_missing(db: Session, dev_eui: str):
     db.add(dev)
     db.commit()
     db.refresh(dev)
-    print(f"[DEVICE] Auto-registered device {dev_eui}")
+    log.info("Auto-registered device %s", dev_eui)
     return dev
 
 
@@ -165,19 +309,55 @@ def list_registered_devices(db: Session):
     return [d.dev_eui for d in db.query(Device).all()]
 
 
+def _device_dict(d: Device) -> dict:
+    return {
+        "dev_eui": d.dev_eui,
+        "nickname": d.nickname,
+        "latitude": d.latitude,
+        "longitude": d.longitude,
+        "status": d.status.value if d.status else "active",
+        "notes": d.notes,
+    }
+
+
 def list_all_devices(db: Session):
-    devices = db.query(Device).all()
-    return [
-        {
-            "dev_eui": d.dev_eui,
-            "nickname": d.nickname,
-            "latitude": d.latitude,
-            "longitude": d.longitude,
-            "status": d.status.value if d.status else "active",
-            "notes": d.notes,
-        }
-        for d in devices
-    ]
+    return [_device_dict(d) for d in db.query(Device).all()]
+
+
+def _latest_readings_stmt(dev_euis: list[str] | None):
+    # Latest reading for every device (or the given EUIs) in one query:
+    # join each device's max(timestamp) back onto sensor_readings.
+    newest = select(
+        SensorReading.dev_eui.label("dev_eui"),
+        func.max(SensorReading.timestamp).label("timestamp"),
+    )
+    if dev_euis:
+        newest = newest.where(SensorReading.dev_eui.in_(dev_euis))
+    newest = newest.group_by(SensorReading.dev_eui).subquery()
+
+    return (
+        select(SensorReading)
+        .join(
+            newest,
+            and_(
+                SensorReading.dev_eui == newest.c.dev_eui,
+                SensorReading.timestamp == newest.c.timestamp,
+            ),
+        )
+        .order_by(SensorReading.dev_eui, SensorReading.id)
+    )
+
+
+def _newest_per_device(rows):
+    # Ties on timestamp: keep the last inserted row.
+    latest = {}
+    for r in rows:
+        latest[r.dev_eui] = r
+    return list(latest.values())
+
+
+def get_latest_readings(db: Session, dev_euis: list[str] | None = None):
+    return _newest_per_device(db.execute(_latest_readings_stmt(dev_euis)).scalars())
 
 
 def ensure_device(db: Session, dev_eui: str):
@@ -194,8 +374,183 @@ def ensure_device(db: Session, dev_eui: str):
     db.add(device)
     db.commit()
     db.refresh(device)
-    print(f"[DEVICE] Auto-registered {dev_eui}")
+    log.info("Auto-registered device %s", dev_eui)
     return device
 
 
+def ensure_devices(db: Session, dev_euis) -> list[str]:
+    # Batch variant of ensure_device: one SELECT for the whole set,
+    # one multi-row INSERT for the unknown ones. Does not commit.
+    wanted = set(dev_euis)
+    if not wanted:
+        return []
+
+    known = {
+        eui for (eui,) in db.query(Device.dev_eui).filter(Device.dev_eui.in_(wanted))
+    }
+    missing = sorted(wanted - known)
+    if missing:
+        now = datetime.now(timezone.utc)
+        db.execute(
+            insert(Device),
+            [
+                {
+                    "dev_eui": eui,
+                    "nickname": eui,
+                    "status": DeviceStatus.active,
+                    "installation_date": now,
+                }
+                for eui in missing
+            ],
+        )
+        log.info("Auto-registered %d devices", len(missing), extra={"dev_euis": missing})
+    return missing
+
+
+def dialect_insert(db: Session, model):
+    # INSERT that supports ON CONFLICT, or None for other backends.
+    name = db.get_bind().dialect.name
+    if name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(model)
+    if name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(model)
+    return None
+
+
+def upsert_devices(db: Session, dev_euis) -> None:
+    # Idempotent auto-registration: a single INSERT ... ON CONFLICT DO NOTHING,
+    # so concurrent writers can never double-insert. Does not commit.
+    dev_euis = sorted(set(dev_euis))
+    if not dev_euis:
+        return
+
+    stmt = dialect_insert(db, Device)
+    if stmt is None:
+        ensure_devices(db, dev_euis)
+        return
+
+    now = datetime.now(timezone.utc)
+    db.execute(
+        stmt.on_conflict_do_nothing(index_elements=["dev_eui"]),
+        [
+            {
+                "dev_eui": eui,
+                "nickname": eui,
+                "status": DeviceStatus.active,
+                "installation_date": now,
+            }
+            for eui in dev_euis
+        ],
+    )
+
+
+# -----------------------------
+#   CALIBRATION FUNCTIONS
+# -----------------------------
+def list_calibration_profiles(db: Session):
+    return db.query(CalibrationProfile).order_by(CalibrationProfile.name).all()
+
+
+def get_calibration_profile(db: Session, name: str):
+    return db.get(CalibrationProfile, name)
+
+
+def upsert_calibration_profile(db: Session, name: str, data: dict) -> CalibrationProfile:
+    profile = db.get(CalibrationProfile, name)
+    if profile is None:
+        profile = CalibrationProfile(name=name)
+        db.add(profile)
+    for key, value in data.items():
+        setattr(profile, key, value)
+    db.commit()
+    db.refresh(profile)
+    return profile
+
+
+def delete_calibration_profile(db: Session, name: str) -> bool:
+    profile = db.get(CalibrationProfile, name)
+    if profile is None:
+        return False
+    db.delete(profile)
+    db.commit()
+    return True
+
+
+def devices_with_profile(db: Session, name: str) -> list[str]:
+    stmt = select(DeviceCalibration.dev_eui).where(DeviceCalibration.profile == name)
+    return list(db.scalars(stmt.order_by(DeviceCalibration.dev_eui)))
+
+
+def get_device_profile(db: Session, dev_eui: str):
+    stmt = (
+        select(CalibrationProfile)
+        .join(DeviceCalibration, DeviceCalibration.profile == CalibrationProfile.name)
+        .where(DeviceCalibration.dev_eui == dev_eui)
+    )
+    return db.scalars(stmt).first()
+
+
+def set_device_profile(db: Session, dev_eui: str, profile: str | None) -> None:
+    row = db.get(DeviceCalibration, dev_eui)
+    if profile is None:
+        if row is not None:
+            db.delete(row)
+    elif row is None:
+        db.add(DeviceCalibration(dev_eui=dev_eui, profile=profile))
+    else:
+        row.profile = profile
+    db.commit()
+
+
+def device_calibrations(db: Session) -> dict[str, tuple[int, int]]:
+    # dev_eui -> (dry, wet) for every device with a profile.
+    stmt = select(
+        DeviceCalibration.dev_eui,
+        CalibrationProfile.dry_value,
+        CalibrationProfile.wet_value,
+    ).join(CalibrationProfile, DeviceCalibration.profile == CalibrationProfile.name)
+    return {eui: (dry, wet) for eui, dry, wet in db.execute(stmt)}
+
+
+def update_moisture_pct(db: Session, rows: list[dict]) -> None:
+    # Bulk UPDATE by primary key; rows are {"id": ..., "moisture_pct": ...}.
+    # Does not commit.
+    if rows:
+        db.execute(update(SensorReading), rows)
+
+
+# -----------------------------
+#   ASYNC READ FUNCTIONS
+# -----------------------------
+async def get_latest_reading_async(db: AsyncSession, dev_eui: str):
+    stmt = (
+        select(SensorReading)
+        .where(SensorReading.dev_eui == dev_eui)
+        .order_by(SensorReading.timestamp.desc(), SensorReading.id.desc())
+        .limit(1)
+    )
+    return (await db.execute(stmt)).scalars().first()
+
+
+async def get_readings_page_async(
+    db: AsyncSession,
+    dev_eui: str,
+    *,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    before: tuple[datetime, int] | None = None,
+    limit: int = 100,
+):
+    stmt = _readings_page_stmt(dev_eui, start, end, before, limit)
+    return (await db.execute(stmt)).scalars().all()
+
+
+async def list_all_devices_async(db: AsyncSession):
+    return [_device_dict(d) for d in (await db.execute(select(Device))).scalars()]
+
 
+async def get_latest_readings_async(db: AsyncSession, dev_euis: list[str] | None = None):
+    result = await db.execute(_latest_readings_stmt(dev_euis))
+    return _newest_per_device(result.scalars())
@@ -0,0 +1,87 @@
+# Jakob Balkovec
+# async_session.py
+# Async engine/session for the read API
+#
+# ASYNC_READS=true (default): read routes use an AsyncSession on the async
+# driver matching DATABASE_URL. ASYNC_READS=false: they get a sync Session
+# whose queries run in Starlette's threadpool, and no async driver is
+# needed or imported.
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from starlette.concurrency import run_in_threadpool
+
+from app.config import DATABASE_URL, ASYNC_DB_POOL_SIZE, ASYNC_READS
+from app.db.session import SessionLocal
+
+# sync driver -> async driver for the same backend
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def to_async_url(url: str):
+    # An explicit async driver in DATABASE_URL is used as-is.
+    u = make_url(url)
+    if u.drivername in ASYNC_DRIVERS.values():
+        return u
+    return u.set(drivername=ASYNC_DRIVERS[u.get_backend_name()])
+
+
+def _pool_args(url) -> dict:
+    # In-memory SQLite gets a StaticPool, which takes no sizing arguments.
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    # Auto: SQLite serializes access anyway, and one aiosqlite worker
+    # thread keeps the event loop from juggling many connection threads.
+    if ASYNC_DB_POOL_SIZE > 0:
+        size = ASYNC_DB_POOL_SIZE
+    else:
+        size = 1 if url.get_backend_name() == "sqlite" else 10
+    return {"pool_size": size, "max_overflow": 0}
+
+
+class ThreadedSession:
+    """
+    A sync Session behind the part of the AsyncSession interface the read
+    functions use. Each statement runs, and its rows are fetched, in the
+    threadpool; the caller gets a buffered result.
+    """
+
+    def __init__(self, db):
+        self._db = db
+
+    async def execute(self, stmt, *args, **kwargs):
+        def run():
+            return self._db.execute(stmt, *args, **kwargs).freeze()
+
+        return (await run_in_threadpool(run))()
+
+    def close(self):
+        self._db.close()
+
+
+async_engine = None
+AsyncSessionLocal = None
+if ASYNC_READS:
+    _async_url = to_async_url(DATABASE_URL)
+    async_engine = create_async_engine(_async_url, **_pool_args(_async_url))
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine,
+        class_=AsyncSession,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+
+async def get_async_db():
+    if AsyncSessionLocal is None:
+        db = ThreadedSession(SessionLocal())
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close)
+        return
+    async with AsyncSessionLocal() as db:
+        yield db
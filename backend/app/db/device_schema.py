@@ -13,5 +13,7 @@ class DeviceCreate(DeviceBase):
     pass
 
 class DeviceOut(DeviceBase):
+    latest: Optional[dict] = None
+
     class Config:
         orm_mode = True
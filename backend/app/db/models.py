@@ -4,7 +4,7 @@
 
 import enum
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, Enum, Text
+from sqlalchemy import Column, Integer, String, Float, DateTime, Enum, Text, Index, ForeignKey
 from sqlalchemy.sql import func
 from app.db.session import Base
 
@@ -19,6 +19,11 @@ class SensorReading(Base):
     raw_value = Column(Integer, nullable=False)
     moisture_pct = Column(Float, nullable=False)
 
+    __table_args__ = (
+        # Per-device time-range scans and keyset paging
+        Index("ix_sensor_readings_dev_eui_timestamp", "dev_eui", "timestamp"),
+    )
+
 class DeviceStatus(enum.Enum):
     active = "active"
     archived = "archived"
@@ -34,3 +39,47 @@ class Device(Base):
     installation_date = Column(DateTime(timezone=True), nullable=True)
     status = Column(Enum(DeviceStatus), default=DeviceStatus.active, nullable=False)
     notes = Column(Text, nullable=True)
+
+
+class CalibrationProfile(Base):
+    # Named dry/wet calibration points, shared by devices of one soil
+    # type or hardware batch. Devices without one use DRY_VALUE/WET_VALUE.
+    __tablename__ = "calibration_profiles"
+
+    name = Column(String, primary_key=True)
+    dry_value = Column(Integer, nullable=False)
+    wet_value = Column(Integer, nullable=False)
+    notes = Column(Text, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class DeviceCalibration(Base):
+    # Kept out of `devices` so existing databases only gain tables.
+    __tablename__ = "device_calibrations"
+
+    dev_eui = Column(String, primary_key=True)
+    profile = Column(String, ForeignKey("calibration_profiles.name"), nullable=False)
+
+
+class _RollupColumns:
+    # Per-device aggregates of one time bucket; mean = sum / count.
+    dev_eui = Column(String, primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    count = Column(Integer, nullable=False)
+    moisture_min = Column(Float, nullable=False)
+    moisture_max = Column(Float, nullable=False)
+    moisture_sum = Column(Float, nullable=False)
+    moisture_last = Column(Float, nullable=False)
+    raw_min = Column(Integer, nullable=False)
+    raw_max = Column(Integer, nullable=False)
+    raw_sum = Column(Integer, nullable=False)
+    raw_last = Column(Integer, nullable=False)
+    last_ts = Column(DateTime(timezone=True), nullable=False)
+
+class ReadingRollupMinute(_RollupColumns, Base):
+    __tablename__ = "sensor_readings_1m"
+
+class ReadingRollupHour(_RollupColumns, Base):
+    __tablename__ = "sensor_readings_1h"
+
+class ReadingRollupDay(_RollupColumns, Base):
+    __tablename__ = "sensor_readings_1d"
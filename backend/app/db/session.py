@@ -4,11 +4,19 @@
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.engine import make_url
 from app.config import DATABASE_URL
 
+# DATABASE_URL may name an async driver (sqlite+aiosqlite, postgresql+asyncpg)
+# for the read API; the sync engine always uses the backend's default driver.
+_url = make_url(DATABASE_URL)
+if "+" in _url.drivername and _url.get_driver_name() in ("aiosqlite", "asyncpg"):
+    _url = _url.set(drivername=_url.get_backend_name())
+
 engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False}  # needed for SQLite in async/multithread apps
+    _url,
+    # needed for SQLite in async/multithread apps
+    connect_args={"check_same_thread": False} if _url.get_backend_name() == "sqlite" else {},
 )
 
 SessionLocal = sessionmaker(
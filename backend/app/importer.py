@@ -0,0 +1,449 @@
+# Jakob Balkovec
+# importer.py
+# Bulk import of historical readings from NDJSON or CSV
+#
+#   python -m app.importer gateway.ndjson --create-devices
+#   python -m app.importer export.csv --dev-eui a1b2c3d4e5f60708 --skip-existing
+#
+# Also served as POST /api/import/readings (app.routers.imports), which
+# feeds the request body through the same BulkImport as it arrives.
+#
+# Each row needs dev_eui (or a default for the whole upload), timestamp
+# (ISO 8601, or epoch seconds/milliseconds) and raw_value; moisture_pct
+# is computed with the device's calibration unless given, latitude and
+# longitude are optional. CSV needs a header row naming the columns;
+# others (e.g. id) are ignored, so the per-device export re-imports.
+#
+# Rows are inserted `batch_size` at a time, one transaction per batch,
+# with rollups updated in the same transaction. A bad row is reported
+# with its line number and skipped. So is a row the database rejects: a
+# batch that fails to commit is split until that row is isolated, and the
+# rest of the batch is stored.
+
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import logging
+import math
+import sys
+import threading
+import time
+
+from app.cache import latest_cache
+from app.config import IMPORT_BATCH_SIZE, IMPORT_MAX_ERRORS
+from app.crud import existing_reading_keys, store_sensor_readings, upsert_devices
+from app.db.session import SessionLocal
+from app.decode import raw_value_in_range
+from app.ingest import decode_readings
+from app.registry import device_registry
+from app.rollups import apply_rollups
+from app.utils.time_utils import to_utc
+
+log = logging.getLogger(__name__)
+
+FORMATS = ("ndjson", "csv")
+# Epoch values above this are taken as milliseconds (year 5138 in seconds).
+_EPOCH_MS_ABOVE = 1e11
+
+
+def parse_timestamp(value) -> datetime.datetime:
+    if isinstance(value, str):
+        value = value.strip()
+        try:
+            value = float(value)
+        except ValueError:
+            return to_utc(datetime.datetime.fromisoformat(value))
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"bad timestamp {value!r}")
+    if value > _EPOCH_MS_ABOVE:
+        value /= 1000
+    return datetime.datetime.fromtimestamp(value, datetime.timezone.utc)
+
+
+def _number(row: dict, field: str, cast):
+    value = row.get(field)
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or (
+        cast is int and isinstance(value, float) and not value.is_integer()
+    ):
+        raise ValueError(f"bad {field} {value!r}")
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        # "11243.0" from a spreadsheet is still an integer reading.
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"bad {field} {value!r}") from None
+        if cast is int and not number.is_integer():
+            raise ValueError(f"bad {field} {value!r}")
+        number = cast(number)
+    if not math.isfinite(number):
+        raise ValueError(f"bad {field} {value!r}")
+    return number
+
+
+def validate_row(row: dict, dev_eui: str | None = None) -> dict:
+    """One input row -> a reading ready for the writer, or ValueError."""
+    eui = row.get("dev_eui") or row.get("devEUI") or dev_eui
+    if not eui or not isinstance(eui, str):
+        raise ValueError("missing dev_eui")
+    if row.get("timestamp") in (None, ""):
+        raise ValueError("missing timestamp")
+    try:
+        timestamp = parse_timestamp(row["timestamp"])
+    except (ValueError, OverflowError, OSError) as e:
+        raise ValueError(f"bad timestamp {row['timestamp']!r}") from e
+
+    raw_value = _number(row, "raw_value", int)
+    if raw_value is None:
+        raise ValueError("missing raw_value")
+    if not raw_value_in_range(raw_value):
+        raise ValueError(f"raw_value {raw_value} out of range")
+    reading = {
+        "dev_eui": eui.strip(),
+        "timestamp": timestamp,
+        "raw_value": raw_value,
+        "latitude": _number(row, "latitude", float),
+        "longitude": _number(row, "longitude", float),
+    }
+    moisture_pct = _number(row, "moisture_pct", float)
+    if moisture_pct is not None:
+        reading["moisture_pct"] = moisture_pct
+    return reading
+
+
+def split_lines(text: str) -> list[str]:
+    # Lines end at "\n" (optionally "\r\n") only: str.splitlines() would
+    # also split on U+2028, \x1c-\x1e, \v or \f inside a string value.
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return [line[:-1] if line.endswith("\r") else line for line in lines]
+
+
+class BulkImport:
+    """
+    Incremental importer: feed() takes the upload in arbitrary byte
+    chunks, close() flushes the tail and returns the report. Progress is
+    readable from `job` at any time (see ImportJobs).
+    """
+
+    def __init__(
+        self,
+        fmt: str = "ndjson",
+        dev_eui: str | None = None,
+        create_devices: bool = False,
+        skip_existing: bool = False,
+        batch_size: int = IMPORT_BATCH_SIZE,
+        max_errors: int = IMPORT_MAX_ERRORS,
+        job: dict | None = None,
+    ):
+        if fmt not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        self.fmt = fmt
+        self.dev_eui = dev_eui
+        self.create_devices = create_devices
+        self.skip_existing = skip_existing
+        self.batch_size = max(1, batch_size)
+        self.max_errors = max_errors
+        self.job = job if job is not None else {}
+        self.job.update({
+            "format": fmt,
+            "status": "running",
+            "lines": 0,
+            "bytes": 0,
+            "imported": 0,
+            "duplicates": 0,
+            "failed": 0,
+            "batches": 0,
+            "rows_per_s": None,
+            "error_count": 0,
+            "errors": [],
+            "new_devices": 0,
+        })
+
+        self._tail = b""
+        self._header: list[str] | None = None
+        # CSV record left open by a quoted field spanning lines
+        self._open: list[str] = []
+        self._open_at = 0
+        self._quotes = 0
+        self._pending: list[tuple[int, dict]] = []
+        self._started = time.perf_counter()
+
+    def _error(self, line: int, message: str):
+        self.job["failed"] += 1
+        self.job["error_count"] += 1
+        if len(self.job["errors"]) < self.max_errors:
+            self.job["errors"].append({"line": line, "error": message})
+
+    def feed(self, data: bytes):
+        self.job["bytes"] += len(data)
+        data = self._tail + data
+        cut = data.rfind(b"\n") + 1
+        self._tail = data[cut:]
+        if cut:
+            self._lines(split_lines(data[:cut].decode("utf-8", "replace")))
+
+    def _lines(self, lines: list[str]):
+        first = self.job["lines"] + 1
+        self.job["lines"] += len(lines)
+        if self.fmt == "ndjson":
+            rows = self._ndjson(lines, first)
+        else:
+            rows = self._csv(lines, first)
+        for line, row in rows:
+            try:
+                self._pending.append((line, validate_row(row, self.dev_eui)))
+            except ValueError as e:
+                self._error(line, str(e))
+                continue
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def _ndjson(self, lines: list[str], first: int):
+        for line, text in enumerate(lines, first):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError as e:
+                self._error(line, f"not JSON: {e}")
+                continue
+            if not isinstance(row, dict):
+                self._error(line, "not a JSON object")
+                continue
+            yield line, row
+
+    def _csv_records(self, lines: list[str], first: int):
+        # Whole CSV records with their first line number. A quoted field
+        # may span lines (and feed() calls): a record is complete once its
+        # quotes pair up, since an escaped quote is written as two.
+        for line, text in enumerate(lines, first):
+            if not self._open:
+                self._open_at = line
+            self._open.append(text)
+            self._quotes += text.count('"')
+            if self._quotes % 2 == 0:
+                yield self._open_at, "\n".join(self._open)
+                self._open, self._quotes = [], 0
+
+    def _csv(self, lines: list[str], first: int):
+        records = list(self._csv_records(lines, first))
+        for (line, _), values in zip(records, csv.reader(r for _, r in records)):
+            if not values or not any(v.strip() for v in values):
+                continue
+            if self._header is None:
+                self._header = [v.strip() for v in values]
+                missing = {"timestamp", "raw_value"} - set(self._header)
+                if "dev_eui" not in self._header and not self.dev_eui:
+                    missing.add("dev_eui")
+                if missing:
+                    raise ValueError(f"CSV header lacks {', '.join(sorted(missing))}")
+                continue
+            yield line, dict(zip(self._header, values))
+
+    def _unknown_devices(self, batch: list[tuple[int, dict]]) -> list[tuple[int, dict]]:
+        unknown = set(device_registry.unknown(r["dev_eui"] for _, r in batch))
+        if not unknown or self.create_devices:
+            return batch
+        kept = []
+        for line, r in batch:
+            if r["dev_eui"] in unknown:
+                self._error(line, f"unknown device {r['dev_eui']}")
+            else:
+                kept.append((line, r))
+        return kept
+
+    def _drop_duplicates(self, db, batch: list[tuple[int, dict]]) -> list[tuple[int, dict]]:
+        # Against the database and against earlier rows of the same batch.
+        seen = existing_reading_keys(
+            db,
+            {r["dev_eui"] for _, r in batch},
+            min(r["timestamp"] for _, r in batch),
+            max(r["timestamp"] for _, r in batch),
+        )
+        kept = []
+        for line, r in batch:
+            key = (r["dev_eui"], r["timestamp"])
+            if key in seen:
+                self.job["duplicates"] += 1
+            else:
+                seen.add(key)
+                kept.append((line, r))
+        return kept
+
+    def _flush(self):
+        batch, self._pending = self._pending, []
+        batch = self._unknown_devices(batch)
+        if not batch:
+            return
+
+        with SessionLocal() as db:
+            try:
+                if self.skip_existing:
+                    batch = self._drop_duplicates(db, batch)
+                decode_readings([r for _, r in batch])
+            except Exception as e:
+                log.exception("Import batch at line %d failed", batch[0][0])
+                for line, _ in batch:
+                    self._error(line, f"batch failed: {e}")
+                return
+            kept = []
+            for line, r in batch:
+                if "moisture_pct" in r:
+                    kept.append((line, r))
+                else:
+                    self._error(line, "raw_value could not be decoded")
+            if not kept:
+                return
+            self._store(db, kept)
+
+        self.job["batches"] += 1
+        elapsed = time.perf_counter() - self._started
+        self.job["rows_per_s"] = round(self.job["imported"] / elapsed, 1) if elapsed else None
+
+    def _store(self, db, batch: list[tuple[int, dict]]):
+        """
+        Commit a batch with its rollups. If the database rejects it, the
+        batch is split in halves until the offending rows are isolated and
+        reported on their own; the rest is stored.
+        """
+        rows = [r for _, r in batch]
+        new_devices = device_registry.unknown(r["dev_eui"] for r in rows)
+        try:
+            upsert_devices(db, new_devices)
+            store_sensor_readings(db, rows, return_ids=False)
+            apply_rollups(db, rows)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            if len(batch) == 1:
+                log.warning("Import row %d rejected: %s", batch[0][0], e)
+                self._error(batch[0][0], f"rejected by the database: {getattr(e, 'orig', e)}")
+                return
+            mid = len(batch) // 2
+            self._store(db, batch[:mid])
+            self._store(db, batch[mid:])
+            return
+
+        if new_devices:
+            device_registry.mark_known(new_devices)
+            self.job["new_devices"] += len(new_devices)
+        # History may hold a newer reading than the cached one; the next
+        # lookup of these devices reloads from the database.
+        for eui in {r["dev_eui"] for r in rows}:
+            latest_cache.invalidate(eui)
+        self.job["imported"] += len(rows)
+
+    def close(self) -> dict:
+        if self._tail:
+            tail, self._tail = self._tail, b""
+            self._lines(split_lines(tail.decode("utf-8", "replace")))
+        if self._open:
+            self._error(self._open_at, "unterminated quoted field")
+            self._open = []
+        if self._pending:
+            self._flush()
+        self.job["status"] = "done"
+        self.job["elapsed_s"] = round(time.perf_counter() - self._started, 3)
+        log.info(
+            "Imported %d readings (%d failed, %d duplicates) in %.1fs",
+            self.job["imported"], self.job["failed"], self.job["duplicates"], self.job["elapsed_s"],
+            extra={"import_id": self.job.get("id")},
+        )
+        return self.job
+
+
+class ImportJobs:
+    """Imports in flight and the last `keep` finished ones, for progress polling."""
+
+    def __init__(self, keep: int = 20):
+        self.keep = keep
+        self.jobs: dict[int, dict] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create(self, source: str) -> dict:
+        job = {
+            "id": next(self._ids),
+            "source": source,
+            "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        with self._lock:
+            self.jobs[job["id"]] = job
+            for old in sorted(self.jobs)[:-self.keep]:
+                if self.jobs[old].get("status") in ("done", "failed"):
+                    del self.jobs[old]
+        return job
+
+    def get(self, job_id: int, errors: bool = True) -> dict | None:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        job = dict(job)
+        if errors:
+            job["errors"] = list(job.get("errors", ()))
+        else:
+            job.pop("errors", None)
+        return job
+
+    def list(self) -> list[dict]:
+        return [self.get(i, errors=False) for i in sorted(self.jobs, reverse=True)]
+
+
+import_jobs = ImportJobs()
+
+
+def main():
+    import app.db.models  # noqa: F401  (register tables)
+    from app.db.session import Base, engine
+    from app.logs import setup_logging
+    from app.profiles import calibration_cache
+
+    parser = argparse.ArgumentParser(description="Bulk import historical readings")
+    parser.add_argument("file", help="NDJSON or CSV file, - for stdin")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    parser.add_argument("--dev-eui", help="device for rows without a dev_eui column")
+    parser.add_argument("--create-devices", action="store_true", help="register unknown devices")
+    parser.add_argument("--skip-existing", action="store_true", help="skip rows already stored")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    fmt = args.format or ("csv" if args.file.lower().endswith(".csv") else "ndjson")
+    setup_logging(stream=sys.stderr)
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        device_registry.load(db)
+        calibration_cache.load(db)
+
+    importer = BulkImport(
+        fmt,
+        dev_eui=args.dev_eui,
+        create_devices=args.create_devices,
+        skip_existing=args.skip_existing,
+        batch_size=args.batch_size,
+    )
+    job = importer.job
+    source = sys.stdin.buffer if args.file == "-" else open(args.file, "rb")
+    last = 0.0
+    with source:
+        while chunk := source.read(1 << 20):
+            importer.feed(chunk)
+            if time.monotonic() - last >= 1.0:
+                last = time.monotonic()
+                print(
+                    f"[IMPORT] {job['lines']} lines, {job['imported']} imported, "
+                    f"{job['failed']} failed, {job['rows_per_s']} rows/s",
+                    file=sys.stderr,
+                )
+    json.dump(importer.close(), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
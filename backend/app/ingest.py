@@ -0,0 +1,406 @@
+# Jakob Balkovec
+# ingest.py
+# Queued MQTT -> parse workers -> batched DB writer
+
+import asyncio
+import datetime
+import logging
+import queue
+import threading
+import time
+import zlib
+
+from sqlalchemy.exc import OperationalError
+
+from app.crud import upsert_devices, store_sensor_readings
+from app.decode import decode_batch
+from app.profiles import calibration_cache
+from app.db.session import SessionLocal
+from app.registry import device_registry
+from app.cache import latest_cache
+from app.metrics import DB_COMMIT_SECONDS
+from app.logs import event_logger
+from app.rollups import apply_rollups
+from app.websocket import ws_manager
+from app.config import (
+    INGEST_BATCH_SIZE,
+    INGEST_MAX_LATENCY_MS,
+    INGEST_QUEUE_SIZE,
+    INGEST_PARSE_WORKERS,
+    INGEST_RAW_QUEUE_SIZE,
+    INGEST_OVERFLOW_POLICY,
+    INGEST_FLUSH_RETRIES,
+)
+
+log = logging.getLogger(__name__)
+events = event_logger(__name__)
+
+_STOP = object()
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+
+def partition_for(key: str | None, n: int) -> int:
+    # Stable across processes and hosts, unlike hash().
+    if not key or n <= 1:
+        return 0
+    return zlib.crc32(key.encode()) % n
+
+
+def decode_readings(batch: list[dict]) -> list[dict]:
+    """
+    Fill in raw_value and moisture_pct for parsed uplinks in one
+    vectorized pass. Messages carry either an int `raw_value` or a base64
+    `payload`; ones that already have moisture_pct pass through untouched.
+    Each device's calibration comes from calibration_cache. Undecodable
+    messages are dropped from the returned list.
+    """
+    todo = [m for m in batch if "moisture_pct" not in m]
+    if not todo:
+        return batch
+
+    dry, wet = calibration_cache.bounds([m["dev_eui"] for m in todo])
+    raw, pct, valid = decode_batch(
+        [
+            m["raw_value"] if m.get("raw_value") is not None else m.get("payload")
+            for m in todo
+        ],
+        dry,
+        wet,
+    )
+    for m, r, p, ok in zip(todo, raw.tolist(), pct.tolist(), valid.tolist()):
+        m.pop("payload", None)
+        if ok:
+            m["raw_value"] = r
+            m["moisture_pct"] = p
+
+    if valid.all():
+        return batch
+    events.warning("Dropped %d undecodable uplinks", len(todo) - int(valid.sum()))
+    return [m for m in batch if "moisture_pct" in m]
+
+
+def reading_row(m: dict) -> dict:
+    """A decoded uplink as a sensor_readings row (and latest-cache entry)."""
+    return {
+        "dev_eui": m["dev_eui"],
+        "timestamp": datetime.datetime.fromtimestamp(m["timestamp"], tz=datetime.timezone.utc),
+        "latitude": m.get("latitude"),
+        "longitude": m.get("longitude"),
+        "raw_value": m["raw_value"],
+        "moisture_pct": m["moisture_pct"],
+    }
+
+
+def persist_batch(db, batch: list[dict]) -> int:
+    """Write a batch of parsed readings in a single transaction."""
+    # Known devices resolve from the registry with zero SQL.
+    new_devices = device_registry.unknown(m["dev_eui"] for m in batch)
+    upsert_devices(db, new_devices)
+
+    rows = [reading_row(m) for m in batch]
+    stored = store_sensor_readings(db, rows)
+    apply_rollups(db, rows)
+    with DB_COMMIT_SECONDS.time():
+        db.commit()
+
+    latest_cache.update_many(rows)
+
+    if new_devices:
+        device_registry.mark_known(new_devices)
+        log.info("Auto-registered %d devices", len(new_devices), extra={"dev_euis": new_devices})
+    return stored
+
+
+class IngestWriter:
+    """
+    Single writer thread fed by a bounded queue.
+
+    Parsed messages are flushed when either `batch_size` messages are
+    waiting or the oldest one has waited `max_latency_ms`. Each flush is
+    one transaction; the WebSocket broadcast is scheduled after commit.
+    A commit that fails on a transient database error (OperationalError)
+    is retried `flush_retries` times with exponential backoff; meanwhile
+    the queue fills and pushes back on the producers. Other failures
+    split the batch, so one bad reading never costs the rest.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = INGEST_BATCH_SIZE,
+        max_latency_ms: int = INGEST_MAX_LATENCY_MS,
+        queue_size: int = INGEST_QUEUE_SIZE,
+        flush_retries: int = INGEST_FLUSH_RETRIES,
+    ):
+        self.batch_size = max(1, batch_size)
+        self.max_latency = max(0, max_latency_ms) / 1000.0
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.flush_retries = max(0, flush_retries)
+        self.event_loop = None
+        self._thread: threading.Thread | None = None
+
+        self.stored = 0
+        self.retries = 0
+        self.dropped = 0
+        self.undecodable = 0
+
+    def bind_event_loop(self, loop):
+        self.event_loop = loop
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+        log.info(
+            "Writer started batch=%d latency=%.0fms", self.batch_size, self.max_latency * 1000
+        )
+
+    def stop(self, timeout: float = 10.0):
+        # Everything queued before the sentinel is still flushed.
+        if not self._thread:
+            return
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, msg: dict | list[dict]):
+        # A list is one packed uplink; its readings stay in one batch.
+        # Blocks when the queue is full, pushing back on the producer.
+        self.queue.put(msg)
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.depth(),
+            "queue_size": self.queue.maxsize,
+            "stored": self.stored,
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "undecodable": self.undecodable,
+        }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self.queue.get()
+            if first is _STOP:
+                break
+
+            batch = first if isinstance(first, list) else [first]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                if isinstance(item, list):
+                    batch.extend(item)
+                else:
+                    batch.append(item)
+
+            self._flush(batch)
+
+    def _flush(self, batch: list[dict]):
+        # Nothing may escape into _run: a dead writer thread lets the queue
+        # fill and stops all ingest until restart.
+        stored = None
+        try:
+            calibration_cache.maybe_refresh()
+            received = len(batch)
+            batch = decode_readings(batch)
+            self.undecodable += received - len(batch)
+            stored = self._persist(batch) if batch else []
+            if stored:
+                self.stored += len(stored)
+                self._broadcast(stored)
+                events.debug("Stored %d readings", len(stored))
+        except Exception as e:
+            if stored is None:
+                self.dropped += len(batch)
+            log.exception("Flush of %d readings failed: %s", len(batch), e)
+
+    def _persist(self, batch: list[dict]) -> list[dict]:
+        """
+        Commit a batch; returns the readings that were stored. Transient
+        database errors are retried with backoff. Any other failure means
+        a reading the database rejects, so the batch is split in halves
+        until the bad ones are isolated and dropped on their own.
+        """
+        attempt = 0
+        while True:
+            db = SessionLocal()
+            try:
+                persist_batch(db, batch)
+                return batch
+            except OperationalError as e:
+                db.rollback()
+                if attempt >= self.flush_retries:
+                    self.dropped += len(batch)
+                    log.error("Batch of %d dropped: %s", len(batch), e)
+                    return []
+                delay = 0.5 * 2 ** attempt
+                attempt += 1
+                self.retries += 1
+                log.warning("Batch of %d failed, retry in %.1fs: %s", len(batch), delay, e)
+                time.sleep(delay)
+            except Exception as e:
+                db.rollback()
+                error = e
+                break
+            finally:
+                db.close()
+
+        if len(batch) == 1:
+            self.dropped += 1
+            log.error("Reading dropped: %s", error, extra={"dev_eui": batch[0].get("dev_eui")})
+            return []
+        mid = len(batch) // 2
+        return self._persist(batch[:mid]) + self._persist(batch[mid:])
+
+    def _broadcast(self, batch: list[dict]):
+        if self.event_loop is None:
+            # Headless ingest worker: no WebSocket clients in this process.
+            return
+        if self.event_loop.is_running():
+            asyncio.run_coroutine_threadsafe(_broadcast_batch(batch), self.event_loop)
+        else:
+            events.warning("Event loop not running, skipping broadcast")
+
+
+async def _broadcast_batch(batch: list[dict]):
+    for msg in batch:
+        await ws_manager.broadcast(msg)
+
+
+class UplinkPool:
+    """
+    Parse workers between the MQTT network thread and the writer.
+
+    submit() is all on_message does: no JSON, no DB, never an unbounded
+    wait, so paho keeps reading the socket and answering keepalives while
+    the database is slow. Backpressure runs writer queue -> workers ->
+    raw queue; once the raw queue is full the overflow policy decides:
+      - "drop_oldest": discard the oldest unparsed uplink
+      - "drop_newest": discard the incoming one
+      - "block": wait for space (stalls paho; for lossless replays only)
+
+    Each worker has its own queue and uplinks are routed by a partition
+    key (the dev_eui from the topic), so one device's readings are always
+    parsed, and reach the writer, in arrival order.
+    """
+
+    def __init__(
+        self,
+        parse,
+        sink,
+        workers: int = INGEST_PARSE_WORKERS,
+        queue_size: int = INGEST_RAW_QUEUE_SIZE,
+        overflow_policy: str = INGEST_OVERFLOW_POLICY,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow_policy must be one of {OVERFLOW_POLICIES}")
+        self.parse = parse
+        self.sink = sink
+        self.workers = max(1, workers)
+        self.overflow_policy = overflow_policy
+        self.queue_size = queue_size
+        per_worker = max(1, queue_size // self.workers) if queue_size > 0 else 0
+        self.queues: list[queue.Queue] = [
+            queue.Queue(maxsize=per_worker) for _ in range(self.workers)
+        ]
+        self._threads: list[threading.Thread] = []
+
+        self.received = 0
+        self.parsed = 0
+        self.readings = 0
+        self.invalid = 0
+        self.overflowed = 0
+
+    def start(self):
+        if self._threads:
+            return
+        for i, q in enumerate(self.queues):
+            t = threading.Thread(
+                target=self._run, args=(q,), name=f"ingest-parse-{i}", daemon=True
+            )
+            t.start()
+            self._threads.append(t)
+        log.info(
+            "%d parse workers started queue=%d overflow=%s",
+            self.workers, self.queue_size, self.overflow_policy,
+        )
+
+    def stop(self, timeout: float = 10.0):
+        # Call after the MQTT loop has stopped; queued uplinks are drained.
+        for q in self.queues:
+            q.put(_STOP)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def submit(self, payload, key: str | None = None) -> bool:
+        """Enqueue one raw uplink. Returns False if it was dropped."""
+        self.received += 1
+        q = self.queues[partition_for(key, self.workers)]
+        if self.overflow_policy == "block":
+            q.put(payload)
+            return True
+
+        while True:
+            try:
+                q.put_nowait(payload)
+                return True
+            except queue.Full:
+                pass
+            self.overflowed += 1
+            if self.overflow_policy == "drop_newest":
+                return False
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+    def _run(self, q: queue.Queue):
+        while True:
+            payload = q.get()
+            if payload is _STOP:
+                break
+            try:
+                msg = self.parse(payload)
+            except Exception as e:
+                msg = None
+                events.exception("Parse failed: %s", e)
+            if msg is None:
+                self.invalid += 1
+                continue
+            self.parsed += 1
+            self.readings += len(msg) if isinstance(msg, list) else 1
+            # Blocks while the writer is backed up.
+            self.sink(msg)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": self.depth(),
+            "queue_size": self.queue_size,
+            "overflow_policy": self.overflow_policy,
+            "received": self.received,
+            "parsed": self.parsed,
+            "readings": self.readings,
+            "invalid": self.invalid,
+            "overflowed": self.overflowed,
+        }
+
+
+ingest_writer = IngestWriter()
@@ -0,0 +1,247 @@
+# Jakob Balkovec
+# ingest_workers.py
+# Sharded ingest: N worker processes splitting the MQTT uplinks by device
+#
+#   python -m app.ingest_workers [--workers N] [--group mdr-ingest]
+#   python -m app.ingest_workers --workers 4 --total 8 --offset 4   # 2nd of 2 hosts
+#
+# Run the API with INGEST_MODE=sharded so it only relays live updates.
+# Client IDs include the hostname so hosts never collide.
+#
+# Per-device ordering: each device's uplinks must reach one worker, whose
+# UplinkPool keeps them in order. With --routing partition (the default)
+# every worker subscribes to all uplinks and keeps those whose dev_eui
+# falls in its partition (partition_for(dev_eui, total) == index), so this
+# holds on any broker. The price is that every worker receives the whole
+# stream, and a restarting worker's partition is not ingested until it
+# reconnects. --routing broker_hash joins a shared subscription instead;
+# it is only ordered on brokers that route shared messages by topic hash
+# (EMQX: shared_subscription_strategy = hash_topic), so it has to be asked
+# for explicitly.
+
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+
+from app.config import (
+    INGEST_SHARD_OFFSET,
+    INGEST_SHARD_ROUTING,
+    INGEST_SHARD_TOTAL,
+    INGEST_SHARD_WORKERS,
+    INGEST_SHARE_GROUP,
+)
+from app.logs import setup_logging
+
+log = logging.getLogger(__name__)
+
+ROUTINGS = ("partition", "broker_hash")
+RESTART_BACKOFF_MAX_S = 30.0
+# A worker that stayed up this long has its restart backoff reset.
+STABLE_AFTER_S = 60.0
+
+
+def client_id_for(group: str, index: int) -> str:
+    # Stable across restarts, so a restarted worker takes over its old
+    # broker session instead of leaving a ghost member in the group.
+    return f"{group}-{socket.gethostname()}-{index}"
+
+
+def _create_tables():
+    import app.db.models  # noqa: F401  (register tables)
+    from app.db.session import Base, engine
+
+    # Workers start together; a CREATE racing another worker's is retried.
+    for attempt in range(3):
+        try:
+            Base.metadata.create_all(bind=engine)
+            return
+        except Exception:
+            if attempt == 2:
+                raise
+            time.sleep(0.2)
+
+
+def run_worker(index: int, group: str, routing: str = "partition", total: int = 1):
+    """
+    Entry point of one ingest process: MQTT -> parse pool -> writer.
+    `index` is the worker's partition out of `total` (partition routing).
+    """
+    from app.db.session import SessionLocal
+    from app.ingest import ingest_writer
+    from app.mqtt import REAL_TOPIC, shared_topic, start_mqtt, uplink_pool
+    from app.profiles import calibration_cache, worker_refresh_s
+    from app.registry import device_registry
+
+    setup_logging()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    _create_tables()
+    with SessionLocal() as db:
+        device_registry.load(db)
+        calibration_cache.load(db)
+    # Profile edits happen in the API process; reload them periodically.
+    calibration_cache.refresh_s = worker_refresh_s()
+
+    ingest_writer.start()
+    uplink_pool.start()
+    client_id = client_id_for(group, index)
+    if routing == "partition":
+        client = start_mqtt(topic=REAL_TOPIC, client_id=client_id, shard=(index, total))
+        log.info("Worker %d takes partition %d of %d", index, index, total,
+                 extra={"worker": index})
+    else:
+        client = start_mqtt(topic=shared_topic(group), client_id=client_id)
+        log.info("Worker %d joined $share/%s", index, group, extra={"worker": index})
+
+    stop.wait()
+
+    client.disconnect()
+    client.loop_stop()
+    uplink_pool.stop()
+    ingest_writer.stop()
+    log.info("Worker %d stopped", index, extra={"worker": index})
+
+
+class _Slot:
+    __slots__ = ("index", "process", "started", "failures", "restart_at")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: multiprocessing.Process | None = None
+        self.started = 0.0
+        self.failures = 0
+        self.restart_at = 0.0
+
+
+class IngestSupervisor:
+    """
+    Starts `workers` ingest processes and restarts any that exit, with
+    exponential backoff (1 s doubling to 30 s) for workers that keep
+    crashing. stop() sends SIGTERM so each worker drains its queues.
+    Workers are numbered offset .. offset + workers - 1 out of `total`.
+    """
+
+    def __init__(
+        self,
+        workers: int = INGEST_SHARD_WORKERS,
+        group: str = INGEST_SHARE_GROUP,
+        routing: str = INGEST_SHARD_ROUTING,
+        total: int = INGEST_SHARD_TOTAL,
+        offset: int = INGEST_SHARD_OFFSET,
+    ):
+        if routing not in ROUTINGS:
+            raise ValueError(f"routing must be one of {ROUTINGS}, got {routing!r}")
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.total = total if total > 0 else self.workers
+        if offset < 0 or offset + self.workers > self.total:
+            raise ValueError(
+                f"workers {offset}..{offset + self.workers - 1} do not fit in total {self.total}"
+            )
+        self.group = group
+        self.routing = routing
+        self.slots = [_Slot(offset + i) for i in range(self.workers)]
+        self.restarts = 0
+        self._ctx = multiprocessing.get_context("spawn")
+        self._stopping = threading.Event()
+
+    def _spawn(self, slot: _Slot):
+        slot.process = self._ctx.Process(
+            target=run_worker,
+            args=(slot.index, self.group, self.routing, self.total),
+            name=f"ingest-shard-{slot.index}",
+        )
+        slot.process.start()
+        slot.started = time.monotonic()
+
+    def start(self):
+        for slot in self.slots:
+            self._spawn(slot)
+        log.info(
+            "Started %d ingest workers in group %s (%s routing, %d in total)",
+            self.workers, self.group, self.routing, self.total,
+        )
+
+    def check(self):
+        """Restart exited workers whose backoff has elapsed."""
+        now = time.monotonic()
+        for slot in self.slots:
+            proc = slot.process
+            if proc is not None and proc.is_alive():
+                continue
+            if proc is not None:
+                if now - slot.started >= STABLE_AFTER_S:
+                    slot.failures = 0
+                delay = min(RESTART_BACKOFF_MAX_S, 2.0 ** slot.failures)
+                slot.failures += 1
+                slot.restart_at = now + delay
+                slot.process = None
+                log.warning(
+                    "Worker %d exited code=%s, restarting in %.0fs",
+                    slot.index, proc.exitcode, delay,
+                    extra={"worker": slot.index, "exitcode": proc.exitcode},
+                )
+            if now >= slot.restart_at:
+                self._spawn(slot)
+                self.restarts += 1
+
+    def run(self, poll_s: float = 0.5):
+        while not self._stopping.wait(poll_s):
+            self.check()
+
+    def stop(self, timeout: float = 15.0):
+        self._stopping.set()
+        procs = [s.process for s in self.slots if s.process is not None]
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        deadline = time.monotonic() + timeout
+        for p in procs:
+            p.join(max(0.0, deadline - time.monotonic()))
+            if p.is_alive():
+                p.kill()
+                p.join()
+        log.info("All workers stopped")
+
+    def pids(self) -> list[int | None]:
+        return [s.process.pid if s.process else None for s in self.slots]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run sharded MQTT ingest workers")
+    parser.add_argument("--workers", type=int, default=INGEST_SHARD_WORKERS,
+                        help="processes to run (0 = one per core)")
+    parser.add_argument("--group", default=INGEST_SHARE_GROUP,
+                        help="client ID prefix and shared subscription group")
+    parser.add_argument("--routing", default=INGEST_SHARD_ROUTING, choices=ROUTINGS,
+                        help="broker_hash only on brokers that route shared messages by topic")
+    parser.add_argument("--total", type=int, default=INGEST_SHARD_TOTAL,
+                        help="workers on all hosts (0 = --workers)")
+    parser.add_argument("--offset", type=int, default=INGEST_SHARD_OFFSET,
+                        help="index of this host's first worker")
+    args = parser.parse_args()
+
+    setup_logging()
+    try:
+        supervisor = IngestSupervisor(
+            args.workers, args.group, args.routing, args.total, args.offset
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    signal.signal(signal.SIGTERM, lambda *_: supervisor._stopping.set())
+    supervisor.start()
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        pass
+    supervisor.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+# Jakob Balkovec
+# logs.py
+# Structured logging: JSON records written by a background thread
+#
+# Call sites use plain `logging.getLogger(__name__)`. setup_logging()
+# puts a non-blocking queue handler on the root logger; one listener
+# thread formats and writes, so a slow stdout (pipe, container log
+# driver) never stalls ingest. When the queue is full, records are
+# dropped and counted rather than waited on.
+#
+# Per-message events (one per uplink or batch) go through event_logger(),
+# which rate-limits each message template.
+
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+from app.config import (
+    LOG_EVENT_BURST,
+    LOG_EVENT_RATE,
+    LOG_FORMAT,
+    LOG_LEVEL,
+    LOG_LEVELS,
+    LOG_QUEUE_SIZE,
+)
+
+# LogRecord attributes that are not user-supplied `extra` fields.
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, extra fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+            .isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+            "pid": record.process,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the logging thread; counts what a full queue drops."""
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args now, since they may change after the call returns;
+        # JSON encoding and the write happen on the listener thread.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimiter:
+    """
+    Token bucket per key: up to `burst` at once, then `rate` per second.
+    allow() returns (allowed, suppressed since the last allowed call).
+    """
+
+    def __init__(self, rate: float = LOG_EVENT_RATE, burst: int = LOG_EVENT_BURST):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._buckets: dict = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key) -> tuple[bool, int]:
+        if self.rate <= 0:
+            return True, 0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                # tokens, last refill, suppressed since last allowed
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False, 0
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+        return True, suppressed
+
+
+class EventLogger:
+    """
+    Logger for per-message events, rate-limited per message template.
+
+    The level check and the rate limit run before a LogRecord is built,
+    so a disabled or suppressed event costs well under a microsecond.
+    The first record let through after a suppression carries
+    `suppressed=<n>`.
+    """
+
+    def __init__(self, logger: logging.Logger, limiter: RateLimiter):
+        self.logger = logger
+        self.limiter = limiter
+
+    def _log(self, level: int, msg: str, args, exc_info=None, extra=None):
+        if not self.logger.isEnabledFor(level):
+            return
+        allowed, suppressed = self.limiter.allow(msg)
+        if not allowed:
+            return
+        if suppressed:
+            extra = {**(extra or {}), "suppressed": suppressed}
+        # stacklevel=3 skips this method and the level method, so the record
+        # points at the code that logged the event.
+        self.logger.log(level, msg, *args, exc_info=exc_info, extra=extra, stacklevel=3)
+
+    def debug(self, msg, *args, **kwargs):
+        self._log(logging.DEBUG, msg, args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self._log(logging.INFO, msg, args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self._log(logging.WARNING, msg, args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self._log(logging.ERROR, msg, args, **kwargs)
+
+    def exception(self, msg, *args, **kwargs):
+        self._log(logging.ERROR, msg, args, exc_info=True, **kwargs)
+
+
+def event_logger(name: str) -> EventLogger:
+    """
+    `<name>.events`, rate-limited per message template (LOG_EVENT_RATE,
+    LOG_EVENT_BURST). Its level can be set on its own in LOG_LEVELS.
+    """
+    return EventLogger(logging.getLogger(f"{name}.events"), RateLimiter())
+
+
+_handler: _DroppingQueueHandler | None = None
+_listener: logging.handlers.QueueListener | None = None
+
+
+def setup_logging(
+    level: str = LOG_LEVEL,
+    levels: dict[str, str] = LOG_LEVELS,
+    fmt: str = LOG_FORMAT,
+    stream=None,
+):
+    """
+    Add the queue handler to the root logger. Handlers already on the root
+    logger are left in place. Safe to call twice.
+    """
+    global _handler, _listener
+    if _listener is not None:
+        return
+
+    out = logging.StreamHandler(stream or sys.stdout)
+    if fmt == "json":
+        out.setFormatter(JsonFormatter())
+    else:
+        out.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    # Neither field is in the output; skip collecting them per record.
+    logging.logMultiprocessing = False
+    logging.logAsyncioTasks = False  # Python 3.12+
+
+    _handler = _DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(level.upper())
+    for name, lvl in levels.items():
+        logging.getLogger(name).setLevel(lvl.upper())
+
+    _listener = logging.handlers.QueueListener(_handler.queue, out, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records, stop the writer thread and detach the handler."""
+    global _listener
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def stats() -> dict:
+    return {
+        "queue_depth": _handler.queue.qsize() if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0,
+    }
@@ -8,46 +8,108 @@
 from typing import Optional
 import datetime
 import asyncio
+import logging
+import time
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, APIRouter
-from fastapi.responses import PlainTextResponse
+from fastapi import (
+    FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request, Response,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy import text
 from pydantic import BaseModel
 
 from app.websocket import ws_manager
-from app.db.session import get_db, Base, engine
+from app.db.session import get_db, Base, engine, SessionLocal
+from app.db.async_session import get_async_db
 from app.db.models import SensorReading, DeviceStatus
-from app.routers import auth, devices, readings
+from app.routers import auth, devices, imports, readings
 from app.crud import (
-    get_latest_reading,
-    get_recent_readings,
-    list_all_devices,
+    get_latest_reading_async,
+    get_latest_readings,
     create_device,
     delete_device,
     update_device,
 )
-from app.mqtt import start_mqtt, bind_event_loop, is_mqtt_connected
-from app.config import WS_API_KEY
+from app.mqtt import (
+    start_mqtt,
+    bind_event_loop,
+    is_mqtt_connected,
+    relay_to_websocket,
+    uplink_pool,
+)
+from app.ingest import ingest_writer
+from app.capture import mqtt_capture
+from app.registry import device_registry
+from app.cache import SHARED_WRITER_TTL_S, latest_cache, reading_to_dict
+from app.security import token_verifier
+from app.profiles import calibration_cache, recompute_jobs
+from app.metrics import CONTENT_TYPE, HTTP_SECONDS, registry as metrics_registry
+from app.config import WS_API_KEY, INGEST_MODE
+from app.logs import setup_logging, stats as logging_stats
+
+log = logging.getLogger(__name__)
 
 # Ensure tables exist
 Base.metadata.create_all(bind=engine)
 
+# create_all skips indexes on tables that already exist
+for index in SensorReading.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    setup_logging()
     loop = asyncio.get_event_loop()
     bind_event_loop(loop)
-    mqtt_client = start_mqtt()
+    if token_verifier.secret_key is None:
+        log.warning("SECRET_KEY is not set: backend JWTs are disabled, Google ID tokens only")
+    with SessionLocal() as db:
+        device_registry.load(db)
+        calibration_cache.load(db)
+        latest_cache.warm(reading_to_dict(r) for r in get_latest_readings(db))
+    if INGEST_MODE == "sharded":
+        # app.ingest_workers persists; this process only feeds the dashboards
+        # and its latest-reading cache.
+        uplink_pool.sink = relay_to_websocket
+        if not latest_cache.ttl_s:
+            latest_cache.ttl_s = SHARED_WRITER_TTL_S
+    else:
+        ingest_writer.start()
+    uplink_pool.start()
+    recompute_jobs.start()
+    if mqtt_capture:
+        mqtt_capture.start()
+    mqtt_client = start_mqtt(capture=mqtt_capture)
     yield
     mqtt_client.loop_stop()
+    if mqtt_capture:
+        mqtt_capture.stop()
+    uplink_pool.stop()
+    ingest_writer.stop()
+    recompute_jobs.stop()
 
 app = FastAPI(lifespan=lifespan)
 
 app.include_router(auth.router)
 app.include_router(devices.router)
 app.include_router(readings.router)
+app.include_router(imports.router)
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    # Streaming responses (CSV export) are timed to their first byte.
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_SECONDS.labels(
+        request.method,
+        route.path if route is not None else "unmatched",
+        response.status_code,
+    ).observe(time.perf_counter() - start)
+    return response
 
 # Pydantic model for device creation/update
 class DeviceCreate(BaseModel):
@@ -60,24 +122,32 @@ class DeviceCreate(BaseModel):
     notes: Optional[str] = None
 
 
+async def cached_latest_reading(db, dev_eui: str):
+    reading = latest_cache.get(dev_eui)
+    if reading is not None:
+        return reading
+
+    row = await get_latest_reading_async(db, dev_eui)
+    if row is None:
+        return None
+    reading = reading_to_dict(row)
+    latest_cache.put(reading)
+    return reading
+
+
 # ---- Reading Endpoints ----
 
 @app.get("/api/readings/latest/{dev_eui}")
-def api_latest(dev_eui: str, db=Depends(get_db)):
-    reading = get_latest_reading(db, dev_eui)
+async def api_latest(dev_eui: str, db=Depends(get_async_db)):
+    reading = await cached_latest_reading(db, dev_eui)
     return reading or {"error": "No readings for this device"}
 
 
-@app.get("/api/readings/{dev_eui}")
-def api_recent(dev_eui: str, limit: int = 100, db=Depends(get_db)):
-    return get_recent_readings(db, dev_eui, limit)
-
-
 # ---- Device Info ----s
 
 @app.get("/api/devices/{dev_eui}")
-def api_device_info(dev_eui: str, db=Depends(get_db)):
-    latest = get_latest_reading(db, dev_eui)
+async def api_device_info(dev_eui: str, db=Depends(get_async_db)):
+    latest = await cached_latest_reading(db, dev_eui)
     if not latest:
         raise HTTPException(status_code=404, detail="Device not found")
     return {"dev_eui": dev_eui, "latest": latest}
@@ -87,35 +157,30 @@ def api_device_info(dev_eui: str, db=Depends(get_db)):
 @app.websocket("/ws/updates")
 async def websocket_endpoint(websocket: WebSocket):
     raw = websocket.headers.get("sec-websocket-protocol")
-    print("DEBUG: received protocol =", raw)
 
     if not raw:
         await websocket.close(code=4401, reason="Missing protocol")
         return
 
     protocols = [p.strip() for p in raw.split(",")]
-    print("DEBUG: parsed protocols =", protocols)
 
     if WS_API_KEY not in protocols:
-        print("DEBUG: WS_API_KEY not found in protocols")
+        log.debug("WebSocket rejected: API key not among %d subprotocols", len(protocols))
         await websocket.close(code=4403, reason="Invalid protocol")
         return
 
     await websocket.accept(subprotocol=WS_API_KEY)
-    ws_manager.connect(websocket)
-    print("[WS] Connected + Authenticated")
+    ws_manager.register(websocket)
+    log.info("WebSocket connected", extra={"clients": len(ws_manager.clients)})
 
     try:
         while True:
-            try:
-                msg = await websocket.receive_text()
-                print("DEBUG: received msg:", msg)
-            except Exception:
-                await asyncio.sleep(10)
-
+            msg = await websocket.receive_text()
+            ws_manager.handle_message(websocket, msg)
     except WebSocketDisconnect:
+        pass
+    finally:
         ws_manager.disconnect(websocket)
-        print("[WS] Disconnected")
 
 
 # ---- Health & Status ----
@@ -126,55 +191,120 @@ def health():
 
 
 @app.get("/system/status")
-def system_status(db=Depends(get_db)):
+async def system_status(db=Depends(get_async_db)):
     status_report = {
         "api": "online",
         "database": "unknown",
         "mqtt": "connected" if is_mqtt_connected() else "disconnected",
-        "websocket_connections": len(ws_manager.active_connections),
+        "websocket_connections": len(ws_manager.clients),
+        "websocket": ws_manager.stats(),
+        "latest_cache": latest_cache.stats(),
+        "auth_cache": token_verifier.cache.stats(),
+        "logging": logging_stats(),
+        "capture": mqtt_capture.stats() if mqtt_capture else None,
+        "ingest": {
+            "mode": INGEST_MODE,
+            "parse": uplink_pool.stats(),
+            "writer": ingest_writer.stats(),
+        },
     }
 
     try:
-        db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 1"))
         status_report["database"] = "connected"
     except Exception as e:
         status_report["database"] = f"error: {str(e)}"
 
     return status_report
 
-# ---- Export CSV -----
-
-export_router = APIRouter()
 
-@export_router.get("/export/{dev_eui}")
-def export_csv(dev_eui: str, limit: int = 1000, db=Depends(get_db)):
-    rows = get_recent_readings(db, dev_eui, limit)
+def _cache_samples():
+    samples = []
+    for name, stats in (("latest", latest_cache.stats()), ("auth", token_verifier.cache.stats())):
+        samples.append(({"cache": name, "result": "hit"}, stats["hits"]))
+        samples.append(({"cache": name, "result": "miss"}, stats["misses"]))
+    return samples
 
-    if not rows:
-        raise HTTPException(status_code=404, detail="No readings found")
 
-    csv_lines = ["timestamp,moisture_pct,raw_value"]
-    for r in rows:
-        ts = r.timestamp.isoformat() if hasattr(r, "timestamp") else r["timestamp"]
-        moisture = r.moisture_pct if hasattr(r, "moisture_pct") else r["moisture_pct"]
-        raw = r.raw_value if hasattr(r, "raw_value") else r["raw_value"]
-        csv_lines.append(f"{ts},{moisture},{raw}")
-
-    csv_string = "\n".join(csv_lines)
+metrics_registry.callback(
+    "mdr_ingest_queue_depth", "gauge", "Items waiting in the ingest queues",
+    lambda: [
+        ({"queue": "parse"}, uplink_pool.depth()),
+        ({"queue": "writer"}, ingest_writer.depth()),
+    ],
+)
+metrics_registry.callback(
+    "mdr_ingest_overflowed", "counter", "Raw uplinks discarded by the parse queue overflow policy",
+    lambda: uplink_pool.overflowed,
+)
+metrics_registry.callback(
+    "mdr_ingest_readings", "counter", "Readings handled by the batch writer, by outcome",
+    lambda: [
+        ({"result": "stored"}, ingest_writer.stored),
+        ({"result": "dropped"}, ingest_writer.dropped),
+        ({"result": "undecodable"}, ingest_writer.undecodable),
+    ],
+)
+metrics_registry.callback(
+    "mdr_ingest_flush_retries", "counter", "Batch commits retried after an error",
+    lambda: ingest_writer.retries,
+)
+metrics_registry.callback(
+    "mdr_mqtt_capture_records", "counter", "Raw uplinks captured to MQTT_CAPTURE_PATH, by outcome",
+    lambda: [
+        ({"result": "written"}, mqtt_capture.records if mqtt_capture else 0),
+        ({"result": "dropped"}, mqtt_capture.dropped if mqtt_capture else 0),
+    ],
+)
+metrics_registry.callback(
+    "mdr_mqtt_connected", "gauge", "1 while the MQTT client is connected",
+    lambda: int(is_mqtt_connected()),
+)
+metrics_registry.callback(
+    "mdr_ws_connections", "gauge", "Open WebSocket connections", lambda: len(ws_manager.clients)
+)
+metrics_registry.callback(
+    "mdr_ws_queue_depth", "gauge", "Frames queued across all WebSocket clients",
+    lambda: sum(c.queue.qsize() for c in ws_manager.clients.values()),
+)
+metrics_registry.callback(
+    "mdr_ws_frames", "counter", "WebSocket frames by outcome",
+    lambda: [
+        ({"result": "encoded"}, ws_manager.frames_encoded),
+        ({"result": "sent"}, ws_manager.messages_sent),
+        ({"result": "dropped"}, ws_manager.messages_dropped),
+    ],
+)
+metrics_registry.callback(
+    "mdr_ws_clients_evicted", "counter", "Slow WebSocket clients disconnected",
+    lambda: ws_manager.clients_evicted,
+)
+metrics_registry.callback(
+    "mdr_log_records_dropped", "counter", "Log records discarded because the log queue was full",
+    lambda: logging_stats()["dropped"],
+)
+metrics_registry.callback(
+    "mdr_cache_requests", "counter", "Cache lookups by cache and result", _cache_samples
+)
+metrics_registry.callback(
+    "mdr_cache_entries", "gauge", "Entries held per cache",
+    lambda: [
+        ({"cache": "latest"}, latest_cache.stats()["entries"]),
+        ({"cache": "auth"}, token_verifier.cache.stats()["size"]),
+    ],
+)
 
-    return PlainTextResponse(
-        content=csv_string,
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename={dev_eui}_readings.csv"}
-    )
 
-app.include_router(export_router, prefix="/api")
+@app.get("/metrics")
+def metrics():
+    return Response(metrics_registry.render(), media_type=CONTENT_TYPE)
 
 # ---- Device CRUD Routes ----
 
 @app.post("/api/device")
 def api_add_device(payload: DeviceCreate, db=Depends(get_db)):
-    dev = create_device(db, payload.model_dump(exclude_unset=True))
+    dev = create_device(db, payload)
+    device_registry.put(dev)
     return {"message": "Device added", "dev_eui": dev.dev_eui}
 
 @app.patch("/api/device/{dev_eui}")
@@ -182,6 +312,7 @@ def api_update_device(dev_eui: str, payload: DeviceCreate, db=Depends(get_db)):
     dev = update_device(db, dev_eui, payload.dict(exclude_unset=True))
     if not dev:
         raise HTTPException(status_code=404, detail="Device not found")
+    device_registry.put(dev)
     return {"message": "Device updated"}
 
 
@@ -190,9 +321,6 @@ def api_delete_device(dev_eui: str, db=Depends(get_db)):
     ok = delete_device(db, dev_eui)
     if not ok:
         raise HTTPException(status_code=404, detail="Device not found")
+    device_registry.remove(dev_eui)
+    latest_cache.invalidate(dev_eui)
     return {"message": "Device removed"}
-
-
-@app.get("/api/devices")
-def api_list_devices(db=Depends(get_db)):
-    return list_all_devices(db)
@@ -0,0 +1,290 @@
+# Jakob Balkovec
+# metrics.py
+# In-process counters/histograms, rendered in Prometheus text format
+#
+# Recording is per thread: each thread increments its own cell, so the
+# hot path takes no lock and never contends with other threads. A scrape
+# sums the cells. Values from the owning thread may be one increment
+# behind at scrape time, which Prometheus tolerates.
+
+import itertools
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; DB commits and HTTP handlers.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Seconds; device timestamps have 1 s resolution.
+E2E_BUCKETS = (0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+# Seconds; enqueueing one reading for every subscriber.
+FANOUT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005, 0.01)
+
+
+class _Owner:
+    # Lives in one thread's local storage; collected when the thread ends.
+    __slots__ = ("__weakref__",)
+
+
+class _Cells:
+    """
+    One value array per thread; the owning thread is its only writer.
+    When a thread ends its values are folded into a retired total, so
+    threadpool churn does not grow the set of cells a scrape sums.
+    """
+
+    __slots__ = ("size", "_local", "_live", "_retired", "_ids", "_lock")
+
+    def __init__(self, size: int):
+        self.size = size
+        self._local = threading.local()
+        self._live: dict[int, list[float]] = {}
+        self._retired = [0.0] * size
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def mine(self) -> list[float]:
+        try:
+            return self._local.cell
+        except AttributeError:
+            return self._register()
+
+    def _register(self) -> list[float]:
+        cell = [0.0] * self.size
+        key = next(self._ids)
+        owner = _Owner()
+        with self._lock:
+            self._live[key] = cell
+        self._local.cell = cell
+        self._local.owner = owner
+        weakref.finalize(owner, self._retire, key)
+        return cell
+
+    def _retire(self, key: int):
+        with self._lock:
+            cell = self._live.pop(key, None)
+            if cell is not None:
+                for i, v in enumerate(cell):
+                    self._retired[i] += v
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def total(self) -> list[float]:
+        with self._lock:
+            cells = [self._retired, *self._live.values()]
+            return [sum(c[i] for c in cells) for i in range(self.size)]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._children: dict[tuple[str, ...], _Metric] = {}
+        self._lock = threading.Lock()
+        self._cells = self._new_cells()
+
+    def _new_cells(self) -> _Cells:
+        raise NotImplementedError
+
+    def labels(self, *values) -> "_Metric":
+        """Child for one label combination; keep it around on hot paths."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._child())
+        return child
+
+    def _child(self) -> "_Metric":
+        return type(self)(self.name, self.help)
+
+    def series(self):
+        """(label dict, child) for every combination recorded so far."""
+        if not self.labelnames:
+            return [({}, self)]
+        with self._lock:
+            items = list(self._children.items())
+        return [(dict(zip(self.labelnames, key)), child) for key, child in items]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_cells(self) -> _Cells:
+        return _Cells(1)
+
+    def inc(self, n: float = 1):
+        self._cells.mine()[0] += n
+
+    def value(self) -> float:
+        return self._cells.total()[0]
+
+    def samples(self, labels: dict):
+        yield self.name + "_total", labels, self.value()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _child(self) -> "Histogram":
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def _new_cells(self) -> _Cells:
+        # One slot per bucket, then +Inf, then the running sum.
+        return _Cells(len(self.buckets) + 2)
+
+    def observe(self, value: float):
+        cell = self._cells.mine()
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+    def samples(self, labels: dict):
+        totals = self._cells.total()
+        cumulative = 0.0
+        for bound, n in zip(self.buckets + (float("inf"),), totals):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else _fmt(bound)
+            yield self.name + "_bucket", {**labels, "le": le}, cumulative
+        yield self.name + "_sum", labels, totals[-1]
+        yield self.name + "_count", labels, cumulative
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class _Callback:
+    """Read at scrape time from existing stats (queue depths, caches)."""
+
+    def __init__(self, name: str, kind: str, help: str, fn):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.fn = fn
+
+    def collect(self):
+        value = self.fn()
+        pairs = value if isinstance(value, list) else [({}, value)]
+        suffix = "_total" if self.kind == "counter" else ""
+        for labels, v in pairs:
+            if v is not None:
+                yield self.name + suffix, labels, v
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, kind: str, help: str, fn):
+        """
+        `fn()` returns a number, or a list of (label dict, number).
+        Replaces an earlier callback of the same name.
+        """
+        self._metrics[name] = _Callback(name, kind, help, fn)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            family = metric.name + ("_total" if metric.kind == "counter" else "")
+            lines.append(f"# HELP {family} {metric.help}")
+            lines.append(f"# TYPE {family} {metric.kind}")
+            if isinstance(metric, _Callback):
+                samples = metric.collect()
+            else:
+                samples = (
+                    s for labels, child in metric.series() for s in child.samples(labels)
+                )
+            for name, labels, value in samples:
+                lines.append(f"{name}{_labels(labels)} {_fmt(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _fmt(value: float) -> str:
+    value = float(value)
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = (f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return "{" + ",".join(pairs) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+
+# ---- MQTT / parsing (app.mqtt) ----
+MQTT_MESSAGES = registry.counter(
+    "mdr_mqtt_messages", "Uplinks by outcome: received, parsed, invalid", ("result",)
+)
+MQTT_READINGS = registry.counter(
+    "mdr_mqtt_readings", "Readings produced by parsed uplinks (packed uplinks carry several)"
+)
+
+# ---- Database (app.crud, app.ingest) ----
+DB_INSERT_SECONDS = registry.histogram(
+    "mdr_db_insert_seconds", "Multi-row sensor_readings insert time"
+)
+DB_INSERT_ROWS = registry.counter("mdr_db_inserted_rows", "Rows inserted into sensor_readings")
+DB_COMMIT_SECONDS = registry.histogram("mdr_db_commit_seconds", "Ingest batch COMMIT time")
+
+# ---- WebSocket (app.websocket) ----
+WS_FANOUT_SECONDS = registry.histogram(
+    "mdr_ws_fanout_seconds",
+    "Time to encode and queue one broadcast (a reading, or a coalescing window)"
+    " for its subscribers",
+    buckets=FANOUT_BUCKETS,
+)
+E2E_SECONDS = registry.histogram(
+    "mdr_ingest_to_ws_seconds",
+    "Reading timestamp to WebSocket fan-out (includes device clock skew)",
+    buckets=E2E_BUCKETS,
+)
+
+# ---- HTTP (app.main middleware) ----
+HTTP_SECONDS = registry.histogram(
+    "mdr_http_request_seconds", "HTTP handler latency", ("method", "route", "status")
+)
@@ -6,134 +6,222 @@
 # FINAL - Reliable MQTT → DB → WS Bridge
 # mqtt.py
 
+import asyncio
+import binascii
 import json
+import logging
+import math
+import struct
 import datetime
-import asyncio
 import paho.mqtt.client as mqtt
 
-from app.crud import store_sensor_reading, create_device_if_missing
-from app.decode import decode_base64_to_decimal
-from app.utils.calibration import convert_to_percentage
-from app.db.session import get_db
+from app.capture import CaptureWriter
+from app.decode import raw_value_in_range
+from app.cache import latest_cache
+from app.ingest import UplinkPool, decode_readings, ingest_writer, partition_for, reading_row
+from app.payloads import decoder_registry, unpack_readings
+from app.metrics import MQTT_MESSAGES, MQTT_READINGS
+from app.logs import event_logger
 from app.websocket import ws_manager
 from app.config import MQTT_BROKER, MQTT_PORT
 
+log = logging.getLogger(__name__)
+events = event_logger(__name__)
+
 mqtt_connected = False
 event_loop = None
 
 REAL_TOPIC = "application/soilmoisture/device/+/rx"
 
+_received = MQTT_MESSAGES.labels("received")
+_parsed = MQTT_MESSAGES.labels("parsed")
+_invalid = MQTT_MESSAGES.labels("invalid")
+
+
+def shared_topic(group: str, topic: str = REAL_TOPIC) -> str:
+    # MQTT 5 / broker-extension shared subscription: each message goes to
+    # one member of the group.
+    return f"$share/{group}/{topic}"
+
+
+def topic_dev_eui(topic: str) -> str | None:
+    # application/<app>/device/<dev_eui>/rx
+    parts = topic.split("/")
+    try:
+        return parts[parts.index("device") + 1]
+    except (ValueError, IndexError):
+        return None
+
+
 def bind_event_loop(loop):
     global event_loop
     event_loop = loop
-    print("[MQTT] Event loop bound.")
+    ingest_writer.bind_event_loop(loop)
+    log.debug("Event loop bound")
 
 
 def on_connect(client, userdata, flags, rc):
     global mqtt_connected
     mqtt_connected = True
 
-    print(f"[MQTT] Connected rc={rc}")
+    topic = userdata["topic"]
+    client.subscribe(topic)
+    log.info("Connected rc=%s, subscribed to %s", rc, topic, extra={"rc": rc, "topic": topic})
+
 
-    client.subscribe(REAL_TOPIC)
-    print(f"[MQTT] SUBSCRIBED: {REAL_TOPIC}")
+def on_disconnect(client, userdata, rc):
+    global mqtt_connected
+    mqtt_connected = False
+    log.warning("Disconnected rc=%s", rc, extra={"rc": rc})
 
 
 def is_mqtt_connected():
     return mqtt_connected
 
 
-def parse_message(payload: str):
+# Latest instant a DateTime column (and datetime itself) can hold.
+MAX_TIMESTAMP = 253402300799  # 9999-12-31T23:59:59Z
+
+
+def uplink_timestamp(value) -> int | None:
+    """Epoch seconds of an uplink (now if absent), or None if unusable."""
+    if value is None or value == 0 or value == "":
+        return int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+    if isinstance(value, bool):
+        return None
+    try:
+        ts = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(ts) or not 0 < ts <= MAX_TIMESTAMP:
+        return None
+    return int(ts)
+
+
+def parse_message(payload: str | bytes, topic: str | None = None):
+    """
+    One uplink -> a parsed reading, a list of readings (packed
+    multi-sample payload, see app.payloads), or None if invalid.
+    """
     try:
         data = json.loads(payload)
     except Exception as e:
-        print("[WARN] Payload not JSON:", payload, e)
+        events.warning("Uplink not JSON: %s", e, extra={"payload": _excerpt(payload)})
+        return None
+    if not isinstance(data, dict):
+        events.warning("Uplink not a JSON object", extra={"payload": _excerpt(payload)})
         return None
 
     dev = data.get("devEUI")
     if not dev:
-        print("[WARN] Missing devEUI:", data)
+        events.warning("Uplink without devEUI", extra={"payload": _excerpt(payload)})
         return None
 
-    if "raw_value" in data and isinstance(data["raw_value"], int):
-        raw = data["raw_value"]
-    else:
-        b64val = data.get("data")
-        if not b64val:
-            print("[WARN] No raw_value or data field:", data)
-            return None
-        try:
-            raw = decode_base64_to_decimal(b64val)
-        except Exception as e:
-            print("[WARN] Base64 decode failed:", b64val, e)
-            return None
-
-    pct = convert_to_percentage(raw)
-    ts = int(data.get("timestamp") or datetime.datetime.now(datetime.timezone.utc).timestamp())
-
-    return {
-        "dev_eui": dev,
-        "timestamp": ts,
-        "raw_value": raw,
-        "moisture_pct": pct,
-    }
-
-def save_and_broadcast(msg):
-    db = next(get_db())
-
-    from app.crud import ensure_device
-
-    ensure_device(
-        db=db,
-        dev_eui=msg["dev_eui"],
-    )
+    ts = uplink_timestamp(data.get("timestamp"))
+    if ts is None:
+        events.warning("Bad uplink timestamp %r", data.get("timestamp"), extra={"dev_eui": dev})
+        return None
+    msg = {"dev_eui": dev, "timestamp": ts}
 
-    ts_dt = datetime.datetime.fromtimestamp(
-        msg["timestamp"], tz=datetime.timezone.utc
-    )
+    # Decoding and calibration happen per batch (ingest.decode_readings).
+    raw = data.get("raw_value")
+    if isinstance(raw, int) and not isinstance(raw, bool):
+        if not raw_value_in_range(raw):
+            events.warning("raw_value %d out of range", raw, extra={"dev_eui": dev})
+            return None
+        msg["raw_value"] = raw
+        return msg
 
-    store_sensor_reading(
-        db=db,
-        dev_eui=msg["dev_eui"],
-        timestamp=ts_dt,
-        latitude=None,
-        longitude=None,
-        raw_value=msg["raw_value"],
-        moisture_pct=msg["moisture_pct"],
-    )
-    db.close()
+    b64val = data.get("data")
+    if not b64val or not isinstance(b64val, str):
+        events.warning("Uplink without raw_value or data", extra={"dev_eui": dev})
+        return None
 
-    if event_loop and event_loop.is_running():
-        asyncio.run_coroutine_threadsafe(ws_manager.broadcast(msg), event_loop)
+    layout = decoder_registry.resolve(topic, data.get("applicationName"))
+    if layout is None:
+        msg["payload"] = b64val
+        return msg
+    try:
+        readings = unpack_readings(layout, dev, b64val, ts)
+    except (ValueError, struct.error, binascii.Error) as e:
+        events.warning(
+            "Bad %s payload: %s", layout.name, e, extra={"dev_eui": dev, "layout": layout.name}
+        )
+        return None
+    kept = [r for r in readings if raw_value_in_range(r["raw_value"])]
+    if len(kept) < len(readings):
+        events.warning(
+            "%d of %d %s samples out of range", len(readings) - len(kept), len(readings),
+            layout.name, extra={"dev_eui": dev, "layout": layout.name},
+        )
+    return kept or None
+
+
+def _excerpt(payload, limit: int = 200) -> str:
+    if isinstance(payload, (bytes, bytearray)):
+        payload = payload[:limit].decode("utf-8", "replace")
+    return str(payload)[:limit]
+
+
+def parse_uplink(item: tuple[str, bytes]):
+    topic, payload = item
+    msg = parse_message(payload, topic)
+    if msg is None:
+        _invalid.inc()
     else:
-        print("[WS FALLBACK] Loop not ready, skipping broadcast")
-
-    print(
-        f"[OK] {msg['dev_eui']} stored+sent raw={msg['raw_value']} pct={msg['moisture_pct']:.2f}"
-    )
+        _parsed.inc()
+        MQTT_READINGS.inc(len(msg) if isinstance(msg, list) else 1)
+    return msg
 
 
+# Runs on paho's network thread: hand the raw bytes off and return.
 def on_message(client, userdata, msg):
-    payload = msg.payload.decode("utf-8")
-    topic = msg.topic
-
-    print(f"[MQTT] RX TOPIC={topic}")
-
-    db = next(get_db())
-
-    parsed = parse_message(payload)
-    if parsed:
-        create_device_if_missing(db, parsed["dev_eui"])
-        save_and_broadcast(parsed)
-
-    db.close()
-
-def start_mqtt():
-    print("[MQTT] Init client...")
-    client = mqtt.Client()
+    shard = userdata.get("shard")
+    dev = topic_dev_eui(msg.topic)
+    if shard is not None and partition_for(dev, shard[1]) != shard[0]:
+        return  # another worker's device
+    _received.inc()
+    capture = userdata.get("capture")
+    if capture is not None:
+        capture.record(msg.topic, msg.payload)
+    userdata["pool"].submit((msg.topic, msg.payload), dev)
+
+
+def relay_to_websocket(msg: dict | list[dict]):
+    # INGEST_MODE=sharded: ingest workers persist, the API only relays.
+    # It still sees every uplink, so it keeps its latest-reading cache
+    # current the same way the local writer does.
+    readings = decode_readings(msg if isinstance(msg, list) else [msg])
+    latest_cache.update_many(reading_row(r) for r in readings)
+    if event_loop and event_loop.is_running():
+        for reading in readings:
+            asyncio.run_coroutine_threadsafe(ws_manager.broadcast(reading), event_loop)
+
+
+uplink_pool = UplinkPool(parse_uplink, ingest_writer.submit)
+
+
+def start_mqtt(
+    topic: str = REAL_TOPIC,
+    client_id: str = "",
+    pool: UplinkPool | None = None,
+    capture: CaptureWriter | None = None,
+    shard: tuple[int, int] | None = None,
+):
+    """
+    Connect and subscribe to `topic`. With `shard` = (index, count), only
+    uplinks whose dev_eui falls in partition `index` of `count` are kept.
+    """
+    client = mqtt.Client(
+        client_id=client_id,
+        userdata={
+            "topic": topic, "pool": pool or uplink_pool, "capture": capture, "shard": shard,
+        },
+    )
     client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
     client.on_message = on_message
     client.connect(MQTT_BROKER, MQTT_PORT, 60)
     client.loop_start()
-    print("[MQTT] MQTT listening...")
+    log.info("Connecting to %s:%s as %r", MQTT_BROKER, MQTT_PORT, client_id)
     return client
@@ -0,0 +1,146 @@
+# Jakob Balkovec
+# payloads.py
+# Uplink payload decoders, selected per application or topic
+#
+# Single-value firmware sends one big-endian integer per uplink; those
+# payloads stay base64 and are decoded per batch (decode.decode_batch).
+# Packed firmware sends several samples per uplink to save airtime:
+#
+#   header  count (u8), interval_s (u16)       big-endian
+#   samples count x raw value (u16 or u32)     oldest first
+#
+# The newest sample is taken at the uplink timestamp, earlier ones
+# `interval_s` apart before it.
+
+import binascii
+import struct
+
+from app.config import PAYLOAD_DECODERS
+
+
+class PackedLayout:
+    """A precompiled packed-uplink layout: header + fixed-size samples."""
+
+    def __init__(self, name: str, sample_fmt: str, header_fmt: str = ">BH"):
+        self.name = name
+        self.header = struct.Struct(header_fmt)
+        self.sample = struct.Struct(sample_fmt)
+
+    def unpack(self, data, timestamp: int) -> list[tuple[int, int]]:
+        """
+        (timestamp, raw_value) per sample. `data` is any buffer; samples
+        are read through a memoryview slice, so the payload is never copied.
+        """
+        view = memoryview(data)
+        count, interval = self.header.unpack_from(view)
+        body = view[self.header.size:]
+        if count == 0 or len(body) != count * self.sample.size:
+            raise ValueError(
+                f"{self.name}: header says {count} samples, body has {len(body)} bytes"
+            )
+        first = timestamp - (count - 1) * interval
+        return [
+            (first + i * interval, value)
+            for i, (value,) in enumerate(self.sample.iter_unpack(body))
+        ]
+
+    def pack(self, values: list[int], interval: int) -> bytes:
+        """Firmware-side encoding; used by tests and simulators."""
+        out = bytearray(self.header.size + len(values) * self.sample.size)
+        self.header.pack_into(out, 0, len(values), interval)
+        for i, v in enumerate(values):
+            self.sample.pack_into(out, self.header.size + i * self.sample.size, v)
+        return bytes(out)
+
+
+LAYOUTS = {
+    layout.name: layout
+    for layout in (
+        PackedLayout("packed_u16", ">H"),
+        PackedLayout("packed_u32", ">I"),
+    )
+}
+
+
+def topic_application(topic: str | None) -> str | None:
+    # application/<app>/device/<dev_eui>/rx
+    parts = topic.split("/") if topic else []
+    if len(parts) > 1 and parts[0] == "application":
+        return parts[1]
+    return None
+
+
+def _topic_matches(filt: str, topic: str) -> bool:
+    f, t = filt.split("/"), topic.split("/")
+    for i, part in enumerate(f):
+        if part == "#":
+            return True
+        if i >= len(t) or (part != "+" and part != t[i]):
+            return False
+    return len(f) == len(t)
+
+
+class DecoderRegistry:
+    """
+    Maps uplinks to a PackedLayout, or None for single-value payloads.
+
+    Keys are application names (ChirpStack `applicationName`, or the
+    <app> segment of the topic) or MQTT topic filters (anything with a
+    "/", wildcards allowed). Application names win over topic filters.
+    Topic lookups are memoized, so steady-state resolution is one dict
+    lookup per uplink.
+    """
+
+    def __init__(self, config: dict[str, str] | None = None):
+        self._by_app: dict[str, PackedLayout] = {}
+        self._by_filter: list[tuple[str, PackedLayout]] = []
+        self._topic_cache: dict[str, PackedLayout | None] = {}
+        for key, layout in (config or {}).items():
+            self.register(key, layout)
+
+    def register(self, key: str, layout: str | PackedLayout):
+        if isinstance(layout, str):
+            if layout not in LAYOUTS:
+                raise ValueError(f"Unknown payload layout {layout!r}; known: {sorted(LAYOUTS)}")
+            layout = LAYOUTS[layout]
+        if "/" in key:
+            self._by_filter.append((key, layout))
+        else:
+            self._by_app[key] = layout
+        self._topic_cache.clear()
+
+    def __len__(self) -> int:
+        return len(self._by_app) + len(self._by_filter)
+
+    def resolve(
+        self, topic: str | None = None, application: str | None = None
+    ) -> PackedLayout | None:
+        if not self:
+            return None
+        layout = self._by_app.get(application) if application else None
+        if layout is not None or not topic:
+            return layout
+
+        try:
+            return self._topic_cache[topic]
+        except KeyError:
+            pass
+        layout = self._by_app.get(topic_application(topic))
+        if layout is None:
+            layout = next(
+                (lay for filt, lay in self._by_filter if _topic_matches(filt, topic)), None
+            )
+        self._topic_cache[topic] = layout
+        return layout
+
+
+def unpack_readings(layout: PackedLayout, dev_eui: str, b64: str, timestamp: int) -> list[dict]:
+    """One packed uplink -> parsed readings with int raw values."""
+    data = binascii.a2b_base64(b64)
+    return [
+        {"dev_eui": dev_eui, "timestamp": ts, "raw_value": raw}
+        for ts, raw in layout.unpack(data, timestamp)
+    ]
+
+
+decoder_registry = DecoderRegistry(PAYLOAD_DECODERS)
@@ -0,0 +1,241 @@
+# Jakob Balkovec
+# profiles.py
+# Per-device calibration profiles: in-memory cache and historical recompute
+
+import datetime
+import itertools
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import func, select
+
+from app.cache import latest_cache
+from app.config import CALIBRATION_REFRESH_S, DRY_VALUE, RECOMPUTE_CHUNK_SIZE, WET_VALUE
+from app.crud import device_calibrations, update_moisture_pct
+from app.db.models import SensorReading
+from app.db.session import SessionLocal
+from app.rollups import backfill_rollups
+from app.utils.calibration import convert_to_percentage_array
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+# Profile reload interval of separate ingest processes when
+# CALIBRATION_REFRESH_S is 0 (auto).
+WORKER_REFRESH_S = 30.0
+
+
+def worker_refresh_s() -> float:
+    return CALIBRATION_REFRESH_S if CALIBRATION_REFRESH_S > 0 else WORKER_REFRESH_S
+
+
+class CalibrationCache:
+    """
+    dev_eui -> (dry, wet) for every device with a calibration profile.
+
+    Loaded at startup and reloaded by the calibration routes, so ingest
+    resolves a device's calibration with a dict lookup. Devices without a
+    profile use DRY_VALUE / WET_VALUE. Ingest processes that never see the
+    API's edits (app.ingest_workers) set `refresh_s` to reload on a timer.
+    """
+
+    def __init__(self, refresh_s: float = CALIBRATION_REFRESH_S):
+        self.refresh_s = refresh_s
+        self._bounds: dict[str, tuple[int, int]] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def load(self, db):
+        bounds = device_calibrations(db)
+        with self._lock:
+            self._bounds = bounds
+            self._loaded_at = time.monotonic()
+
+    def maybe_refresh(self):
+        if self.refresh_s <= 0 or time.monotonic() - self._loaded_at < self.refresh_s:
+            return
+        with SessionLocal() as db:
+            self.load(db)
+
+    def __len__(self) -> int:
+        return len(self._bounds)
+
+    def get(self, dev_eui: str) -> tuple[int, int]:
+        return self._bounds.get(dev_eui, (DRY_VALUE, WET_VALUE))
+
+    def bounds(self, dev_euis: list[str]):
+        """Per-reading (dry, wet) arrays, or (None, None) if all use the defaults."""
+        table = self._bounds
+        if not table or not any(e in table for e in dev_euis):
+            return None, None
+        pairs = np.array(
+            [table.get(e, (DRY_VALUE, WET_VALUE)) for e in dev_euis], dtype=np.int64
+        )
+        return pairs[:, 0], pairs[:, 1]
+
+
+def recompute_moisture(
+    db, dev_eui: str, chunk_size: int = RECOMPUTE_CHUNK_SIZE, progress=None
+) -> int:
+    """
+    Rewrite moisture_pct of a device's stored readings from raw_value with
+    its current calibration. Keyset chunks over id, one short transaction
+    each, so ingest is never blocked for more than one chunk. The scan
+    runs to the end of the table, so rows ingest wrote with the old
+    calibration while the job was starting are covered too.
+    """
+    dry, wet = calibration_cache.get(dev_eui)
+    stmt = (
+        select(SensorReading.id, SensorReading.raw_value)
+        .where(SensorReading.dev_eui == dev_eui)
+        .order_by(SensorReading.id)
+        .limit(chunk_size)
+    )
+
+    total, last_id = 0, 0
+    while True:
+        chunk = db.execute(stmt.where(SensorReading.id > last_id)).all()
+        if not chunk:
+            break
+        ids = [r.id for r in chunk]
+        pct = convert_to_percentage_array([r.raw_value for r in chunk], dry, wet)
+        update_moisture_pct(
+            db, [{"id": i, "moisture_pct": p} for i, p in zip(ids, pct.tolist())]
+        )
+        db.commit()
+        total += len(chunk)
+        last_id = ids[-1]
+        if progress:
+            progress(len(chunk))
+    return total
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class RecomputeJobs:
+    """
+    One background thread running recompute jobs in submission order.
+
+    A job recomputes moisture_pct for its devices, then rebuilds their
+    rollups. Progress (rows done / rows counted at start, current device
+    and phase) is kept for the last `keep` jobs and served by the API.
+    """
+
+    def __init__(self, chunk_size: int = RECOMPUTE_CHUNK_SIZE, keep: int = 50):
+        self.chunk_size = chunk_size
+        self.keep = keep
+        self.queue: queue.Queue = queue.Queue()
+        self.jobs: dict[int, dict] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="calibration-recompute", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        # Jobs queued before the sentinel still run, up to `timeout`.
+        if not self._thread:
+            return
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, dev_euis, reason: str, settle_s: float = 0.0) -> dict:
+        """
+        Queue a recompute. `settle_s` delays the start, e.g. to let other
+        ingest processes pick up the new calibration first.
+        """
+        job = {
+            "id": next(self._ids),
+            "reason": reason,
+            "dev_euis": sorted(set(dev_euis)),
+            "status": "queued",
+            "phase": None,
+            "device": None,
+            "total": None,
+            "done": 0,
+            "percent": 0.0,
+            "rollup_rows": 0,
+            "submitted_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "_not_before": time.monotonic() + settle_s,
+        }
+        with self._lock:
+            self.jobs[job["id"]] = job
+            for old in sorted(self.jobs)[:-self.keep]:
+                if self.jobs[old]["status"] in ("done", "failed"):
+                    del self.jobs[old]
+        self.queue.put(job)
+        return self.get(job["id"])
+
+    def get(self, job_id: int) -> dict | None:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        return {k: v for k, v in job.items() if not k.startswith("_")}
+
+    def list(self) -> list[dict]:
+        return [self.get(i) for i in sorted(self.jobs, reverse=True)]
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is _STOP:
+                break
+            wait = job["_not_before"] - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self._execute(job)
+                job["status"] = "done"
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = str(e)
+                log.exception("Recompute job %d failed", job["id"])
+            job["finished_at"] = _now()
+
+    def _execute(self, job: dict):
+        job["status"] = "running"
+        job["started_at"] = _now()
+
+        def advance(n: int):
+            job["done"] += n
+            job["total"] = max(job["total"], job["done"])
+            job["percent"] = round(100.0 * job["done"] / job["total"], 1)
+
+        with SessionLocal() as db:
+            job["total"] = db.execute(
+                select(func.count())
+                .select_from(SensorReading)
+                .where(SensorReading.dev_eui.in_(job["dev_euis"]))
+            ).scalar() or 0
+            if job["total"] == 0:
+                job["percent"] = 100.0
+
+            for eui in job["dev_euis"]:
+                job["device"] = eui
+                job["phase"] = "recompute"
+                recompute_moisture(db, eui, self.chunk_size, advance)
+                latest_cache.invalidate(eui)
+
+                job["phase"] = "rollups"
+                job["rollup_rows"] += backfill_rollups(db, eui, self.chunk_size)
+
+        job["device"] = None
+        job["phase"] = None
+        log.info("Recompute job %d rewrote %d readings", job["id"], job["done"])
+
+
+calibration_cache = CalibrationCache()
+recompute_jobs = RecomputeJobs()
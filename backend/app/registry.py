@@ -0,0 +1,81 @@
+# Jakob Balkovec
+# registry.py
+# Process-wide in-memory device registry
+
+import logging
+import threading
+
+from app.db.models import Device
+
+log = logging.getLogger(__name__)
+
+
+def _device_entry(dev: Device) -> dict:
+    return {
+        "dev_eui": dev.dev_eui,
+        "nickname": dev.nickname,
+        "latitude": dev.latitude,
+        "longitude": dev.longitude,
+        "status": dev.status.value if dev.status else "active",
+    }
+
+
+class DeviceRegistry:
+    """
+    Known devices keyed by dev_eui.
+
+    Loaded once at startup and updated by the device CRUD routes, so the
+    ingest path can resolve a known EUI without touching the database.
+    Reads are lock-free dict lookups; writers take a lock.
+    """
+
+    def __init__(self):
+        self._devices: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def load(self, db):
+        devices = {d.dev_eui: _device_entry(d) for d in db.query(Device).all()}
+        with self._lock:
+            self._devices = devices
+        log.info("Loaded %d devices", len(devices))
+
+    def __contains__(self, dev_eui: str) -> bool:
+        return dev_eui in self._devices
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def get(self, dev_eui: str) -> dict | None:
+        return self._devices.get(dev_eui)
+
+    def dev_euis(self) -> list[str]:
+        return list(self._devices)
+
+    def unknown(self, dev_euis) -> list[str]:
+        return sorted({e for e in dev_euis if e not in self._devices})
+
+    def put(self, dev: Device):
+        with self._lock:
+            self._devices[dev.dev_eui] = _device_entry(dev)
+
+    def mark_known(self, dev_euis):
+        # Auto-registered devices: nickname defaults to the EUI.
+        with self._lock:
+            for eui in dev_euis:
+                self._devices.setdefault(
+                    eui,
+                    {
+                        "dev_eui": eui,
+                        "nickname": eui,
+                        "latitude": None,
+                        "longitude": None,
+                        "status": "active",
+                    },
+                )
+
+    def remove(self, dev_eui: str):
+        with self._lock:
+            self._devices.pop(dev_eui, None)
+
+
+device_registry = DeviceRegistry()
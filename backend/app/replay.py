@@ -0,0 +1,249 @@
+# Jakob Balkovec
+# replay.py
+# Feed a captured MQTT stream (app.capture) back through the ingest pipeline
+#
+#   python -m app.replay capture.bin --dry-run --speed 0
+#   python -m app.replay capture.bin --database-url sqlite:///./replay.db --speed 10
+#   python -m app.replay capture.bin --dry-run --save-parsed before.ndjson
+#   python -m app.replay capture.bin --dry-run --compare before.ndjson
+#
+# Uplinks are paced by their captured arrival times: --speed 1 is real
+# time, N is N times faster, 0 is as fast as possible. Each one is parsed
+# exactly as on_message's workers would. Then:
+#   --dry-run         readings are decoded in writer-sized batches, no DB
+#                     (default DRY_VALUE/WET_VALUE calibration)
+#   --database-url    readings go to the real batch writer, which decodes,
+#                     stores, rolls up and caches them in that (scratch) DB
+#
+# --save-parsed writes the rows each uplink decodes to (dev_eui, timestamp,
+# raw_value, moisture_pct) as one NDJSON line; --compare reports where this
+# run's rows differ from such a file (e.g. before and after a parser or
+# decoder change). Compare runs in the same mode: --database-url decodes
+# with the DB's calibration profiles, --dry-run with the defaults. Uplinks
+# without a timestamp are stamped when parsed, so they differ between runs.
+#
+# Prints one JSON report: throughput, how far pacing fell behind the
+# capture, reading counts and divergence.
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+
+def pace(records, speed: float, lag: list[float]):
+    """
+    Yield records `speed` times faster than captured (0 = no waiting).
+    lag[0] tracks the furthest behind schedule we've been, in seconds.
+    """
+    first = start = None
+    for record in records:
+        if speed > 0:
+            if first is None:
+                first, start = record[0], time.perf_counter()
+            delay = (record[0] - first) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                lag[0] = max(lag[0], -delay)
+        yield record
+
+
+ROW_FIELDS = ("dev_eui", "timestamp", "raw_value", "moisture_pct")
+
+
+def decoded_rows(msg) -> list[dict] | None:
+    """
+    The rows a parsed uplink decodes to, as decode_readings leaves them
+    (in place, so later decoding passes skip them); None if unparseable.
+    """
+    from app.ingest import decode_readings
+
+    if msg is None:
+        return None
+    batch = msg if isinstance(msg, list) else [msg]
+    return [{k: m[k] for k in ROW_FIELDS} for m in decode_readings(batch)]
+
+
+def canonical(rows) -> str:
+    return json.dumps(rows, sort_keys=True, separators=(",", ":"))
+
+
+class Divergence:
+    """Streams a --save-parsed file alongside the replay and counts differences."""
+
+    def __init__(self, path: str, examples: int = 5):
+        self.file = open(path)
+        self.max_examples = examples
+        self.compared = 0
+        self.diverged = 0
+        self.missing = 0
+        self.examples = []
+
+    def check(self, index: int, topic: str, got: str):
+        expected = self.file.readline()
+        if not expected:
+            self.missing += 1
+            return
+        expected = expected.rstrip("\n")
+        self.compared += 1
+        if expected != got:
+            self.diverged += 1
+            if len(self.examples) < self.max_examples:
+                self.examples.append({
+                    "index": index,
+                    "topic": topic,
+                    "expected": json.loads(expected),
+                    "got": json.loads(got),
+                })
+
+    def report(self) -> dict:
+        # Baseline lines left over: the capture replayed fewer uplinks.
+        extra = sum(1 for _ in self.file)
+        self.file.close()
+        return {
+            "compared": self.compared,
+            "diverged": self.diverged,
+            "not_in_baseline": self.missing,
+            "not_replayed": extra,
+            "examples": self.examples,
+        }
+
+
+def replay(args) -> dict:
+    from app.capture import capture_files, read_capture
+    from app.config import INGEST_BATCH_SIZE
+    from app.ingest import decode_readings, ingest_writer
+    from app.mqtt import parse_uplink
+
+    files = capture_files(args.capture)
+    if not files:
+        raise SystemExit(f"No capture at {args.capture}")
+    records = read_capture(files)
+    if args.limit:
+        records = itertools.islice(records, args.limit)
+
+    if not args.dry_run:
+        import app.db.models  # noqa: F401  (register tables)
+        from app.db.session import Base, SessionLocal, engine
+        from app.profiles import calibration_cache
+        from app.registry import device_registry
+
+        Base.metadata.create_all(bind=engine)
+        with SessionLocal() as db:
+            device_registry.load(db)
+            calibration_cache.load(db)
+        ingest_writer.start()
+
+    save = open(args.save_parsed, "w") if args.save_parsed else None
+    compare = Divergence(args.compare, args.examples) if args.compare else None
+
+    uplinks = readings = invalid = undecodable = 0
+    span = [None, None]
+    lag = [0.0]
+    pending: list[dict] = []
+    started = time.perf_counter()
+
+    for index, (arrival, topic, payload) in enumerate(pace(records, args.speed, lag)):
+        if span[0] is None:
+            span[0] = arrival
+        span[1] = arrival
+        uplinks += 1
+
+        msg = parse_uplink((topic, payload))
+        if save or compare:
+            line = canonical(decoded_rows(msg))
+            if save:
+                save.write(line + "\n")
+            if compare:
+                compare.check(index, topic, line)
+        if msg is None:
+            invalid += 1
+            continue
+        readings += len(msg) if isinstance(msg, list) else 1
+
+        if not args.dry_run:
+            ingest_writer.submit(msg)
+            continue
+        if isinstance(msg, list):
+            pending.extend(msg)
+        else:
+            pending.append(msg)
+        if len(pending) >= INGEST_BATCH_SIZE:
+            undecodable += len(pending) - len(decode_readings(pending))
+            pending = []
+
+    if pending:
+        undecodable += len(pending) - len(decode_readings(pending))
+    parsed_s = time.perf_counter() - started
+
+    report = {
+        "files": files,
+        "mode": "dry-run" if args.dry_run else "database",
+        "speed": args.speed or "max",
+        "uplinks": uplinks,
+        "readings": readings,
+        "invalid": invalid,
+        "captured_span_s": round((span[1] - span[0]) if uplinks else 0.0, 3),
+        "replay_s": round(parsed_s, 3),
+        "uplinks_per_s": round(uplinks / parsed_s, 1) if parsed_s else None,
+        "readings_per_s": round(readings / parsed_s, 1) if parsed_s else None,
+        "max_lag_ms": round(lag[0] * 1000, 1),
+    }
+
+    if args.dry_run:
+        report["undecodable"] = undecodable
+    else:
+        # Everything submitted is flushed before the writer thread exits.
+        ingest_writer.stop(timeout=None)
+        total_s = time.perf_counter() - started
+        report.update({
+            "stored": ingest_writer.stored,
+            "undecodable": ingest_writer.undecodable,
+            "dropped": ingest_writer.dropped,
+            "flush_retries": ingest_writer.retries,
+            "drain_s": round(total_s - parsed_s, 3),
+            "stored_per_s": round(ingest_writer.stored / total_s, 1) if total_s else None,
+        })
+
+    if save:
+        save.close()
+    if compare:
+        report["divergence"] = compare.report()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a captured MQTT stream through ingest")
+    parser.add_argument(
+        "capture", help="MQTT_CAPTURE_PATH of the capture (rotated files included)"
+    )
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="1 = real time, N = N times faster, 0 = max"
+    )
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--dry-run", action="store_true", help="parse and decode only")
+    target.add_argument("--database-url", help="scratch database to store readings in")
+    parser.add_argument("--limit", type=int, help="stop after this many uplinks")
+    parser.add_argument("--save-parsed", help="write each uplink's decoded rows (NDJSON)")
+    parser.add_argument("--compare", help="report divergence from a --save-parsed file")
+    parser.add_argument("--examples", type=int, default=5, help="diverging uplinks to show")
+    args = parser.parse_args()
+
+    # Settings and engines are read at import time, so the target database
+    # has to be in the environment before any app module loads.
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from app.logs import setup_logging
+
+    setup_logging(stream=sys.stderr)
+    json.dump(replay(args), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
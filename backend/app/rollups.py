@@ -0,0 +1,236 @@
+# Jakob Balkovec
+# rollups.py
+# Incrementally maintained minute/hour/day rollups of sensor_readings
+#
+# Backfill from existing data (rebuilds from scratch). On SQLite and
+# Postgres it can run alongside ingest (see backfill_rollups); on other
+# backends stop ingest first:
+#   python -m app.rollups [--dev-eui EUI]
+
+import argparse
+import datetime
+import logging
+
+from sqlalchemy import case, delete, func, select, text
+
+from app.crud import dialect_insert
+from app.db.models import (
+    SensorReading,
+    ReadingRollupMinute,
+    ReadingRollupHour,
+    ReadingRollupDay,
+)
+from app.config import EXPORT_CHUNK_SIZE
+from app.utils.time_utils import to_utc
+
+log = logging.getLogger(__name__)
+
+# bucket name -> (table, width in seconds)
+BUCKETS = {
+    "minute": (ReadingRollupMinute, 60),
+    "hour": (ReadingRollupHour, 3600),
+    "day": (ReadingRollupDay, 86400),
+}
+
+
+def _aggregate(rows, width: int) -> list[dict]:
+    aggs: dict[tuple[str, int], dict] = {}
+    for r in rows:
+        ts = to_utc(r["timestamp"])
+        epoch = int(ts.timestamp())
+        key = (r["dev_eui"], epoch - epoch % width)
+        pct, raw = r["moisture_pct"], r["raw_value"]
+
+        a = aggs.get(key)
+        if a is None:
+            aggs[key] = {
+                "dev_eui": key[0],
+                "bucket_start": datetime.datetime.fromtimestamp(
+                    key[1], tz=datetime.timezone.utc
+                ),
+                "count": 1,
+                "moisture_min": pct,
+                "moisture_max": pct,
+                "moisture_sum": pct,
+                "moisture_last": pct,
+                "raw_min": raw,
+                "raw_max": raw,
+                "raw_sum": raw,
+                "raw_last": raw,
+                "last_ts": ts,
+            }
+            continue
+
+        a["count"] += 1
+        a["moisture_min"] = min(a["moisture_min"], pct)
+        a["moisture_max"] = max(a["moisture_max"], pct)
+        a["moisture_sum"] += pct
+        a["raw_min"] = min(a["raw_min"], raw)
+        a["raw_max"] = max(a["raw_max"], raw)
+        a["raw_sum"] += raw
+        if ts >= a["last_ts"]:
+            a["moisture_last"] = pct
+            a["raw_last"] = raw
+            a["last_ts"] = ts
+    return list(aggs.values())
+
+
+def _merge_python(db, model, aggs: list[dict]):
+    # Fallback for backends without INSERT ... ON CONFLICT.
+    for a in aggs:
+        row = db.get(model, (a["dev_eui"], a["bucket_start"]))
+        if row is None:
+            db.add(model(**a))
+            continue
+        row.count += a["count"]
+        row.moisture_min = min(row.moisture_min, a["moisture_min"])
+        row.moisture_max = max(row.moisture_max, a["moisture_max"])
+        row.moisture_sum += a["moisture_sum"]
+        row.raw_min = min(row.raw_min, a["raw_min"])
+        row.raw_max = max(row.raw_max, a["raw_max"])
+        row.raw_sum += a["raw_sum"]
+        if to_utc(a["last_ts"]) >= to_utc(row.last_ts):
+            row.moisture_last = a["moisture_last"]
+            row.raw_last = a["raw_last"]
+            row.last_ts = a["last_ts"]
+
+
+def _upsert(db, model, aggs: list[dict]):
+    # On the table, not the mapped class: a Core executemany skips the
+    # ORM's per-row bulk bookkeeping.
+    stmt = dialect_insert(db, model.__table__)
+    if stmt is None:
+        _merge_python(db, model, aggs)
+        return
+
+    t, ex = model.__table__.c, stmt.excluded
+    if db.get_bind().dialect.name == "postgresql":
+        lo, hi = func.least, func.greatest
+    else:
+        lo, hi = func.min, func.max  # SQLite's multi-argument scalar min/max
+    newer = ex.last_ts >= t.last_ts
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["dev_eui", "bucket_start"],
+        set_={
+            "count": t.count + ex.count,
+            "moisture_min": lo(t.moisture_min, ex.moisture_min),
+            "moisture_max": hi(t.moisture_max, ex.moisture_max),
+            "moisture_sum": t.moisture_sum + ex.moisture_sum,
+            "moisture_last": case((newer, ex.moisture_last), else_=t.moisture_last),
+            "raw_min": lo(t.raw_min, ex.raw_min),
+            "raw_max": hi(t.raw_max, ex.raw_max),
+            "raw_sum": t.raw_sum + ex.raw_sum,
+            "raw_last": case((newer, ex.raw_last), else_=t.raw_last),
+            "last_ts": case((newer, ex.last_ts), else_=t.last_ts),
+        },
+    )
+    db.execute(stmt, aggs)
+
+
+def apply_rollups(db, rows) -> None:
+    """
+    Fold raw readings (mappings with dev_eui, timestamp, moisture_pct,
+    raw_value) into every rollup table. Does not commit, so ingest can
+    update rollups in the same transaction as the raw rows.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    for model, width in BUCKETS.values():
+        _upsert(db, model, _aggregate(rows, width))
+
+
+def backfill_rollups(
+    db,
+    dev_eui: str | None = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+    progress=None,
+) -> int:
+    """
+    Rebuild rollups from sensor_readings (all devices or one), committing
+    per chunk. Returns the number of raw rows folded in. `progress`, if
+    given, is called with the running total after each chunk.
+
+    The delete and the read of max(id) share one write transaction, and
+    no reading may be inserted while it is open: SQLite has a single
+    writer, and on Postgres the transaction holds a SHARE lock on
+    sensor_readings, which waits for in-flight ingest to commit and holds
+    new inserts until it ends. Rows committed after it were folded in by
+    apply_rollups and are left alone, while rows at or below max(id) are
+    rebuilt here. Other backends give no such guarantee; stop ingest first.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        db.execute(text(f"LOCK TABLE {SensorReading.__tablename__} IN SHARE MODE"))
+    elif dialect != "sqlite":
+        log.warning("Rebuilding rollups on %s next to live ingest may miscount", dialect)
+    for model, _ in BUCKETS.values():
+        stmt = delete(model)
+        if dev_eui:
+            stmt = stmt.where(model.dev_eui == dev_eui)
+        db.execute(stmt)
+    max_stmt = select(func.max(SensorReading.id))
+    if dev_eui:
+        max_stmt = max_stmt.where(SensorReading.dev_eui == dev_eui)
+    max_id = db.execute(max_stmt).scalar() or 0
+    db.commit()
+
+    stmt = select(
+        SensorReading.id,
+        SensorReading.dev_eui,
+        SensorReading.timestamp,
+        SensorReading.moisture_pct,
+        SensorReading.raw_value,
+    ).where(SensorReading.id <= max_id)
+    if dev_eui:
+        stmt = stmt.where(SensorReading.dev_eui == dev_eui)
+    stmt = stmt.order_by(SensorReading.id).limit(chunk_size)
+
+    # Keyset chunks over id: each chunk is a short read followed by a short
+    # write transaction, so the table is never locked for long.
+    total, last_id = 0, 0
+    while True:
+        chunk = db.execute(stmt.where(SensorReading.id > last_id)).all()
+        if not chunk:
+            break
+        apply_rollups(db, (r._mapping for r in chunk))
+        db.commit()
+        total += len(chunk)
+        last_id = chunk[-1].id
+        if progress:
+            progress(total)
+    return total
+
+
+def rollup_to_dict(r) -> dict:
+    return {
+        "timestamp": to_utc(r.bucket_start),
+        "count": r.count,
+        "moisture_min": r.moisture_min,
+        "moisture_max": r.moisture_max,
+        "moisture_mean": r.moisture_sum / r.count,
+        "moisture_last": r.moisture_last,
+        "raw_min": r.raw_min,
+        "raw_max": r.raw_max,
+        "raw_mean": r.raw_sum / r.count,
+        "raw_last": r.raw_last,
+    }
+
+
+def main():
+    from app.db.session import Base, SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="Rebuild reading rollups from raw data")
+    parser.add_argument("--dev-eui", help="only rebuild this device")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        total = backfill_rollups(db, args.dev_eui, args.chunk_size)
+    print(f"[ROLLUP] Backfilled from {total} readings")
+
+
+if __name__ == "__main__":
+    main()
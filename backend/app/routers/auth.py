@@ -1,14 +1,16 @@
 # app/routers/auth.py
 
+import logging
 from datetime import datetime, timedelta, timezone
 
 from fastapi import APIRouter, HTTPException, status
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
 from jose import jwt
 
-from app.config import settings, GOOGLE_CLIENT_ID, ADMIN_EMAILS
+from app.config import settings, ADMIN_EMAILS
 from app.schemas.auth import GoogleAuthIn, TokenOut, UserOut
+from app.security import InvalidToken, token_verifier
+
+log = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/auth", tags=["Auth"])
 
@@ -31,14 +33,10 @@ def google_options():
 
 @router.post("/google", response_model=TokenOut)
 def google_login(payload: GoogleAuthIn):
-    # 1) Verify the Google ID token with Google
+    # 1) Verify the Google ID token against Google's (cached) signing keys
     try:
-        idinfo = id_token.verify_oauth2_token(
-            payload.id_token,
-            google_requests.Request(),
-            GOOGLE_CLIENT_ID,
-        )
-    except Exception:
+        idinfo = token_verifier.verify_google(payload.id_token)
+    except InvalidToken:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid Google token",
@@ -55,13 +53,17 @@ def google_login(payload: GoogleAuthIn):
     allowed_admins = {e.lower() for e in ADMIN_EMAILS}
     is_admin = email.lower() in allowed_admins
 
-    # 3) Create our own JWT
-    token = create_access_token(
-        {
-            "sub": email,
-            "role": "admin" if is_admin else "user",
-        }
-    )
+    # 3) Create our own JWT. Without a SECRET_KEY none can be minted, and
+    # the verified Google token itself is handed back as the bearer token.
+    if token_verifier.secret_key is None:
+        token = payload.id_token
+    else:
+        token = create_access_token(
+            {
+                "sub": email,
+                "role": "admin" if is_admin else "user",
+            }
+        )
 
     # 4) Return token + basic user info to frontend
     user = UserOut(
@@ -70,8 +72,7 @@ def google_login(payload: GoogleAuthIn):
         picture=idinfo.get("picture"),
     )
 
-    print("GOOGLE EMAIL =", email)
-    print("ADMIN_EMAILS =", ADMIN_EMAILS)
+    log.info("Google login", extra={"user": email, "admin": is_admin})
 
     return TokenOut(
         access_token=token,
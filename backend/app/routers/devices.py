@@ -1,17 +1,36 @@
 # app/routers/devices.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 
 from app.security import require_admin
 from app.db.session import get_db
+from app.db.async_session import get_async_db
 from app.crud import (
     create_device,
     delete_device_by_eui,
     get_device_by_eui,
-    list_all_devices,
+    get_latest_readings_async,
+    list_all_devices_async,
+    list_calibration_profiles,
+    get_calibration_profile,
+    upsert_calibration_profile,
+    delete_calibration_profile,
+    devices_with_profile,
+    get_device_profile,
+    set_device_profile,
 )
 from app.db.device_schema import DeviceCreate, DeviceOut
+from app.schemas.calibration import (
+    CalibrationProfileIn,
+    CalibrationProfileOut,
+    DeviceCalibrationIn,
+    DeviceCalibrationOut,
+)
+from app.registry import device_registry
+from app.cache import latest_cache, reading_json, reading_to_dict
+from app.profiles import calibration_cache, recompute_jobs, worker_refresh_s
+from app.config import INGEST_MODE
 
 router = APIRouter(prefix="/api", tags=["Devices"])
 
@@ -30,7 +49,9 @@ def add_device(device: DeviceCreate, db: Session = Depends(get_db)):
             detail="Device already exists",
         )
 
-    return create_device(db, device.dict())
+    dev = create_device(db, device)
+    device_registry.put(dev)
+    return dev
 
 
 # Delete Device (admin only)
@@ -46,10 +67,162 @@ def remove_device(dev_eui: str, db: Session = Depends(get_db)):
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Device not found",
         )
+    device_registry.remove(dev_eui)
+    latest_cache.invalidate(dev_eui)
     return None
 
 
+async def latest_by_device(db, dev_euis: list[str] | None = None) -> dict[str, dict]:
+    # JSON-ready (see reading_json), so a response model cannot reformat it.
+    latest = {}
+    for row in await get_latest_readings_async(db, dev_euis):
+        latest_cache.put(reading_to_dict(row))
+        latest[row.dev_eui] = reading_json(row)
+    return latest
+
+
+# Latest reading for every device, or a filtered set (public)
+@router.get("/devices/latest")
+async def list_latest_readings(
+    dev_eui: list[str] | None = Query(None),
+    db=Depends(get_async_db),
+):
+    return list((await latest_by_device(db, dev_eui)).values())
+
+
 # List Devices (public)
-@router.get("/devices", response_model=list[DeviceOut])
-def list_devices(db: Session = Depends(get_db)):
-    return list_all_devices(db)
+@router.get(
+    "/devices",
+    response_model=list[DeviceOut],
+    response_model_exclude_unset=True,
+)
+async def list_devices(include_latest: bool = False, db=Depends(get_async_db)):
+    devices = await list_all_devices_async(db)
+    if include_latest:
+        latest = await latest_by_device(db)
+        for d in devices:
+            d["latest"] = latest.get(d["dev_eui"])
+    return devices
+
+
+# ---- Calibration profiles ----
+
+def _profile_out(db, profile) -> dict:
+    return CalibrationProfileOut(
+        name=profile.name,
+        dry_value=profile.dry_value,
+        wet_value=profile.wet_value,
+        notes=profile.notes,
+        devices=devices_with_profile(db, profile.name),
+    ).model_dump()
+
+
+def _recompute(dev_euis: list[str], reason: str) -> dict | None:
+    if not dev_euis:
+        return None
+    # Separate ingest processes reload profiles on a timer; start after
+    # that so they no longer write with the old calibration.
+    settle_s = worker_refresh_s() if INGEST_MODE == "sharded" else 0.0
+    return recompute_jobs.submit(dev_euis, reason, settle_s=settle_s)
+
+
+@router.get("/calibration/profiles", response_model=list[CalibrationProfileOut])
+def list_profiles(db: Session = Depends(get_db)):
+    return [_profile_out(db, p) for p in list_calibration_profiles(db)]
+
+
+# Create or edit a profile (admin only); devices using it are recomputed
+@router.put(
+    "/calibration/profiles/{name}",
+    dependencies=[Depends(require_admin)]
+)
+def put_profile(name: str, payload: CalibrationProfileIn, db: Session = Depends(get_db)):
+    before = get_calibration_profile(db, name)
+    old = (before.dry_value, before.wet_value) if before else None
+
+    profile = upsert_calibration_profile(db, name, payload.model_dump())
+    calibration_cache.load(db)
+
+    job = None
+    if old != (profile.dry_value, profile.wet_value):
+        job = _recompute(devices_with_profile(db, name), f"profile {name} changed")
+    return {"profile": _profile_out(db, profile), "job": job}
+
+
+@router.delete(
+    "/calibration/profiles/{name}",
+    status_code=204,
+    dependencies=[Depends(require_admin)]
+)
+def remove_profile(name: str, db: Session = Depends(get_db)):
+    in_use = devices_with_profile(db, name)
+    if in_use:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Profile in use by {len(in_use)} device(s)",
+        )
+    if not delete_calibration_profile(db, name):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found",
+        )
+    return None
+
+
+@router.get("/device/{dev_eui}/calibration", response_model=DeviceCalibrationOut)
+def device_calibration(dev_eui: str, db: Session = Depends(get_db)):
+    profile = get_device_profile(db, dev_eui)
+    dry, wet = calibration_cache.get(dev_eui)
+    return DeviceCalibrationOut(
+        dev_eui=dev_eui,
+        profile=profile.name if profile else None,
+        dry_value=dry,
+        wet_value=wet,
+    )
+
+
+# Assign (or clear) a device's profile (admin only); recomputes its history
+@router.put(
+    "/device/{dev_eui}/calibration",
+    dependencies=[Depends(require_admin)]
+)
+def put_device_calibration(
+    dev_eui: str,
+    payload: DeviceCalibrationIn,
+    db: Session = Depends(get_db),
+):
+    if dev_eui not in device_registry and not get_device_by_eui(db, dev_eui):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Device not found",
+        )
+    if payload.profile is not None and not get_calibration_profile(db, payload.profile):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found",
+        )
+
+    old = calibration_cache.get(dev_eui)
+    set_device_profile(db, dev_eui, payload.profile)
+    calibration_cache.load(db)
+
+    job = None
+    if calibration_cache.get(dev_eui) != old:
+        job = _recompute([dev_eui], f"device {dev_eui} set to profile {payload.profile}")
+    return {"calibration": device_calibration(dev_eui, db), "job": job}
+
+
+@router.get("/calibration/jobs")
+def list_recompute_jobs():
+    return recompute_jobs.list()
+
+
+@router.get("/calibration/jobs/{job_id}")
+def get_recompute_job(job_id: int):
+    job = recompute_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found",
+        )
+    return job
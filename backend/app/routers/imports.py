@@ -0,0 +1,71 @@
+# app/routers/imports.py
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from starlette.concurrency import run_in_threadpool
+
+from app.security import require_admin
+from app.importer import BulkImport, import_jobs
+
+router = APIRouter(prefix="/api", tags=["Import"], dependencies=[Depends(require_admin)])
+
+_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+
+
+# Stream NDJSON or CSV readings into the database (admin only).
+# Progress of a running import: GET /api/import/jobs/{id}.
+@router.post("/import/readings")
+async def import_readings(
+    request: Request,
+    fmt: str | None = Query(None, alias="format", pattern="^(ndjson|csv)$"),
+    dev_eui: str | None = None,
+    create_devices: bool = False,
+    skip_existing: bool = False,
+):
+    if fmt is None:
+        content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+        fmt = _CONTENT_TYPES.get(content_type, "ndjson")
+
+    job = import_jobs.create(source=f"upload ({fmt})")
+    importer = BulkImport(
+        fmt,
+        dev_eui=dev_eui,
+        create_devices=create_devices,
+        skip_existing=skip_existing,
+        job=job,
+    )
+    # Parsing and inserts are blocking; each body chunk is handed to the
+    # threadpool so the event loop keeps serving while a large upload runs.
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                await run_in_threadpool(importer.feed, chunk)
+        return await run_in_threadpool(importer.close)
+    except ValueError as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except BaseException as e:
+        job["status"] = "failed"
+        job["error"] = str(e) or type(e).__name__
+        raise
+
+
+@router.get("/import/jobs")
+def list_import_jobs():
+    return import_jobs.list()
+
+
+@router.get("/import/jobs/{job_id}")
+def get_import_job(job_id: int):
+    job = import_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Import not found",
+        )
+    return job
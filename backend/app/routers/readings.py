@@ -1,48 +1,192 @@
 # app/routers/readings.py
 
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-
-from app.db.session import get_db
-from app.crud import get_recent_readings
-
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
 import csv
+import itertools
+from datetime import datetime, timezone
 from io import StringIO
 
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.orm import Session
+
+from app.db.session import get_db, SessionLocal
+from app.db.async_session import get_async_db
+from app import columnar
+from app.cache import reading_json
+from app.crud import count_readings, get_readings_page_async, get_rollups, iter_readings
+from app.db.models import SensorReading
+from app.registry import device_registry
+from app.rollups import BUCKETS, rollup_to_dict
+from app.utils.downsample import StreamingLTTB
+from app.config import EXPORT_CHUNK_SIZE
+from app.utils.time_utils import to_utc, encode_cursor, decode_cursor
+
 router = APIRouter(prefix="/api", tags=["Readings"])
 
 
 @router.get("/readings/{dev_eui}")
-def recent_readings(dev_eui: str, limit: int = 100, db: Session = Depends(get_db)):
-    rows = get_recent_readings(db, dev_eui, limit)
-    return rows
-
-@router.get("/api/export/{dev_eui}")
-async def export_csv(dev_eui: str, db: Session = Depends(get_db)):
-    rows = db.execute("""
-        SELECT timestamp, moisture_pct, raw_value
-        FROM readings
-        WHERE dev_eui = :dev
-        ORDER BY timestamp ASC
-    """, {"dev": dev_eui}).fetchall()
-
-    if not rows:
-        raise HTTPException(status_code=404, detail="No data found")
+async def recent_readings(
+    dev_eui: str,
+    limit: int = Query(100, ge=1, le=10000),
+    start: datetime | None = Query(None, alias="from"),
+    end: datetime | None = Query(None, alias="to"),
+    cursor: str | None = None,
+    db=Depends(get_async_db),
+):
+    # Newest first. When a full page is returned, X-Next-Cursor holds the
+    # cursor for the next (older) page.
+    before = None
+    if cursor:
+        try:
+            before = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["timestamp", "moisture_pct", "raw_value"])
-    for r in rows:
-        writer.writerow([r.timestamp, r.moisture_pct, r.raw_value])
+    rows = await get_readings_page_async(
+        db, dev_eui, start=to_utc(start), end=to_utc(end), before=before, limit=limit
+    )
+    headers = {}
+    if len(rows) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    # Encoded directly: jsonable_encoder over ORM rows would dominate the
+    # request and run on the event loop.
+    return JSONResponse([reading_json(r) for r in rows], headers=headers)
+
+
+@router.get("/readings/{dev_eui}/aggregate")
+def aggregate_readings(
+    dev_eui: str,
+    bucket: str = "hour",
+    start: datetime | None = Query(None, alias="from"),
+    end: datetime | None = Query(None, alias="to"),
+    db: Session = Depends(get_db),
+):
+    # Reads only the rollup tables, never raw readings.
+    if bucket not in BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"bucket must be one of: {', '.join(BUCKETS)}",
+        )
+    model, _ = BUCKETS[bucket]
+    rows = get_rollups(db, model, dev_eui, start=to_utc(start), end=to_utc(end))
+    return [rollup_to_dict(r) for r in rows]
+
+
+@router.get("/readings/{dev_eui}/downsample")
+def downsample_readings(
+    dev_eui: str,
+    points: int = Query(500, ge=3, le=10000),
+    field: str = Query("moisture_pct", pattern="^(moisture_pct|raw_value)$"),
+    start: datetime | None = Query(None, alias="from"),
+    end: datetime | None = Query(None, alias="to"),
+    db: Session = Depends(get_db),
+):
+    # LTTB-downsampled series, oldest first. Rows are streamed in chunks,
+    # so memory is bounded by the bucket size, not the range size.
+    start, end = to_utc(start), to_utc(end)
+    total = count_readings(db, dev_eui, start=start, end=end)
+    lttb = StreamingLTTB(total, points)
+
+    column = getattr(SensorReading, field)
+    for chunk in iter_readings(
+        db,
+        dev_eui,
+        start=start,
+        end=end,
+        columns=(SensorReading.timestamp, column),
+        chunk_size=EXPORT_CHUNK_SIZE,
+    ):
+        x = np.fromiter((to_utc(r[0]).timestamp() for r in chunk), np.float64, len(chunk))
+        y = np.fromiter((r[1] for r in chunk), np.float64, len(chunk))
+        lttb.feed(x, y)
+
+    xs, ys = lttb.finish()
+    cast = int if field == "raw_value" else float
+    return [
+        {"timestamp": datetime.fromtimestamp(t, tz=timezone.utc), field: cast(v)}
+        for t, v in zip(xs, ys)
+    ]
 
-    output.seek(0)
-    filename = f"{dev_eui}_readings.csv"
 
+def _csv_chunks(db: Session, first, chunks):
+    buf = StringIO()
+    writer = csv.writer(buf)
+    try:
+        writer.writerow(["timestamp", "moisture_pct", "raw_value"])
+        for chunk in itertools.chain([first], chunks):
+            writer.writerows(
+                (to_utc(r.timestamp).isoformat(), r.moisture_pct, r.raw_value) for r in chunk
+            )
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    finally:
+        db.close()
+
+
+@router.get("/export/{dev_eui}")
+def export_csv(
+    dev_eui: str,
+    start: datetime | None = Query(None, alias="from"),
+    end: datetime | None = Query(None, alias="to"),
+):
+    # The session outlives this function: it is closed by the stream.
+    db = SessionLocal()
+    chunks = iter_readings(
+        db, dev_eui, start=to_utc(start), end=to_utc(end), chunk_size=EXPORT_CHUNK_SIZE
+    )
+    first = next(chunks, None)
+    if first is None:
+        db.close()
+        raise HTTPException(status_code=404, detail="No data found")
+
+    filename = f"{dev_eui}_readings.csv"
     return StreamingResponse(
-        iter([output.getvalue()]),
+        _csv_chunks(db, first, chunks),
         media_type="text/csv",
         headers={"Content-Disposition": f'attachment; filename="{filename}"'}
     )
+
+
+def _closing(db: Session, chunks):
+    try:
+        yield from chunks
+    finally:
+        db.close()
+
+
+# Arrow IPC / Parquet for a set of devices (all registered ones by default)
+@router.get("/export")
+def export_columnar(
+    dev_eui: list[str] | None = Query(None),
+    start: datetime | None = Query(None, alias="from"),
+    end: datetime | None = Query(None, alias="to"),
+    fmt: str = Query("arrow", alias="format", pattern="^(arrow|parquet)$"),
+    compression: str = Query("none", pattern="^(none|lz4|zstd)$"),
+):
+    if not columnar.available():
+        raise HTTPException(status_code=501, detail="Columnar export needs pyarrow installed")
+    dev_euis = list(dict.fromkeys(dev_eui)) if dev_eui else sorted(device_registry.dev_euis())
+
+    # The session outlives this function: it is closed by the stream.
+    db = SessionLocal()
+    batches = columnar.record_batches(
+        db, dev_euis, start=to_utc(start), end=to_utc(end), chunk_size=EXPORT_CHUNK_SIZE
+    )
+    first = next(batches, None)
+    if first is None:
+        db.close()
+        raise HTTPException(status_code=404, detail="No data found")
+
+    batches = itertools.chain([first], batches)
+    if fmt == "parquet":
+        body = columnar.parquet_stream(batches, first.schema)
+    else:
+        body = columnar.ipc_stream(batches, first.schema, compression)
+    media_type, extension = columnar.FORMATS[fmt]
+    return StreamingResponse(
+        _closing(db, body),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="readings.{extension}"'},
+    )
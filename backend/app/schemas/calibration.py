@@ -0,0 +1,30 @@
+from pydantic import BaseModel, model_validator
+
+
+class CalibrationProfileIn(BaseModel):
+    dry_value: int
+    wet_value: int
+    notes: str | None = None
+
+    @model_validator(mode="after")
+    def distinct_points(self):
+        if self.dry_value == self.wet_value:
+            raise ValueError("dry_value and wet_value must differ")
+        return self
+
+
+class CalibrationProfileOut(CalibrationProfileIn):
+    name: str
+    devices: list[str] = []
+
+
+class DeviceCalibrationIn(BaseModel):
+    # Profile name, or null to fall back to the global DRY_VALUE/WET_VALUE.
+    profile: str | None = None
+
+
+class DeviceCalibrationOut(BaseModel):
+    dev_eui: str
+    profile: str | None = None
+    dry_value: int
+    wet_value: int
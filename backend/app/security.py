@@ -1,13 +1,43 @@
 # app/security.py
 
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
 from fastapi import Depends, HTTPException, status, Header
 from pydantic import BaseModel
-from google.oauth2 import id_token
+from google.auth import exceptions as google_exceptions
+from google.auth import jwt as google_jwt
 from google.auth.transport import requests
+from jose import JWTError, jwt
+
+from app.config import (
+    Settings,
+    GOOGLE_CLIENT_ID,
+    ADMIN_EMAILS,
+    SECRET_KEY,
+    AUTH_CACHE_SIZE,
+    AUTH_CACHE_TTL_S,
+)
+
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+GOOGLE_CERTS_DEFAULT_MAX_AGE = 300
+# Floor between refetches triggered by an unknown key id.
+GOOGLE_CERTS_MIN_REFRESH_S = 60
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+# The committed SECRET_KEY default; anyone could sign admin tokens with it.
+DEFAULT_SECRET_KEY = Settings.model_fields["SECRET_KEY"].default
+
+
+def backend_tokens_enabled(secret_key: str = SECRET_KEY) -> bool:
+    return bool(secret_key) and secret_key != DEFAULT_SECRET_KEY
 
-from app.config import GOOGLE_CLIENT_ID, ADMIN_EMAILS
-from fastapi import Header, HTTPException, status
-from app.config import ADMIN_API_KEY
 
 class User(BaseModel):
     email: str
@@ -15,6 +45,199 @@ class User(BaseModel):
     picture: str | None = None
 
 
+class InvalidToken(ValueError):
+    pass
+
+
+def fetch_google_certs(request=None) -> tuple[dict, float]:
+    """GET the Google cert endpoint; returns ({kid: pem}, max-age seconds)."""
+    request = request or requests.Request()
+    response = request(GOOGLE_CERTS_URL, method="GET")
+    if response.status != 200:
+        raise google_exceptions.TransportError(
+            f"Could not fetch certificates at {GOOGLE_CERTS_URL}"
+        )
+    match = _MAX_AGE.search(response.headers.get("cache-control", ""))
+    max_age = int(match.group(1)) if match else GOOGLE_CERTS_DEFAULT_MAX_AGE
+    return json.loads(response.data.decode("utf-8")), max_age
+
+
+class GoogleKeySet:
+    """
+    Google's signing certs, held for the lifetime their Cache-Control
+    header allows. Verification is then a local RSA check; the endpoint
+    is only hit on expiry or when a token names a key id we don't have
+    (key rotation), and the latter at most once a minute.
+    """
+
+    def __init__(self, fetch=fetch_google_certs):
+        self._fetch = fetch
+        self._certs: dict[str, str] = {}
+        self._expires = 0.0
+        self._fetched = 0.0
+        self._lock = threading.Lock()
+        self.fetches = 0
+
+    def _refresh(self):
+        certs, max_age = self._fetch()
+        now = time.monotonic()
+        self._certs = certs
+        self._expires = now + max_age
+        self._fetched = now
+        self.fetches += 1
+
+    def certs(self, kid: str | None = None) -> dict[str, str]:
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._expires:
+                self._refresh()
+            elif (
+                kid is not None
+                and kid not in self._certs
+                and now - self._fetched >= GOOGLE_CERTS_MIN_REFRESH_S
+            ):
+                self._refresh()
+            return self._certs
+
+    def verify(self, token: str, audience: str) -> dict:
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+            claims = google_jwt.decode(
+                token,
+                certs=self.certs(kid),
+                audience=audience,
+                clock_skew_in_seconds=10,
+            )
+        except (JWTError, ValueError, google_exceptions.GoogleAuthError) as exc:
+            raise InvalidToken(str(exc)) from exc
+        if claims.get("iss") not in GOOGLE_ISSUERS:
+            raise InvalidToken(f"Wrong issuer: {claims.get('iss')}")
+        return claims
+
+
+class VerifiedTokenCache:
+    """
+    TTL LRU of verified claims keyed by SHA-256 of the token. An entry
+    never outlives the token's own `exp`, so a cache hit is exactly as
+    valid as a fresh verification. Only successes are cached.
+    """
+
+    def __init__(self, maxsize: int = AUTH_CACHE_SIZE, ttl_s: float = AUTH_CACHE_TTL_S):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self._entries: OrderedDict[bytes, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> dict | None:
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token: str, claims: dict):
+        if self.maxsize <= 0 or self.ttl_s <= 0:
+            return
+        expires = time.time() + self.ttl_s
+        if "exp" in claims:
+            expires = min(expires, float(claims["exp"]))
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = (expires, claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_s": self.ttl_s,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class TokenVerifier:
+    """
+    Verifies both token kinds the API sees:
+      - our own HS256 access tokens (routers/auth.create_access_token),
+        checked locally with SECRET_KEY; rejected outright while
+        SECRET_KEY is empty or still the default
+      - Google ID tokens, checked locally against GoogleKeySet
+    and memoizes the resulting claims in a VerifiedTokenCache.
+    """
+
+    def __init__(
+        self,
+        secret_key: str = SECRET_KEY,
+        audience: str = GOOGLE_CLIENT_ID,
+        keys: GoogleKeySet | None = None,
+        cache: VerifiedTokenCache | None = None,
+    ):
+        self.secret_key = secret_key if backend_tokens_enabled(secret_key) else None
+        self.audience = audience
+        self.keys = keys or GoogleKeySet()
+        self.cache = cache or VerifiedTokenCache()
+
+    def verify(self, token: str) -> dict:
+        claims = self.cache.get(token)
+        if claims is not None:
+            return claims
+
+        try:
+            alg = jwt.get_unverified_header(token).get("alg")
+        except JWTError as exc:
+            raise InvalidToken(str(exc)) from exc
+
+        if alg == "HS256":
+            if self.secret_key is None:
+                raise InvalidToken("Backend tokens are disabled: SECRET_KEY is not set")
+            try:
+                claims = jwt.decode(token, self.secret_key, algorithms=["HS256"])
+            except JWTError as exc:
+                raise InvalidToken(str(exc)) from exc
+        else:
+            claims = self.keys.verify(token, self.audience)
+
+        self.cache.put(token, claims)
+        return claims
+
+    def verify_google(self, token: str) -> dict:
+        # Login exchange: must be a Google token, never one of ours.
+        return self.keys.verify(token, self.audience)
+
+    def user(self, token: str) -> User:
+        claims = self.verify(token)
+        email = claims.get("email") or claims.get("sub")
+        if not email:
+            raise InvalidToken("No email in token")
+        return User(
+            email=email,
+            name=claims.get("name"),
+            picture=claims.get("picture"),
+        )
+
+
+token_verifier = TokenVerifier()
+
+
 def get_current_user(authorization: str = Header(..., alias="Authorization")) -> User:
     if not authorization.startswith("Bearer "):
         raise HTTPException(
@@ -30,29 +253,13 @@ def get_current_user(authorization: str = Header(..., alias="Authorization")) ->
         )
 
     try:
-        # verify against your Google Client ID
-        idinfo = id_token.verify_oauth2_token(
-            token, requests.Request(), GOOGLE_CLIENT_ID
-        )
-    except Exception:
+        return token_verifier.user(token)
+    except InvalidToken:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid Google token",
+            detail="Invalid token",
         )
 
-    email = idinfo.get("email")
-    if not email:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="No email in token",
-        )
-
-    return User(
-        email=email,
-        name=idinfo.get("name"),
-        picture=idinfo.get("picture"),
-    )
-
 
 def require_admin(user: User = Depends(get_current_user)) -> User:
     if user.email not in ADMIN_EMAILS:
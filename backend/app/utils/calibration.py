@@ -2,9 +2,31 @@
 # Fri Nov 28th
 # calibration.py
 
+import numpy as np
+
 from app.config import DRY_VALUE, WET_VALUE
 
-def convert_to_percentage(raw: int) -> float:
-    pct = (DRY_VALUE - raw) / (DRY_VALUE - WET_VALUE)
+# The one moisture formula: linear between the dry and wet calibration
+# points, clamped to [0, 100]. Scalar and array versions must stay
+# bit-identical, so both evaluate the same expression in float64.
+
+
+def convert_to_percentage(raw: int, dry: int | None = None, wet: int | None = None) -> float:
+    if raw is None:
+        return 0.0
+    dry = DRY_VALUE if dry is None else dry
+    wet = WET_VALUE if wet is None else wet
+    pct = (dry - raw) / (dry - wet)
     pct = max(0.0, min(1.0, pct))  # clamp into [0, 1]
     return pct * 100.0
+
+
+def convert_to_percentage_array(raw, dry=None, wet=None) -> np.ndarray:
+    # dry/wet may be scalars or per-element arrays.
+    dry = DRY_VALUE if dry is None else dry
+    wet = WET_VALUE if wet is None else wet
+    raw = np.asarray(raw, dtype=np.int64)
+    pct = (np.asarray(dry, dtype=np.int64) - raw) / (
+        np.asarray(dry, dtype=np.int64) - np.asarray(wet, dtype=np.int64)
+    )
+    return np.clip(pct, 0.0, 1.0) * 100.0
@@ -0,0 +1,114 @@
+# Jakob Balkovec
+# downsample.py
+# Streaming Largest-Triangle-Three-Buckets (LTTB) downsampling
+
+import numpy as np
+
+
+class StreamingLTTB:
+    """
+    LTTB over a series that arrives in chunks, oldest first.
+
+    The total point count must be known up front (a COUNT query) so bucket
+    boundaries can be fixed before the data is seen. Only two buckets are
+    held at a time: the one being decided and the next one, whose mean is
+    the third triangle vertex. The per-bucket triangle areas are computed
+    with NumPy, so the Python loop runs once per bucket, not per point.
+    """
+
+    def __init__(self, n_total: int, threshold: int):
+        if threshold < 3:
+            raise ValueError("threshold must be at least 3")
+        self.n_total = n_total
+        self.threshold = threshold
+        self.passthrough = n_total <= threshold
+        self.every = (n_total - 2) / (threshold - 2) if not self.passthrough else 1.0
+
+        self._seen = 0
+        self._out_x: list[float] = []
+        self._out_y: list[float] = []
+        self._filling_id = -1
+        self._filling: list[tuple[np.ndarray, np.ndarray]] = []
+        self._pending: tuple[np.ndarray, np.ndarray] | None = None
+        # The newest point is held back: it is only known to be the final
+        # one (always kept) once the stream ends.
+        self._held: tuple[np.ndarray, np.ndarray] | None = None
+
+    def feed(self, x: np.ndarray, y: np.ndarray):
+        if len(x) == 0:
+            return
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if self._held is not None:
+            x = np.concatenate([self._held[0], x])
+            y = np.concatenate([self._held[1], y])
+        self._held = (x[-1:], y[-1:])
+        x, y = x[:-1], y[:-1]
+        if len(x) == 0:
+            return
+
+        start = self._seen
+        self._seen += len(x)
+
+        if self.passthrough:
+            self._out_x.extend(x.tolist())
+            self._out_y.extend(y.tolist())
+            return
+
+        if start == 0:
+            # The first point is always kept.
+            self._out_x.append(float(x[0]))
+            self._out_y.append(float(y[0]))
+            x, y = x[1:], y[1:]
+            start = 1
+            if len(x) == 0:
+                return
+
+        # Bucket i holds points [floor(i * every) + 1, floor((i + 1) * every) + 1).
+        # Rows that arrived after the COUNT land in the last middle bucket.
+        idx = np.arange(start, start + len(x))
+        ids = np.ceil(idx / self.every).astype(np.int64) - 1
+        ids = np.clip(ids, 0, self.threshold - 3)
+
+        cuts = np.flatnonzero(np.diff(ids)) + 1
+        for part_x, part_y, bucket_id in zip(
+            np.split(x, cuts), np.split(y, cuts), ids[np.r_[0, cuts]]
+        ):
+            if bucket_id != self._filling_id:
+                self._close_bucket()
+                self._filling_id = int(bucket_id)
+            self._filling.append((part_x, part_y))
+
+    def _close_bucket(self):
+        if not self._filling:
+            return
+        bx = np.concatenate([p[0] for p in self._filling])
+        by = np.concatenate([p[1] for p in self._filling])
+        self._filling = []
+
+        if self._pending is not None:
+            self._select(self._pending, bx.mean(), by.mean())
+        self._pending = (bx, by)
+
+    def _select(self, bucket, cx: float, cy: float):
+        bx, by = bucket
+        ax, ay = self._out_x[-1], self._out_y[-1]
+        area = np.abs((ax - cx) * (by - ay) - (ax - bx) * (cy - ay))
+        i = int(area.argmax())
+        self._out_x.append(float(bx[i]))
+        self._out_y.append(float(by[i]))
+
+    def finish(self) -> tuple[list[float], list[float]]:
+        if self._held is None:
+            return self._out_x, self._out_y
+
+        last_x, last_y = float(self._held[0][0]), float(self._held[1][0])
+        self._held = None
+        if not self.passthrough:
+            self._close_bucket()
+            if self._pending is not None:
+                self._select(self._pending, last_x, last_y)
+                self._pending = None
+        self._out_x.append(last_x)
+        self._out_y.append(last_y)
+        return self._out_x, self._out_y
@@ -0,0 +1,31 @@
+# Jakob Balkovec
+# time_utils.py
+
+import base64
+import datetime
+
+
+def to_utc(ts: datetime.datetime | None) -> datetime.datetime | None:
+    # Naive datetimes are treated as UTC (that is how they are stored).
+    if ts is None:
+        return None
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=datetime.timezone.utc)
+    return ts.astimezone(datetime.timezone.utc)
+
+
+def encode_cursor(ts: datetime.datetime, reading_id: int) -> str:
+    # Opaque keyset cursor over (timestamp, id).
+    micros = int(to_utc(ts).timestamp() * 1_000_000)
+    raw = f"{micros}:{reading_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        micros, reading_id = base64.urlsafe_b64decode(padded).decode().split(":")
+        ts = datetime.datetime.fromtimestamp(int(micros) / 1_000_000, tz=datetime.timezone.utc)
+        return ts, int(reading_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
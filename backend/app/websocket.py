@@ -2,17 +2,99 @@
 # Thu 27th Nov
 # websocket.py
 
-from fastapi import WebSocket, WebSocketDisconnect, status
-from typing import List
-from google.oauth2 import id_token
-from google.auth.transport import requests
+import asyncio
+import json
+import logging
+import time
+
+from fastapi import WebSocket, status
+
+from app.config import (
+    WS_COALESCE_MS,
+    WS_QUEUE_SIZE,
+    WS_SLOW_CLIENT_POLICY,
+)
+from app.metrics import E2E_SECONDS, WS_FANOUT_SECONDS
+from app.security import InvalidToken, User, token_verifier
+
+log = logging.getLogger(__name__)
+
+SLOW_CLIENT_POLICIES = ("drop_oldest", "disconnect")
+WILDCARD = "*"
+
+
+def encode_frame(payload) -> str:
+    # Same encoding as WebSocket.send_json.
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+
+def _observe_latency(message: dict, now: float):
+    ts = message.get("timestamp")
+    if isinstance(ts, (int, float)):
+        E2E_SECONDS.observe(max(0.0, now - ts))
+
+
+class _Client:
+    """One connection: a bounded outbound queue drained by its own sender task."""
+
+    __slots__ = ("websocket", "user", "queue", "task", "dropped", "subscriptions")
+
+    def __init__(self, websocket: WebSocket, user: User | None, queue_size: int):
+        self.websocket = websocket
+        self.user = user
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.task: asyncio.Task | None = None
+        self.dropped = 0
+        self.subscriptions: set[str] = set()
 
-from app.config import GOOGLE_CLIENT_ID
-from app.security import User
 
 class WebSocketManager:
-    def __init__(self):
-        self.active_connections: List[tuple[WebSocket, User]] = []
+    """
+    Fan-out to dashboard clients.
+
+    broadcast() only enqueues, so it costs O(1) per client and never waits
+    on a socket. A client whose queue is full is handled by the slow-client
+    policy:
+      - "drop_oldest": discard its oldest queued message (the client skips
+        intermediate readings but stays connected)
+      - "disconnect": evict it with close code 1013 (try again later)
+
+    Clients subscribe to sets of dev_eui (or WILDCARD, the default on
+    connect). An index from dev_eui to subscribers means each reading is
+    only enqueued for the clients that asked for that device.
+
+    Each message is JSON-encoded once and the same string is queued for
+    every recipient. With `coalesce_ms` > 0, readings arriving within the
+    window are sent as one JSON array frame per distinct recipient set
+    instead of one frame per reading.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = WS_QUEUE_SIZE,
+        slow_client_policy: str = WS_SLOW_CLIENT_POLICY,
+        coalesce_ms: int = WS_COALESCE_MS,
+    ):
+        if slow_client_policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(f"slow_client_policy must be one of {SLOW_CLIENT_POLICIES}")
+        self.queue_size = queue_size
+        self.slow_client_policy = slow_client_policy
+        self.clients: dict[WebSocket, _Client] = {}
+        self._wildcard: set[_Client] = set()
+        self._by_device: dict[str, set[_Client]] = {}
+
+        self.coalesce_s = max(0, coalesce_ms) / 1000.0
+        self._pending: list[dict] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+
+        self.frames_encoded = 0
+        self.messages_sent = 0
+        self.messages_dropped = 0
+        self.clients_evicted = 0
+
+    @property
+    def active_connections(self) -> list[tuple[WebSocket, User | None]]:
+        return [(c.websocket, c.user) for c in self.clients.values()]
 
     async def connect(self, websocket: WebSocket):
         # Expect the token to arrive in subprotocol list: ["Bearer <token>"]
@@ -27,41 +109,217 @@ class WebSocketManager:
             return
 
         try:
-            idinfo = id_token.verify_oauth2_token(
-                token, requests.Request(), GOOGLE_CLIENT_ID
-            )
-        except Exception:
+            user = token_verifier.user(token)
+        except InvalidToken:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
 
-        user = User(
-            email=idinfo.get("email"),
-            name=idinfo.get("name"),
-            picture=idinfo.get("picture")
-        )
-
         # Accept the connection and record user
         await websocket.accept(subprotocol=f"Bearer {token}")
-        self.active_connections.append((websocket, user))
-        print(f"WS Connected: {user.email}")
+        self.register(websocket, user)
+        log.info("Client connected", extra={"user": user.email})
+
+    def register(self, websocket: WebSocket, user: User | None = None) -> _Client:
+        # For an already-accepted socket; must run on the event loop.
+        client = _Client(websocket, user, self.queue_size)
+        client.task = asyncio.create_task(self._sender(client))
+        self.clients[websocket] = client
+        self.subscribe(websocket, [WILDCARD])
+        return client
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections = [
-            (ws, user) for ws, user in self.active_connections if ws != websocket
-        ]
-        print("WS Disconnected")
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return
+        self._unindex(client, list(client.subscriptions))
+        if client.task and client.task is not asyncio.current_task():
+            client.task.cancel()
+        log.info("Client disconnected", extra={"clients": len(self.clients)})
+
+    def subscribe(self, websocket: WebSocket, dev_euis) -> set[str]:
+        client = self.clients.get(websocket)
+        if client is None:
+            return set()
+        for eui in dev_euis:
+            client.subscriptions.add(eui)
+            if eui == WILDCARD:
+                self._wildcard.add(client)
+            else:
+                self._by_device.setdefault(eui, set()).add(client)
+        return client.subscriptions
+
+    def unsubscribe(self, websocket: WebSocket, dev_euis) -> set[str]:
+        client = self.clients.get(websocket)
+        if client is None:
+            return set()
+        self._unindex(client, dev_euis)
+        return client.subscriptions
+
+    def _unindex(self, client: _Client, dev_euis):
+        for eui in dev_euis:
+            client.subscriptions.discard(eui)
+            if eui == WILDCARD:
+                self._wildcard.discard(client)
+                continue
+            subscribers = self._by_device.get(eui)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self._by_device[eui]
+
+    def subscribers(self, dev_eui: str | None) -> set[_Client]:
+        targets = self._by_device.get(dev_eui) if dev_eui else None
+        if not targets:
+            return self._wildcard
+        if not self._wildcard:
+            return targets
+        return self._wildcard | targets
+
+    def send_to(self, websocket: WebSocket, message: dict):
+        # Direct reply to one client (acks, errors), same queue as updates.
+        client = self.clients.get(websocket)
+        if client is not None:
+            self._enqueue(client, encode_frame(message))
+
+    def handle_message(self, websocket: WebSocket, raw: str):
+        """
+        Client control messages:
+          {"action": "subscribe",   "dev_euis": ["a1b2...", ...]}
+          {"action": "unsubscribe", "dev_euis": ["*"]}
+        "*" is the wildcard (every device); new clients start on it, so a
+        client that wants a subset unsubscribes "*" and subscribes its EUIs.
+        Each message is answered with the resulting subscription set.
+        """
+        try:
+            data = json.loads(raw)
+            action = data["action"]
+            dev_euis = data["dev_euis"]
+            if isinstance(dev_euis, str):
+                dev_euis = [dev_euis]
+            if action not in ("subscribe", "unsubscribe") or not isinstance(dev_euis, list):
+                raise ValueError
+            dev_euis = [str(e) for e in dev_euis]
+        except Exception:
+            self.send_to(websocket, {
+                "type": "error",
+                "detail": 'expected {"action": "subscribe"|"unsubscribe", "dev_euis": [...]}',
+            })
+            return
+
+        if action == "subscribe":
+            subscriptions = self.subscribe(websocket, dev_euis)
+        else:
+            subscriptions = self.unsubscribe(websocket, dev_euis)
+        self.send_to(websocket, {"type": "subscriptions", "dev_euis": sorted(subscriptions)})
 
     async def broadcast(self, message: dict):
-        living = []
-        for conn, user in self.active_connections:
-            try:
-                await conn.send_json(message)
-                living.append((conn, user))
-            except WebSocketDisconnect:
-                pass
-            except Exception:
-                pass
-        self.active_connections = living
+        if self.coalesce_s:
+            self._pending.append(message)
+            if self._flush_handle is None:
+                self._flush_handle = asyncio.get_running_loop().call_later(
+                    self.coalesce_s, self._flush_pending
+                )
+            return
+
+        _observe_latency(message, time.time())
+        targets = self.subscribers(message.get("dev_eui"))
+        if not targets:
+            return
+        start = time.perf_counter()
+        frame = encode_frame(message)
+        self.frames_encoded += 1
+        for client in list(targets):
+            self._enqueue(client, frame)
+        WS_FANOUT_SECONDS.observe(time.perf_counter() - start)
+
+    def _flush_pending(self):
+        self._flush_handle = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        now = time.time()
+        for message in pending:
+            _observe_latency(message, now)
+        start = time.perf_counter()
+
+        # Wildcard clients all get the whole window in one shared frame.
+        wildcard = list(self._wildcard)
+        if wildcard:
+            frame = encode_frame(pending)
+            self.frames_encoded += 1
+            for client in wildcard:
+                self._enqueue(client, frame)
+
+        # Everyone else gets the readings for their devices; clients with
+        # the same selection share one encoded frame.
+        selected: dict[_Client, list[int]] = {}
+        for i, message in enumerate(pending):
+            for client in self._by_device.get(message.get("dev_eui"), ()):
+                if client not in self._wildcard:
+                    selected.setdefault(client, []).append(i)
+
+        frames: dict[tuple[int, ...], str] = {}
+        for client, indices in selected.items():
+            key = tuple(indices)
+            frame = frames.get(key)
+            if frame is None:
+                frame = frames[key] = encode_frame([pending[i] for i in indices])
+                self.frames_encoded += 1
+            self._enqueue(client, frame)
+        WS_FANOUT_SECONDS.observe(time.perf_counter() - start)
+
+    def _enqueue(self, client: _Client, frame: str):
+        try:
+            client.queue.put_nowait(frame)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        self.messages_dropped += 1
+        client.dropped += 1
+        if self.slow_client_policy == "drop_oldest":
+            client.queue.get_nowait()
+            client.queue.put_nowait(frame)
+            return
+
+        self.clients_evicted += 1
+        self.disconnect(client.websocket)
+        asyncio.create_task(self._close(client.websocket))
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        except Exception:
+            pass
+
+    async def _sender(self, client: _Client):
+        try:
+            while True:
+                frame = await client.queue.get()
+                await client.websocket.send_text(frame)
+                self.messages_sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Socket gone; stop tracking it.
+            self.disconnect(client.websocket)
+
+    def stats(self) -> dict:
+        depths = [c.queue.qsize() for c in self.clients.values()]
+        return {
+            "connections": len(depths),
+            "wildcard_subscribers": len(self._wildcard),
+            "subscribed_devices": len(self._by_device),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "queue_size": self.queue_size,
+            "slow_client_policy": self.slow_client_policy,
+            "coalesce_ms": round(self.coalesce_s * 1000),
+            "frames_encoded": self.frames_encoded,
+            "messages_sent": self.messages_sent,
+            "messages_dropped": self.messages_dropped,
+            "clients_evicted": self.clients_evicted,
+        }
 
 
 ws_manager = WebSocketManager()
@@ -0,0 +1,121 @@
+# Jakob Balkovec
+# bench_async_reads.py
+# Read API latency: sync session (threadpool) vs async session, N concurrent clients
+#
+#   python -m tests.bench_async_reads --clients 500 --requests 5000
+#
+# Runs in-process against a scratch SQLite DB (or DATABASE_URL if set) and
+# prints one JSON object with p50/p99 latency and throughput per variant.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+_scratch = os.path.join(tempfile.mkdtemp(prefix="mdr_bench_"), "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_scratch}")
+
+import httpx  # noqa: E402
+from fastapi import Depends  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.crud import get_readings_page  # noqa: E402
+from app.db.session import SessionLocal, get_db  # noqa: E402
+from app.ingest import persist_batch  # noqa: E402
+
+
+def sync_readings(dev_eui: str, limit: int = 50, db=Depends(get_db)):
+    # The pre-async shape of the route, for comparison.
+    return get_readings_page(db, dev_eui, limit=limit)
+
+
+app.add_api_route("/bench/sync/readings/{dev_eui}", sync_readings)
+
+
+def seed(devices: int, rows_per_device: int):
+    now = int(time.time())
+    batch = []
+    with SessionLocal() as db:
+        for i in range(rows_per_device):
+            for d in range(devices):
+                raw = random.randint(10600, 12400)
+                batch.append({
+                    "dev_eui": f"bench{d:04d}",
+                    "timestamp": now - (rows_per_device - i) * 60,
+                    "raw_value": raw,
+                    "moisture_pct": 50.0,
+                })
+            if len(batch) >= 5000:
+                persist_batch(db, batch)
+                batch = []
+        if batch:
+            persist_batch(db, batch)
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[k]
+
+
+async def drive(path_fmt: str, devices: int, clients: int, total: int) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    remaining = total
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                url = path_fmt.format(dev=f"bench{random.randrange(devices):04d}")
+                t0 = time.perf_counter()
+                resp = await client.get(url)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                if resp.status_code != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p90_ms": round(percentile(latencies, 90), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--rows-per-device", type=int, default=200)
+    args = parser.parse_args()
+
+    seed(args.devices, args.rows_per_device)
+
+    result = {
+        "database_url": os.environ["DATABASE_URL"],
+        "clients": args.clients,
+        "sync": asyncio.run(
+            drive("/bench/sync/readings/{dev}?limit=50", args.devices, args.clients, args.requests)
+        ),
+        "async": asyncio.run(
+            drive("/api/readings/{dev}?limit=50", args.devices, args.clients, args.requests)
+        ),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
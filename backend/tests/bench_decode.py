@@ -0,0 +1,99 @@
+# Jakob Balkovec
+# bench_decode.py
+# Per-message decode + calibration vs the vectorized batch path
+#
+#   python -m tests.bench_decode --batch 500 --rounds 200
+#
+# Checks both paths agree bit for bit, then prints one JSON object with
+# per-reading cost for each.
+
+import argparse
+import base64
+import json
+import random
+import time
+
+from app.decode import RAW_VALUE_MAX, decode_base64_to_decimal, decode_batch
+from app.utils.calibration import convert_to_percentage
+
+
+def hex_round_trip(b64: str) -> int:
+    # The pre-batch decoder: base64 -> hex string -> int(hex, 16).
+    return int(base64.b64decode(b64).hex(), 16)
+
+
+def make_payloads(n: int, widths=(2,)) -> list[str]:
+    out = []
+    for _ in range(n):
+        w = random.choice(widths)
+        value = random.randrange(1 << (8 * w - 1), 1 << (8 * w))
+        out.append(base64.b64encode(value.to_bytes(w, "big")).decode())
+    return out
+
+
+def check():
+    odd = ["", "!!", "A", "MGx=", "MG\nw=", "A===", "=AAA", "AA=A", "AAAAAAA=", "éAA="]
+    for payloads in (
+        make_payloads(2000, widths=range(1, 10)) + odd,
+        make_payloads(2000, widths=(2,)),
+        odd,
+    ):
+        check_against_scalar(payloads)
+
+    mixed = [11000, "MGw=", 12364, 10656]
+    raw, pct, valid = decode_batch(mixed)
+    assert valid.all()
+    assert pct.tolist() == [convert_to_percentage(int(r)) for r in raw]
+
+
+def check_against_scalar(payloads: list[str]):
+    raw, pct, valid = decode_batch(payloads)
+    for i, p in enumerate(payloads):
+        try:
+            expected = decode_base64_to_decimal(p)
+        except ValueError:
+            assert not valid[i], p
+            continue
+        if expected > RAW_VALUE_MAX:
+            assert not valid[i], p
+            continue
+        assert valid[i] and raw[i] == expected == hex_round_trip(p), p
+        assert pct[i] == convert_to_percentage(expected), p
+
+
+def bench(fn, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    check()
+    payloads = make_payloads(args.batch)
+
+    def scalar():
+        return [convert_to_percentage(hex_round_trip(p)) for p in payloads]
+
+    def batched():
+        return decode_batch(payloads)
+
+    t_scalar = bench(scalar, args.rounds)
+    t_batch = bench(batched, args.rounds)
+    print(json.dumps({
+        "batch": args.batch,
+        "scalar_us_per_reading": round(t_scalar / args.batch * 1e6, 3),
+        "batch_us_per_reading": round(t_batch / args.batch * 1e6, 3),
+        "speedup": round(t_scalar / t_batch, 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+# Jakob Balkovec
+# bench_ingest.py
+# End-to-end ingest load: simulated devices -> MQTT -> DB -> WebSocket clients
+#
+#   python -m tests.bench_ingest --devices 5000 --rate 2000 --duration 20 --ws-clients 20
+#   python -m tests.bench_ingest --via broker --packed 6 --output bench.jsonl
+#
+# The app runs in-process against a scratch SQLite DB (or DATABASE_URL if
+# set) with its lifespan, writer and WebSocket manager as in production.
+# Uplinks come from a publisher thread at a fixed aggregate rate (0 = as
+# fast as possible), either straight into app.mqtt.on_message ("direct",
+# the paho network thread's view) or through tests.mqtt_broker ("broker",
+# adds paho + TCP on both sides). WebSocket clients attach to /ws/updates
+# over ASGI, so socket writes are not included. Everything shares one
+# interpreter: numbers are a floor for a dedicated server.
+#
+# Prints one JSON object: publish and ingest rates, DB rows/s, backlog and
+# drain time, and per-reading publish -> WebSocket latency percentiles.
+# --output appends it as one line to a file, for tracking across commits.
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+
+from tests.mqtt_broker import StandInBroker
+
+WS_KEY = "bench-ws-key"
+APPLICATION = "soilmoisture"  # the app subscribes to this application only
+
+
+class _Msg:
+    # What paho hands on_message.
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def latency_summary(ms: list[float]) -> dict:
+    return {
+        "samples": len(ms),
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p90_ms": round(percentile(ms, 90), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+        "max_ms": round(max(ms, default=0.0), 2),
+    }
+
+
+class Publisher(threading.Thread):
+    """
+    Sends `total` uplinks round-robin over `devices` at `rate` per second.
+    Every reading gets a per-device timestamp that is unique, so a
+    WebSocket frame maps back to the moment its uplink was published.
+    """
+
+    def __init__(self, send, devices: int, total: int, rate: float, packed: int):
+        super().__init__(name="bench-publisher", daemon=True)
+        self.send = send
+        self.devices = [f"{i:016x}" for i in range(devices)]
+        self.total = total
+        self.rate = rate
+        self.packed = packed
+        self.sent_at: dict[tuple[str, int], float] = {}
+        self.started = 0.0
+        self.finished = 0.0
+        self.sent = 0
+        self.readings = 0
+
+    def _uplink(self, i: int) -> tuple[str, bytes, list[int]]:
+        from app.payloads import LAYOUTS
+
+        dev = self.devices[i % len(self.devices)]
+        per_uplink = max(1, self.packed)
+        rounds = -(-self.total // len(self.devices))
+        ts = int(time.time()) - rounds * per_uplink + (i // len(self.devices)) * per_uplink
+        if self.packed:
+            values = [random.randint(10600, 12400) for _ in range(self.packed)]
+            data = LAYOUTS["packed_u16"].pack(values, interval=1)
+            stamps = [ts - (self.packed - 1 - j) for j in range(self.packed)]
+        else:
+            data = random.randint(10600, 12400).to_bytes(2, "big")
+            stamps = [ts]
+        body = {"devEUI": dev, "timestamp": ts, "data": base64.b64encode(data).decode()}
+        topic = f"application/{APPLICATION}/device/{dev}/rx"
+        return topic, json.dumps(body).encode(), [(dev, s) for s in stamps]
+
+    def run(self):
+        uplinks = [self._uplink(i) for i in range(self.total)]
+        self.started = time.perf_counter()
+        while self.sent < self.total:
+            if self.rate > 0:
+                due = min(self.total, int((time.perf_counter() - self.started) * self.rate) + 1)
+            else:
+                due = self.total
+            while self.sent < due:
+                topic, payload, keys = uplinks[self.sent]
+                now = time.perf_counter()
+                for key in keys:
+                    self.sent_at[key] = now
+                self.send(topic, payload)
+                self.sent += 1
+                self.readings += len(keys)
+            if self.rate > 0:
+                time.sleep(0.001)
+        self.finished = time.perf_counter()
+
+
+class AsgiWebSocket:
+    """A /ws/updates client speaking ASGI directly to the app."""
+
+    # Every recipient is handed the same frame string; decode it once.
+    _decoded: dict[str, list[tuple[str, int]]] = {}
+
+    def __init__(self, app, index: int, sent_at: dict):
+        self.app = app
+        self.index = index
+        self.sent_at = sent_at
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.accepted = asyncio.Event()
+        self.closed = False
+        self.frames = 0
+        self.readings = 0
+        self.latencies_ms: list[float] = []
+        self.task: asyncio.Task | None = None
+
+    async def connect(self):
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": "/ws/updates",
+            "raw_path": b"/ws/updates",
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(b"host", b"bench"), (b"sec-websocket-protocol", WS_KEY.encode())],
+            "subprotocols": [WS_KEY],
+            "client": ("127.0.0.1", 10000 + self.index),
+            "server": ("bench", 80),
+            "state": {},
+        }
+        self.task = asyncio.create_task(self.app(scope, self.inbox.get, self._send))
+        await self.inbox.put({"type": "websocket.connect"})
+        await self.accepted.wait()
+        if self.closed:
+            raise RuntimeError("WebSocket rejected")
+
+    async def close(self):
+        await self.inbox.put({"type": "websocket.disconnect", "code": 1000})
+        try:
+            await asyncio.wait_for(self.task, 5)
+        except Exception:
+            self.task.cancel()
+
+    async def _send(self, message: dict):
+        kind = message["type"]
+        if kind == "websocket.send":
+            self._on_frame(message.get("text") or "", time.perf_counter())
+        elif kind == "websocket.accept":
+            self.accepted.set()
+        elif kind == "websocket.close":
+            self.closed = True
+            self.accepted.set()
+
+    def _on_frame(self, text: str, now: float):
+        keys = self._decoded.get(text)
+        if keys is None:
+            data = json.loads(text)
+            items = data if isinstance(data, list) else [data]
+            keys = [(r["dev_eui"], r["timestamp"]) for r in items if "dev_eui" in r]
+            if len(self._decoded) > 50_000:
+                self._decoded.clear()
+            self._decoded[text] = keys
+        self.frames += 1
+        for key in keys:
+            sent = self.sent_at.get(key)
+            if sent is not None:
+                self.readings += 1
+                self.latencies_ms.append((now - sent) * 1000)
+
+
+async def lifespan(app):
+    inbox: asyncio.Queue = asyncio.Queue()
+    started, stopped = asyncio.Event(), asyncio.Event()
+
+    async def send(message):
+        if message["type"].startswith("lifespan.startup"):
+            started.set()
+        elif message["type"].startswith("lifespan.shutdown"):
+            stopped.set()
+
+    task = asyncio.create_task(
+        app({"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}}, inbox.get, send)
+    )
+    await inbox.put({"type": "lifespan.startup"})
+    await started.wait()
+
+    async def shutdown():
+        await inbox.put({"type": "lifespan.shutdown"})
+        await stopped.wait()
+        await task
+
+    return shutdown
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+async def run(args) -> dict:
+    from app.main import app
+    from app.mqtt import on_message, uplink_pool
+    from app.ingest import ingest_writer
+    from app.websocket import ws_manager
+
+    shutdown = await lifespan(app)
+    clients = [AsgiWebSocket(app, i, {}) for i in range(args.ws_clients)]
+
+    total = int(args.rate * args.duration) if args.rate > 0 else args.messages
+    if args.via == "broker":
+        import paho.mqtt.client as mqtt
+
+        pub = mqtt.Client(client_id="bench-publisher")
+        pub.max_queued_messages_set(0)
+        pub.connect("127.0.0.1", int(os.environ["MQTT_PORT"]))
+        pub.loop_start()
+
+        def send(topic, payload):
+            pub.publish(topic, payload)
+    else:
+        pub = None
+        userdata = {"pool": uplink_pool}
+
+        def send(topic, payload):
+            on_message(None, userdata, _Msg(topic, payload))
+
+    publisher = Publisher(send, args.devices, total, args.rate, args.packed)
+    for c in clients:
+        c.sent_at = publisher.sent_at
+        await c.connect()
+
+    # Give the app's MQTT subscription a moment in broker mode.
+    await asyncio.sleep(0.5 if pub else 0)
+    base_stored = ingest_writer.stored
+    expected = total * max(1, args.packed)
+
+    publisher.start()
+    while publisher.is_alive():
+        await asyncio.sleep(0.05)
+    backlog = uplink_pool.depth() + ingest_writer.depth()
+    publish_end = time.perf_counter()
+
+    # Done when every uplink is stored or accounted for (parse-queue
+    # overflow, invalid, dropped batches) and the WebSocket queues are
+    # empty; frames dropped for slow clients never arrive.
+    per_uplink = max(1, args.packed)
+    deadline = publish_end + args.drain_timeout
+    stored_at = None
+    idle_polls = 0
+    while time.perf_counter() < deadline:
+        handled = (
+            ingest_writer.stored - base_stored
+            + ingest_writer.dropped + ingest_writer.undecodable
+            + (uplink_pool.overflowed + uplink_pool.invalid) * per_uplink
+        )
+        if stored_at is None and handled >= expected:
+            stored_at = time.perf_counter()
+        if stored_at is not None:
+            idle = ws_manager.stats()["queue_depth_total"] == 0
+            idle_polls = idle_polls + 1 if idle else 0
+            if idle_polls >= 5 or all(c.readings >= expected for c in clients):
+                break
+        await asyncio.sleep(0.01)
+    end = stored_at or time.perf_counter()
+
+    stored = ingest_writer.stored - base_stored
+    window = max(1e-9, end - publisher.started)
+    latencies = [ms for c in clients for ms in c.latencies_ms]
+    ws_stats = ws_manager.stats()
+
+    for c in clients:
+        await c.close()
+    if pub is not None:
+        pub.loop_stop()
+        pub.disconnect()
+    parse_stats = uplink_pool.stats()
+    writer_stats = ingest_writer.stats()
+    await shutdown()
+
+    publish_s = publisher.finished - publisher.started
+    return {
+        "revision": git_revision(),
+        "timestamp": int(time.time()),
+        "config": {
+            "via": args.via,
+            "devices": args.devices,
+            "rate": args.rate,
+            "duration_s": args.duration,
+            "packed": args.packed,
+            "ws_clients": args.ws_clients,
+            "database_url": os.environ["DATABASE_URL"],
+            "batch_size": ingest_writer.batch_size,
+            "max_latency_ms": round(ingest_writer.max_latency * 1000),
+            "parse_workers": uplink_pool.workers,
+            "ws_coalesce_ms": ws_stats["coalesce_ms"],
+        },
+        "publish": {
+            "uplinks": publisher.sent,
+            "readings": publisher.readings,
+            "seconds": round(publish_s, 3),
+            "uplinks_per_s": round(publisher.sent / max(publish_s, 1e-9), 1),
+        },
+        "ingest": {
+            "uplinks_per_s": round(parse_stats["parsed"] / window, 1),
+            "db_rows": stored,
+            "db_rows_per_s": round(stored / window, 1),
+            "backlog_at_publish_end": backlog,
+            "drain_s": round(end - publish_end, 3),
+            "complete": stored_at is not None,
+            "overflowed": parse_stats["overflowed"],
+            "invalid": parse_stats["invalid"],
+            "dropped": writer_stats["dropped"],
+            "retries": writer_stats["retries"],
+        },
+        "websocket": {
+            "clients": len(clients),
+            "frames_encoded": ws_stats["frames_encoded"],
+            "readings_received": sum(c.readings for c in clients),
+            "readings_expected": expected * len(clients),
+            "messages_dropped": ws_stats["messages_dropped"],
+            "latency": latency_summary(latencies),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end ingest load benchmark")
+    parser.add_argument("--devices", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=1000, help="uplinks/s, 0 = max speed")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load at --rate")
+    parser.add_argument("--messages", type=int, default=20000, help="uplinks when --rate 0")
+    parser.add_argument("--packed", type=int, default=0, help="samples per uplink (packed_u16)")
+    parser.add_argument("--ws-clients", type=int, default=10)
+    parser.add_argument("--via", choices=["direct", "broker"], default="direct")
+    parser.add_argument("--drain-timeout", type=float, default=60)
+    parser.add_argument("--output", help="append the result as one JSON line")
+    args = parser.parse_args()
+
+    broker = StandInBroker()
+    port = broker.start()
+    scratch = os.path.join(tempfile.mkdtemp(prefix="mdr_bench_"), "ingest.db")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{scratch}")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["MQTT_BROKER"] = "127.0.0.1"
+    os.environ["MQTT_PORT"] = str(port)
+    os.environ["WS_API_KEY"] = WS_KEY
+    if args.packed:
+        os.environ["PAYLOAD_DECODERS"] = f"{APPLICATION}=packed_u16"
+
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        broker.stop()
+
+    line = json.dumps(result)
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(line + "\n")
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
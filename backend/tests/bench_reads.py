@@ -0,0 +1,332 @@
+# Jakob Balkovec
+# bench_reads.py
+# Read-path latency and memory over seeded databases of growing size
+#
+#   python -m tests.bench_reads --sizes 10k,1m --devices 200
+#   python -m tests.bench_reads --sizes 10m --postgres postgresql://bench@localhost/mdr_bench
+#
+# For each size, a child process seeds (or reuses) a database and drives
+# every read endpoint through the ASGI app in-process:
+#   - `--requests` calls each, at random devices, for p50/p90/p99/max
+#   - one extra traced call each for peak Python memory (tracemalloc)
+#
+# SQLite databases are cached in --cache-dir by size and device count, so
+# only the first run pays for seeding. --postgres names a scratch
+# database: its tables are dropped and reseeded whenever the row count
+# differs. Postgres is skipped, with the reason, when its drivers or
+# server are unavailable.
+#
+# Prints one JSON object with a result per (backend, size); --output
+# appends it as one line to a file, for tracking across commits.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SUFFIXES = {"k": 1_000, "m": 1_000_000}
+READING_INTERVAL_S = 900
+SEED_CHUNK = 50_000
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    if text[-1:] in SUFFIXES:
+        return int(float(text[:-1]) * SUFFIXES[text[-1]])
+    return int(text)
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[k]
+
+
+# ---- child: seed + measure one database ----
+
+def seed(rows: int, devices: int, log) -> dict:
+    """
+    `devices` random-walk series, one reading every 15 min, inserted in
+    time order (interleaved across devices, as ingest writes them), then
+    rollups rebuilt from the raw rows. Reuses a database that already
+    holds exactly `rows` readings.
+    """
+    import datetime
+
+    import numpy as np
+    from sqlalchemy import delete, func, insert, select
+
+    import app.db.models  # noqa: F401  (register tables)
+    from app.db.models import Device, SensorReading
+    from app.db.session import Base, SessionLocal, engine
+    from app.rollups import BUCKETS, backfill_rollups
+    from app.utils.calibration import convert_to_percentage_array
+
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        existing = db.execute(select(func.count()).select_from(SensorReading)).scalar()
+        if existing == rows:
+            return {"seeded": False, "seed_s": 0.0, "rollup_s": 0.0}
+        for model in [SensorReading, Device] + [m for m, _ in BUCKETS.values()]:
+            db.execute(delete(model))
+        db.commit()
+
+    started = time.perf_counter()
+    rng = np.random.default_rng(42)
+    steps = -(-rows // devices)
+    euis = [f"{i:016x}" for i in range(devices)]
+    # One column per device, one row per 15 min step.
+    walk = rng.normal(0, 40, size=(steps, devices)).cumsum(axis=0)
+    raw = np.clip(rng.integers(10800, 12200, size=devices) + walk, 10000, 13000).astype(np.int64)
+    pct = convert_to_percentage_array(raw.ravel()).reshape(raw.shape)
+    end = int(time.time()) // READING_INTERVAL_S * READING_INTERVAL_S
+    first = end - (steps - 1) * READING_INTERVAL_S
+    jitter = rng.integers(0, 30, size=devices)
+
+    with engine.begin() as conn:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        conn.execute(insert(Device), [
+            {"dev_eui": e, "nickname": f"bench {i}", "installation_date": now}
+            for i, e in enumerate(euis)
+        ])
+
+    done = 0
+    step = 0
+    utc = datetime.timezone.utc
+    while done < rows:
+        batch = []
+        while len(batch) < SEED_CHUNK and done + len(batch) < rows and step < steps:
+            base = first + step * READING_INTERVAL_S
+            for d in range(min(devices, rows - done - len(batch))):
+                batch.append({
+                    "dev_eui": euis[d],
+                    "timestamp": datetime.datetime.fromtimestamp(base + int(jitter[d]), utc),
+                    "raw_value": int(raw[step, d]),
+                    "moisture_pct": float(pct[step, d]),
+                })
+            step += 1
+        with engine.begin() as conn:
+            conn.execute(insert(SensorReading), batch)
+        done += len(batch)
+        log(f"seeded {done}/{rows}")
+    seed_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        backfill_rollups(db, chunk_size=SEED_CHUNK, progress=lambda n: log(f"rollups {n}/{rows}"))
+    return {
+        "seeded": True,
+        "seed_s": round(seed_s, 1),
+        "rollup_s": round(time.perf_counter() - started, 1),
+    }
+
+
+def endpoints(rows: int, devices: int) -> list[tuple[str, str, int]]:
+    """(name, path template, requests divisor) for every read route."""
+    day = middle_day(rows, devices)
+    return [
+        ("readings_recent", "/api/readings/{dev}?limit=100", 1),
+        ("readings_page_deep", "/api/readings/{dev}?limit=100&to=" + day[0], 1),
+        ("readings_window_day", f"/api/readings/{{dev}}?limit=1000&from={day[0]}&to={day[1]}", 1),
+        ("latest_cached", "/api/readings/latest/{dev}", 1),
+        ("device_info", "/api/devices/{dev}", 1),
+        ("devices_list", "/api/devices", 1),
+        ("devices_with_latest", "/api/devices?include_latest=true", 4),
+        ("devices_latest", "/api/devices/latest", 4),
+        ("aggregate_hour", "/api/readings/{dev}/aggregate?bucket=hour", 1),
+        ("aggregate_day", "/api/readings/{dev}/aggregate?bucket=day", 1),
+        ("downsample_500", "/api/readings/{dev}/downsample?points=500", 4),
+        ("export_csv", "/api/export/{dev}", 10),
+    ]
+
+
+def middle_day(rows: int, devices: int) -> tuple[str, str]:
+    # A day-long window ending halfway through the seeded span (or the
+    # whole span, when shorter), URL-safe ("Z" instead of "+00:00").
+    import datetime
+
+    span = -(-rows // devices) * READING_INTERVAL_S
+    end = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    end -= datetime.timedelta(seconds=span // 2)
+    start = end - datetime.timedelta(seconds=min(86400, span // 2))
+    fmt = "%Y-%m-%dT%H:%M:%SZ"
+    return start.strftime(fmt), end.strftime(fmt)
+
+
+async def measure(path: str, devices: int, requests: int, concurrency: int) -> dict:
+    import httpx
+
+    from app.main import app
+
+    euis = [f"{i:016x}" for i in range(devices)]
+    latencies: list[float] = []
+    sizes: list[int] = []
+    errors = 0
+    remaining = requests
+    transport = httpx.ASGITransport(app=app)
+
+    client = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None)
+    async with client:
+        async def one():
+            url = path.format(dev=random.choice(euis))
+            t0 = time.perf_counter()
+            resp = await client.get(url)
+            body = resp.content  # drains streaming responses
+            return (time.perf_counter() - t0) * 1000, len(body), resp.status_code
+
+        # Warm-up: connection pools, route compilation, first-touch pages.
+        await one()
+
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                ms, size, status = await one()
+                latencies.append(ms)
+                sizes.append(size)
+                if status != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        await one()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p90_ms": round(percentile(latencies, 90), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2),
+        "mean_bytes": int(sum(sizes) / len(sizes)),
+        "peak_traced_kib": round(peak / 1024, 1),
+    }
+
+
+def run_child(args) -> dict:
+    import resource
+
+    from sqlalchemy import make_url
+
+    def log(msg):
+        print(f"[bench_reads {args.rows}] {msg}", file=sys.stderr, flush=True)
+
+    url = make_url(os.environ["DATABASE_URL"])
+    result = {"backend": url.get_backend_name(), "rows": args.rows, "devices": args.devices}
+    result.update(seed(args.rows, args.devices, log))
+    if url.get_backend_name() == "sqlite" and url.database:
+        result["db_mib"] = round(os.path.getsize(url.database) / 2**20, 1)
+
+    result["endpoints"] = {}
+    for name, path, divisor in endpoints(args.rows, args.devices):
+        n = max(5, args.requests // divisor)
+        log(f"{name} x{n}")
+        result["endpoints"][name] = asyncio.run(
+            measure(path, args.devices, n, args.concurrency)
+        )
+    result["max_rss_mib"] = round(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+    )
+    return result
+
+
+# ---- parent: one child per (backend, size) ----
+
+def postgres_unavailable(url: str) -> str | None:
+    try:
+        import asyncpg  # noqa: F401
+        import psycopg2
+    except ImportError as e:
+        return f"driver missing: {e.name}"
+    try:
+        psycopg2.connect(url, connect_timeout=3).close()
+    except Exception as e:
+        return f"cannot connect: {e}".strip()
+    return None
+
+
+def spawn(database_url: str, rows: int, args) -> dict:
+    env = dict(os.environ, DATABASE_URL=database_url)
+    env.setdefault("LOG_LEVEL", "WARNING")
+    cmd = [
+        sys.executable, "-m", "tests.bench_reads", "--child",
+        "--rows", str(rows),
+        "--devices", str(args.devices),
+        "--requests", str(args.requests),
+        "--concurrency", str(args.concurrency),
+    ]
+    proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        return {"rows": rows, "error": f"child exited with {proc.returncode}"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read-path latency over seeded databases")
+    parser.add_argument("--sizes", default="10k,1m", help="row counts, e.g. 10k,1m,10m")
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=200, help="per endpoint (heavy ones fewer)")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument(
+        "--cache-dir", default=os.path.join(tempfile.gettempdir(), "mdr_bench_reads")
+    )
+    parser.add_argument("--postgres", default=os.environ.get("BENCH_POSTGRES_URL"),
+                        help="scratch Postgres URL (tables are replaced)")
+    parser.add_argument("--output", help="append the result as one JSON line")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--rows", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args)))
+        return
+
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    os.makedirs(args.cache_dir, exist_ok=True)
+    results = []
+    skipped = {}
+    for rows in sizes:
+        path = os.path.join(args.cache_dir, f"readings_{rows}_{args.devices}.db")
+        results.append(spawn(f"sqlite:///{path}", rows, args))
+    if args.postgres:
+        reason = postgres_unavailable(args.postgres)
+        if reason:
+            skipped["postgresql"] = reason
+        else:
+            for rows in sizes:
+                results.append(spawn(args.postgres, rows, args))
+
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        revision = None
+    report = {
+        "revision": revision,
+        "timestamp": int(time.time()),
+        "concurrency": args.concurrency,
+        "results": results,
+        "skipped": skipped,
+    }
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(report) + "\n")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
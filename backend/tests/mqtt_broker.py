@@ -0,0 +1,271 @@
+# Jakob Balkovec
+# mqtt_broker.py
+# Minimal in-process MQTT 3.1.1 broker stand-in for local ingest tests
+#
+#   python -m tests.mqtt_broker --port 1883
+#
+# QoS 0/1 publish (delivered at QoS 0), subscribe/unsubscribe with + and #
+# wildcards, ping, and "$share/<group>/<filter>" shared subscriptions. A
+# shared message goes to one group member, picked by topic hash (the
+# "hash_topic" strategy of EMQX and friends) or round robin.
+
+import argparse
+import asyncio
+import struct
+import threading
+import zlib
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def topic_matches(filt: str, topic: str) -> bool:
+    if topic.startswith("$") and not filt.startswith("$"):
+        return False
+    f_parts, t_parts = filt.split("/"), topic.split("/")
+    for i, f in enumerate(f_parts):
+        if f == "#":
+            return True
+        if i >= len(t_parts):
+            return False
+        if f != "+" and f != t_parts[i]:
+            return False
+    return len(f_parts) == len(t_parts)
+
+
+def _encode_length(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def _string(b: bytes, pos: int) -> tuple[str, int]:
+    (n,) = struct.unpack_from("!H", b, pos)
+    return b[pos + 2:pos + 2 + n].decode(), pos + 2 + n
+
+
+def publish_packet(topic: str, payload: bytes) -> bytes:
+    t = topic.encode()
+    body = struct.pack("!H", len(t)) + t + payload
+    return bytes([PUBLISH << 4]) + _encode_length(len(body)) + body
+
+
+class _Session:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.client_id = ""
+        self.filters: set[str] = set()
+        self.received = 0
+
+
+class StandInBroker:
+    """Runs on its own event loop thread; start() returns the bound port."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, strategy: str = "hash_topic"):
+        if strategy not in ("hash_topic", "round_robin"):
+            raise ValueError("strategy must be hash_topic or round_robin")
+        self.host = host
+        self.port = port
+        self.strategy = strategy
+        self.sessions: dict[str, _Session] = {}
+        # (group, filter) -> members in join order
+        self.groups: dict[tuple[str, str], list[_Session]] = {}
+        self._rr: dict[tuple[str, str], int] = {}
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._server = None
+        self._thread: threading.Thread | None = None
+        self._ready = threading.Event()
+        self._anon = 0
+
+    # ---- lifecycle ----
+
+    def start(self) -> int:
+        self._thread = threading.Thread(target=self._serve, name="mqtt-standin", daemon=True)
+        self._thread.start()
+        self._ready.wait(5)
+        return self.port
+
+    def stop(self):
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(5)
+
+    def _serve(self):
+        self.loop = asyncio.new_event_loop()
+        self._server = self.loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self.loop.run_forever()
+        self._server.close()
+        for s in list(self.sessions.values()):
+            s.writer.close()
+        tasks = asyncio.all_tasks(self.loop)
+        for t in tasks:
+            t.cancel()
+        if tasks:
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    # ---- introspection (thread-safe enough for tests) ----
+
+    def group_members(self, group: str) -> list[str]:
+        return sorted(
+            s.client_id
+            for (g, _), members in list(self.groups.items())
+            if g == group
+            for s in members
+        )
+
+    def subscribers(self, filt: str) -> list[str]:
+        return sorted(cid for cid, s in list(self.sessions.items()) if filt in s.filters)
+
+    def received_by(self) -> dict[str, int]:
+        return {cid: s.received for cid, s in list(self.sessions.items())}
+
+    # ---- protocol ----
+
+    async def _read_packet(self, reader: asyncio.StreamReader) -> tuple[int, int, bytes]:
+        head = (await reader.readexactly(1))[0]
+        length, mult = 0, 1
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * mult
+            if not byte & 0x80:
+                break
+            mult *= 128
+        body = await reader.readexactly(length) if length else b""
+        return head >> 4, head & 0x0F, body
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = _Session(writer)
+        try:
+            while True:
+                kind, flags, body = await self._read_packet(reader)
+                if kind == CONNECT:
+                    self._connect(session, body)
+                elif kind == PUBLISH:
+                    self._publish(session, flags, body)
+                elif kind == SUBSCRIBE:
+                    self._subscribe(session, body)
+                elif kind == UNSUBSCRIBE:
+                    self._unsubscribe(session, body)
+                elif kind == PINGREQ:
+                    writer.write(bytes([PINGRESP << 4, 0]))
+                elif kind == DISCONNECT:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._drop(session)
+            writer.close()
+
+    def _connect(self, session: _Session, body: bytes):
+        _, pos = _string(body, 0)  # protocol name
+        pos += 4  # level, flags, keepalive
+        client_id, _ = _string(body, pos)
+        if not client_id:
+            self._anon += 1
+            client_id = f"anon-{self._anon}"
+        # MQTT: a second connection with the same id takes over the session.
+        old = self.sessions.get(client_id)
+        if old is not None:
+            self._drop(old)
+            old.writer.close()
+        session.client_id = client_id
+        self.sessions[client_id] = session
+        session.writer.write(bytes([CONNACK << 4, 2, 0, 0]))
+
+    def _subscribe(self, session: _Session, body: bytes):
+        (pid,) = struct.unpack_from("!H", body, 0)
+        pos, granted = 2, bytearray()
+        while pos < len(body):
+            filt, pos = _string(body, pos)
+            pos += 1  # requested QoS
+            session.filters.add(filt)
+            if filt.startswith("$share/"):
+                _, group, inner = filt.split("/", 2)
+                members = self.groups.setdefault((group, inner), [])
+                if session not in members:
+                    members.append(session)
+            granted.append(0)
+        out = struct.pack("!H", pid) + bytes(granted)
+        session.writer.write(bytes([SUBACK << 4]) + _encode_length(len(out)) + out)
+
+    def _unsubscribe(self, session: _Session, body: bytes):
+        (pid,) = struct.unpack_from("!H", body, 0)
+        pos = 2
+        while pos < len(body):
+            filt, pos = _string(body, pos)
+            self._remove_filter(session, filt)
+        session.writer.write(bytes([UNSUBACK << 4, 2]) + struct.pack("!H", pid))
+
+    def _remove_filter(self, session: _Session, filt: str):
+        session.filters.discard(filt)
+        if filt.startswith("$share/"):
+            _, group, inner = filt.split("/", 2)
+            members = self.groups.get((group, inner), [])
+            if session in members:
+                members.remove(session)
+            if not members:
+                self.groups.pop((group, inner), None)
+
+    def _drop(self, session: _Session):
+        for filt in list(session.filters):
+            self._remove_filter(session, filt)
+        if self.sessions.get(session.client_id) is session:
+            del self.sessions[session.client_id]
+
+    def _publish(self, session: _Session, flags: int, body: bytes):
+        topic, pos = _string(body, 0)
+        qos = (flags >> 1) & 0x03
+        if qos:
+            (pid,) = struct.unpack_from("!H", body, pos)
+            pos += 2
+            session.writer.write(bytes([PUBACK << 4, 2]) + struct.pack("!H", pid))
+        self.route(topic, body[pos:])
+
+    def route(self, topic: str, payload: bytes):
+        packet = publish_packet(topic, payload)
+        targets: set[_Session] = set()
+        for s in self.sessions.values():
+            if any(not f.startswith("$share/") and topic_matches(f, topic) for f in s.filters):
+                targets.add(s)
+        for (group, filt), members in self.groups.items():
+            if not members or not topic_matches(filt, topic):
+                continue
+            if self.strategy == "hash_topic":
+                i = zlib.crc32(topic.encode()) % len(members)
+            else:
+                i = self._rr.get((group, filt), 0) % len(members)
+                self._rr[(group, filt)] = i + 1
+            targets.add(members[i])
+        for s in targets:
+            s.received += 1
+            s.writer.write(packet)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local MQTT broker stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--strategy", default="hash_topic", choices=["hash_topic", "round_robin"])
+    args = parser.parse_args()
+
+    broker = StandInBroker(args.host, args.port, args.strategy)
+    port = broker.start()
+    print(f"[BROKER] Listening on {args.host}:{port} ({args.strategy})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
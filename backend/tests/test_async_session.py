@@ -0,0 +1,81 @@
+# Jakob Balkovec
+# test_async_session.py
+# Read-API sessions: async engine setup and the threadpool fallback
+#
+#   python -m pytest tests/test_async_session.py
+
+import asyncio
+import datetime
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import app.db.models  # noqa: F401  (register tables)
+from app.crud import get_latest_reading_async, get_readings_page_async
+from app.db import async_session
+from app.db.async_session import ThreadedSession, _pool_args, to_async_url
+from app.db.models import SensorReading
+from app.db.session import Base
+
+T0 = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def test_urls_and_pool_arguments():
+    assert str(to_async_url("sqlite:///./x.db")) == "sqlite+aiosqlite:///./x.db"
+    assert to_async_url("postgresql://u@h/db").drivername == "postgresql+asyncpg"
+    assert to_async_url("postgresql+asyncpg://u@h/db").drivername == "postgresql+asyncpg"
+
+    assert _pool_args(make_url("sqlite+aiosqlite://")) == {}
+    assert _pool_args(make_url("sqlite+aiosqlite:///:memory:")) == {}
+    assert _pool_args(make_url("sqlite+aiosqlite:///x.db"))["pool_size"] == 1
+    assert _pool_args(make_url("postgresql+asyncpg://h/db"))["pool_size"] == 10
+
+    # In-memory SQLite is served from a StaticPool, which rejects pool sizing.
+    url = to_async_url("sqlite://")
+    asyncio.run(create_async_engine(url, **_pool_args(url)).dispose())
+
+
+def test_threaded_and_async_sessions_agree(tmp_path):
+    path = tmp_path / "reads.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(SensorReading), [
+            {"dev_eui": "a", "timestamp": T0 + datetime.timedelta(minutes=i),
+             "raw_value": 11000 + i, "moisture_pct": 50.0}
+            for i in range(20)
+        ])
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+    async def read(db):
+        latest = await get_latest_reading_async(db, "a")
+        page = await get_readings_page_async(db, "a", limit=5)
+        return latest.raw_value, [r.id for r in page]
+
+    async def both():
+        threaded = ThreadedSession(sessionmaker(bind=engine)())
+        try:
+            via_threads = await read(threaded)
+        finally:
+            threaded.close()
+        async with async_sessionmaker(async_engine)() as db:
+            via_async = await read(db)
+        await async_engine.dispose()
+        return via_threads, via_async
+
+    via_threads, via_async = asyncio.run(both())
+    assert via_threads == via_async == (11019, [20, 19, 18, 17, 16])
+
+
+def test_sync_reads_when_async_is_off(monkeypatch):
+    monkeypatch.setattr(async_session, "AsyncSessionLocal", None)
+
+    async def session_type():
+        gen = async_session.get_async_db()
+        db = await gen.__anext__()
+        await gen.aclose()
+        return type(db)
+
+    assert asyncio.run(session_type()) is ThreadedSession
@@ -0,0 +1,68 @@
+# Jakob Balkovec
+# test_cache.py
+# Latest-reading cache: forward-only updates, TTL and invalidation
+#
+#   python -m pytest tests/test_cache.py
+
+import datetime
+
+import pytest
+
+from app import cache
+from app.cache import LatestReadingCache
+
+T0 = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def reading(dev: str, minutes: int, raw: int = 11000) -> dict:
+    return {"dev_eui": dev, "timestamp": T0 + datetime.timedelta(minutes=minutes), "raw_value": raw}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entries_only_move_forward():
+    c = LatestReadingCache(ttl_s=0)
+    c.update_many([reading("a", 5, 1), reading("a", 10, 2), reading("a", 7, 3), reading("b", 1)])
+    assert c.get("a")["raw_value"] == 2
+
+    c.put(reading("a", 3, 4))  # late arrival
+    assert c.get("a")["raw_value"] == 2
+    c.put(reading("a", 10, 5))  # same instant: last write wins
+    assert c.get("a")["raw_value"] == 5
+    assert c.stats()["entries"] == 2
+
+
+def test_ttl_expires_entries(clock):
+    c = LatestReadingCache(ttl_s=30)
+    c.put(reading("a", 0))
+    clock[0] += 29
+    assert c.get("a") is not None
+    clock[0] += 2
+    assert c.get("a") is None
+    assert c.stats()["hit_rate"] == 0.5
+
+    forever = LatestReadingCache(ttl_s=0)
+    forever.put(reading("a", 0))
+    clock[0] += 10 ** 6
+    assert forever.get("a") is not None
+
+
+def test_refresh_after_expiry_and_invalidate(clock):
+    c = LatestReadingCache(ttl_s=30)
+    c.put(reading("a", 10, 1))
+    clock[0] += 60
+    # An expired entry still blocks older readings, but a refresh from
+    # the database with the same reading restarts its TTL.
+    c.put(reading("a", 10, 1))
+    assert c.get("a")["raw_value"] == 1
+
+    c.invalidate("a")
+    assert c.get("a") is None
+    c.put(reading("a", 1, 2))  # e.g. readings re-imported further back
+    assert c.get("a")["raw_value"] == 2
+    c.invalidate("missing")
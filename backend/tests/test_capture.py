@@ -0,0 +1,117 @@
+# Jakob Balkovec
+# test_capture.py
+# MQTT capture files: round trip, rotation, truncation, replay pacing and divergence
+#
+#   python -m pytest tests/test_capture.py
+
+import argparse
+import json
+import time
+
+import pytest
+
+from app import ingest
+from app.capture import CaptureWriter, capture_files, read_capture
+from app.replay import pace, replay
+
+TOPIC = "application/soilmoisture/device/a1b2c3d4e5f60708/rx"
+
+
+def write(path, records, **kwargs):
+    writer = CaptureWriter(str(path), **kwargs)
+    writer.start()
+    for arrival, topic, payload in records:
+        writer.record(topic, payload, arrival)
+    writer.stop()
+    return writer
+
+
+def test_round_trip_keeps_bytes_and_arrival_times(tmp_path):
+    records = [
+        (1_700_000_000.25 + i, TOPIC, b'{"devEUI":"a1","raw_value":%d}' % i) for i in range(50)
+    ]
+    records.append((1_700_000_100.5, TOPIC, b"\xff not json"))
+    writer = write(tmp_path / "cap", records)
+
+    assert list(read_capture(capture_files(str(tmp_path / "cap")))) == records
+    assert writer.records == 51 and writer.dropped == 0
+
+
+def test_rotation_keeps_order_across_backups(tmp_path):
+    path = tmp_path / "cap"
+    records = [(float(i), TOPIC, b"x" * 100) for i in range(40)]
+    writer = write(path, records, max_bytes=1000, backups=10)
+
+    files = capture_files(str(path))
+    assert writer.rotations == len(files) - 1 > 0
+    assert all(p.stat().st_size <= 1000 for p in tmp_path.iterdir())
+    assert [r[0] for r in read_capture(files)] == [r[0] for r in records]
+
+
+def test_rotation_discards_beyond_backups(tmp_path):
+    path = tmp_path / "cap"
+    write(path, [(float(i), TOPIC, b"x" * 100) for i in range(40)], max_bytes=1000, backups=1)
+
+    files = capture_files(str(path))
+    assert len(files) == 2
+    arrivals = [r[0] for r in read_capture(files)]
+    assert arrivals == sorted(arrivals) and arrivals[-1] == 39.0 and arrivals[0] > 0
+
+
+def test_truncated_tail_ends_the_file(tmp_path):
+    path = tmp_path / "cap"
+    write(path, [(1.0, TOPIC, b"one"), (2.0, TOPIC, b"two")])
+    with open(path, "r+b") as f:
+        f.truncate(path.stat().st_size - 2)
+
+    assert [r[2] for r in read_capture([str(path)])] == [b"one"]
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "not-a-capture"
+    path.write_bytes(b"hello world")
+    with pytest.raises(ValueError):
+        list(read_capture([str(path)]))
+
+
+def test_pace_scales_captured_gaps():
+    records = [(100.0, TOPIC, b""), (100.2, TOPIC, b""), (100.4, TOPIC, b"")]
+    lag = [0.0]
+    start = time.perf_counter()
+    assert list(pace(records, 4.0, lag)) == records
+    assert 0.09 < time.perf_counter() - start < 0.5
+
+    start = time.perf_counter()
+    list(pace(records, 0, lag))
+    assert time.perf_counter() - start < 0.05
+
+
+def test_replay_baseline_holds_decoded_rows(tmp_path, monkeypatch):
+    uplinks = [
+        b'{"devEUI":"a1","timestamp":1700000000,"raw_value":11500}',
+        b'{"devEUI":"a1","timestamp":1700000060,"data":"LOw="}',  # 11500
+        b"not json",
+    ]
+    write(tmp_path / "cap", [(float(i), TOPIC, p) for i, p in enumerate(uplinks)])
+
+    def run(**kwargs):
+        args = argparse.Namespace(
+            capture=str(tmp_path / "cap"), speed=0, dry_run=True, limit=None,
+            save_parsed=None, compare=None, examples=5,
+        )
+        vars(args).update(kwargs)
+        return replay(args)
+
+    baseline = tmp_path / "before.ndjson"
+    run(save_parsed=str(baseline))
+    lines = [json.loads(line) for line in baseline.read_text().splitlines()]
+    assert lines[2] is None
+    assert [row["raw_value"] for rows in lines[:2] for row in rows] == [11500, 11500]
+    assert set(lines[1][0]) == {"dev_eui", "timestamp", "raw_value", "moisture_pct"}
+
+    assert run(compare=str(baseline))["divergence"]["diverged"] == 0
+
+    # Same parsed uplinks, different calibration: the rows diverge.
+    monkeypatch.setattr(ingest.calibration_cache, "_bounds", {"a1": (13000, 10000)})
+    divergence = run(compare=str(baseline))["divergence"]
+    assert (divergence["compared"], divergence["diverged"]) == (3, 2)
@@ -0,0 +1,117 @@
+# Jakob Balkovec
+# test_columnar.py
+# Arrow IPC / Parquet export: schema, device set, range and streaming
+#
+#   python -m pytest tests/test_columnar.py
+
+import asyncio
+import datetime
+import functools
+import io
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+import app.db.models  # noqa: E402,F401  (register tables)
+from app.db.models import SensorReading  # noqa: E402
+from app.db.session import Base  # noqa: E402
+from app.routers import readings  # noqa: E402
+
+DEVICES = ["dev-a", "dev-b", "dev-c"]
+T0 = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'export.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(SensorReading), [
+            {
+                "dev_eui": eui,
+                "timestamp": T0 + datetime.timedelta(minutes=15 * i, milliseconds=250 * d),
+                "raw_value": 11000 + i,
+                "moisture_pct": 40.0 + i / 4,
+            }
+            for d, eui in enumerate(DEVICES)
+            for i in range(1000)
+        ])
+    monkeypatch.setattr(readings, "SessionLocal", sessionmaker(bind=engine))
+    # Small chunks and row groups, so both streams span many writes.
+    monkeypatch.setattr(readings, "EXPORT_CHUNK_SIZE", 128)
+    monkeypatch.setattr(
+        readings.columnar,
+        "parquet_stream",
+        functools.partial(readings.columnar.parquet_stream, row_group_rows=500),
+    )
+    monkeypatch.setattr(readings.device_registry, "dev_euis", lambda: DEVICES)
+
+    app = FastAPI()
+    app.include_router(readings.router)
+    return app
+
+
+def get(app, url):
+    async def fetch():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(url)
+
+    return asyncio.run(fetch())
+
+
+def test_arrow_stream_is_typed_and_complete(api):
+    resp = get(api, "/api/export?dev_eui=dev-b&dev_eui=dev-a")
+    assert resp.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pa.ipc.open_stream(resp.content).read_all()
+
+    assert table.schema.types == [
+        pa.dictionary(pa.int32(), pa.string()),
+        pa.timestamp("ms", tz="UTC"),
+        pa.float32(),
+        pa.int32(),
+    ]
+    assert table.num_rows == 2000
+    assert table.column("dev_eui").to_pylist()[::1000] == ["dev-b", "dev-a"]
+    first = table.slice(0, 1).to_pylist()[0]
+    assert first["timestamp"] == T0 + datetime.timedelta(milliseconds=250)
+    assert (first["raw_value"], first["moisture_pct"]) == (11000, 40.0)
+    millis = table.column("timestamp").cast(pa.int64()).to_pylist()
+    assert millis[1] == int(T0.timestamp() * 1000) + 900_250
+
+
+def test_range_and_compression(api):
+    url = (
+        "/api/export?dev_eui=dev-c&from=2025-01-02T00:00:00Z&to=2025-01-02T23:59:59Z"
+        "&compression=zstd"
+    )
+    table = pa.ipc.open_stream(get(api, url).content).read_all()
+    assert table.num_rows == 96
+    assert table.column("raw_value").to_pylist()[0] == 11096
+
+
+def test_parquet_covers_all_devices_in_row_groups(api):
+    resp = get(api, "/api/export?format=parquet")
+    assert resp.headers["content-type"] == "application/vnd.apache.parquet"
+    f = pq.ParquetFile(io.BytesIO(resp.content))
+    assert f.metadata.num_rows == 3000
+    assert f.metadata.num_row_groups > 1
+    table = f.read()
+    assert sorted(set(table.column("dev_eui").to_pylist())) == DEVICES
+    assert table.schema.field("moisture_pct").type == pa.float32()
+
+
+def test_no_rows_is_404_and_bad_format_is_rejected(api):
+    assert get(api, "/api/export?dev_eui=missing").status_code == 404
+    assert get(api, "/api/export?format=feather").status_code == 422
+
+
+def test_without_pyarrow_is_501(api, monkeypatch):
+    monkeypatch.setattr(readings.columnar, "pa", None)
+    assert get(api, "/api/export").status_code == 501
@@ -0,0 +1,115 @@
+# Jakob Balkovec
+# test_decode.py
+# Vectorized decode + calibration against the scalar path, and bad values
+#
+#   python -m pytest tests/test_decode.py
+
+import base64
+import json
+import random
+
+import numpy as np
+import pytest
+
+from app import ingest, mqtt
+from app.decode import RAW_VALUE_MAX, decode_base64_to_decimal, decode_batch
+from app.ingest import IngestWriter, decode_readings
+from app.payloads import LAYOUTS, DecoderRegistry
+from app.utils.calibration import convert_to_percentage
+
+ODD = ["", "!!", "A", "MGx=", "MG\nw=", "A===", "=AAA", "AA=A", "AAAAAAA=", "éAA=", "AA==AA=="]
+
+
+def payloads(n: int, seed: int = 11) -> list[str]:
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        width = rng.randint(1, 9)
+        value = rng.randrange(1 << (8 * width))
+        out.append(base64.b64encode(value.to_bytes(width, "big")).decode())
+    return out
+
+
+def scalar(p: str):
+    try:
+        value = decode_base64_to_decimal(p)
+    except ValueError:
+        return None
+    return value if value <= RAW_VALUE_MAX else None
+
+
+@pytest.mark.parametrize("batch", [payloads(3000) + ODD, payloads(500)[:1] * 64, ODD])
+def test_batch_matches_scalar_decoder(batch):
+    raw, pct, valid = decode_batch(batch, 12364, 10656)
+    for i, p in enumerate(batch):
+        expected = scalar(p)
+        if expected is None:
+            assert not valid[i] and raw[i] == 0, p
+        else:
+            assert valid[i] and raw[i] == expected, p
+            assert pct[i] == convert_to_percentage(expected, 12364, 10656), p
+
+
+def test_mixed_and_out_of_range_items_do_not_raise():
+    items = [11000, "MGw=", 2 ** 70, -(2 ** 40), RAW_VALUE_MAX, True, None, np.int64(12000)]
+    raw, pct, valid = decode_batch(items)
+    assert valid.tolist() == [True, True, False, False, True, False, False, True]
+    assert raw.tolist() == [11000, 12396, 0, 0, RAW_VALUE_MAX, 0, 0, 12000]
+
+    raw, pct, valid = decode_batch([11000, 2 ** 70, 2 ** 40])
+    assert valid.tolist() == [True, False, False]
+    assert pct[0] == convert_to_percentage(11000)
+
+
+def test_decode_readings_uses_per_device_calibration(monkeypatch):
+    monkeypatch.setattr(ingest.calibration_cache, "_bounds", {"b": (13000, 10000)})
+    batch = [
+        {"dev_eui": "a", "timestamp": 1, "raw_value": 11500},
+        {"dev_eui": "b", "timestamp": 1, "payload": "LOw="},  # 11500
+        {"dev_eui": "b", "timestamp": 1, "payload": "!!"},
+        {"dev_eui": "a", "timestamp": 1, "raw_value": 1, "moisture_pct": 12.5},
+    ]
+    out = decode_readings(batch)
+    assert [m["moisture_pct"] for m in out] == [
+        convert_to_percentage(11500),
+        convert_to_percentage(11500, 13000, 10000),
+        12.5,
+    ]
+    assert all("payload" not in m for m in out)
+
+
+def test_parse_rejects_values_the_column_cannot_hold(monkeypatch):
+    def uplink(**fields):
+        return json.dumps({"devEUI": "a1", "timestamp": 1_700_000_000, **fields})
+
+    assert mqtt.parse_message(uplink(raw_value=2 ** 70)) is None
+    assert mqtt.parse_message(uplink(raw_value=RAW_VALUE_MAX))["raw_value"] == RAW_VALUE_MAX
+
+    monkeypatch.setattr(mqtt, "decoder_registry", DecoderRegistry({"v2": "packed_u32"}))
+    data = LAYOUTS["packed_u32"].pack([11000, 2 ** 32 - 1, 12000], interval=60)
+    b64 = base64.b64encode(data).decode()
+    readings = mqtt.parse_message(uplink(data=b64, applicationName="v2"))
+    assert [r["raw_value"] for r in readings] == [11000, 12000]
+
+
+def test_writer_survives_failures_outside_the_commit(monkeypatch):
+    persisted = []
+    monkeypatch.setattr(ingest, "persist_batch", lambda db, batch: persisted.extend(batch))
+    refreshes = iter([RuntimeError("profiles table gone")])
+
+    def refresh():
+        error = next(refreshes, None)
+        if error:
+            raise error
+
+    monkeypatch.setattr(ingest.calibration_cache, "maybe_refresh", refresh)
+    writer = IngestWriter(batch_size=1, max_latency_ms=0)
+    writer.start()
+    writer.submit({"dev_eui": "a", "timestamp": 1_700_000_000, "raw_value": 11000})
+    writer.submit({"dev_eui": "a", "timestamp": 1_700_000_001, "raw_value": 2 ** 70})
+    writer.submit({"dev_eui": "a", "timestamp": 1_700_000_002, "raw_value": 11000})
+    writer.stop()
+
+    stats = writer.stats()
+    assert (stats["dropped"], stats["undecodable"], stats["stored"]) == (1, 1, 1)
+    assert [m["timestamp"] for m in persisted] == [1_700_000_002]
@@ -0,0 +1,77 @@
+# Jakob Balkovec
+# test_downsample.py
+# Streaming LTTB against a textbook (whole-series) implementation
+#
+#   python -m pytest tests/test_downsample.py
+
+import math
+import random
+
+import numpy as np
+import pytest
+
+from app.utils.downsample import StreamingLTTB
+
+
+def lttb(x: list[float], y: list[float], threshold: int):
+    """Reference LTTB (Steinarsson 2013) over the whole series at once."""
+    n = len(x)
+    if n <= threshold:
+        return list(x), list(y)
+    every = (n - 2) / (threshold - 2)
+    out = [0]
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = math.floor(i * every) + 1, math.floor((i + 1) * every) + 1
+        nlo, nhi = hi, min(math.floor((i + 2) * every) + 1, n)
+        if i == threshold - 3:
+            nlo, nhi = n - 1, n
+        cx = sum(x[nlo:nhi]) / (nhi - nlo)
+        cy = sum(y[nlo:nhi]) / (nhi - nlo)
+        areas = [
+            abs((x[a] - cx) * (y[j] - y[a]) - (x[a] - x[j]) * (cy - y[a]))
+            for j in range(lo, hi)
+        ]
+        a = lo + areas.index(max(areas))
+        out.append(a)
+    out.append(n - 1)
+    return [x[i] for i in out], [y[i] for i in out]
+
+
+def stream(x, y, threshold: int, chunk: int):
+    s = StreamingLTTB(len(x), threshold)
+    for i in range(0, len(x), chunk):
+        s.feed(np.array(x[i:i + chunk]), np.array(y[i:i + chunk]))
+    return s.finish()
+
+
+def series(n: int, seed: int = 3):
+    rng = random.Random(seed)
+    x = sorted(rng.uniform(0, 1e6) for _ in range(n))
+    y = [50 + 30 * math.sin(t / 5e4) + rng.gauss(0, 5) for t in x]
+    return x, y
+
+
+@pytest.mark.parametrize("n,threshold", [(1000, 100), (997, 3), (5000, 333), (40, 39)])
+@pytest.mark.parametrize("chunk", [1, 7, 256, 10_000])
+def test_streaming_matches_reference(n, threshold, chunk):
+    x, y = series(n)
+    assert stream(x, y, threshold, chunk) == lttb(x, y, threshold)
+
+
+def test_keeps_extremes_and_endpoints():
+    x = list(range(1000))
+    y = [0.0] * 1000
+    y[123], y[877] = 100.0, -100.0
+    xs, ys = stream(x, y, 50, 64)
+    assert len(xs) == 50
+    assert (xs[0], xs[-1]) == (0, 999)
+    assert 100.0 in ys and -100.0 in ys
+
+
+def test_short_series_passes_through():
+    x, y = series(10)
+    assert stream(x, y, 20, 3) == (x, y)
+    assert StreamingLTTB(0, 10).finish() == ([], [])
+    with pytest.raises(ValueError):
+        StreamingLTTB(100, 2)
@@ -0,0 +1,139 @@
+# Jakob Balkovec
+# test_export_csv.py
+# Streaming CSV export: chunking, range bounds, session lifetime, re-import
+#
+#   python -m pytest tests/test_export_csv.py
+
+import asyncio
+import csv
+import datetime
+import gc
+import io
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session, sessionmaker
+
+import app.db.models  # noqa: F401  (register tables)
+from app import importer
+from app.cache import LatestReadingCache
+from app.db.models import SensorReading
+from app.db.session import Base
+from app.importer import BulkImport
+from app.registry import DeviceRegistry
+from app.routers import readings
+
+T0 = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+ROWS = 23
+
+
+class TrackedSession(Session):
+    closed = 0
+
+    def close(self):
+        TrackedSession.closed += 1
+        super().close()
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'export.db'}", connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        # Inserted newest first; the export must still be oldest first.
+        conn.execute(insert(SensorReading), [
+            {
+                "dev_eui": "a",
+                "timestamp": T0 + datetime.timedelta(minutes=i),
+                "raw_value": 11000 + i,
+                "moisture_pct": 40.0 + i / 4,
+            }
+            for i in reversed(range(ROWS))
+        ])
+    monkeypatch.setattr(readings, "SessionLocal", sessionmaker(engine, class_=TrackedSession))
+    monkeypatch.setattr(readings, "EXPORT_CHUNK_SIZE", 5)
+    monkeypatch.setattr(TrackedSession, "closed", 0)
+    app = FastAPI()
+    app.include_router(readings.router)
+    return app
+
+
+def get(app, url: str) -> httpx.Response:
+    async def call():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(url)
+
+    return asyncio.run(call())
+
+
+def parse(body: str) -> list[list[str]]:
+    return list(csv.reader(io.StringIO(body)))
+
+
+def test_chunks_join_into_one_header_and_oldest_first(api):
+    resp = get(api, "/api/export/a")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/csv")
+
+    lines = parse(resp.text)
+    assert lines[0] == ["timestamp", "moisture_pct", "raw_value"]
+    assert sum(line == lines[0] for line in lines) == 1
+    assert [int(line[2]) for line in lines[1:]] == [11000 + i for i in range(ROWS)]
+    assert lines[1][0] == "2025-01-01T00:00:00+00:00"
+    assert TrackedSession.closed == 1
+
+
+def test_from_and_to_are_inclusive(api):
+    url = "/api/export/a?from=2025-01-01T00:03:00Z&to=2025-01-01T00:14:00Z"
+    raw = [int(line[2]) for line in parse(get(api, url).text)[1:]]
+    assert raw == [11000 + i for i in range(3, 15)]
+
+    url = "/api/export/a?from=2025-01-01T00:03:30Z&to=2025-01-01T00:04:00Z"
+    assert [int(line[2]) for line in parse(get(api, url).text)[1:]] == [11004]
+
+
+def test_empty_result_is_404_and_closes_the_session(api):
+    assert get(api, "/api/export/nobody").status_code == 404
+    assert get(api, "/api/export/a?from=2030-01-01T00:00:00Z").status_code == 404
+    assert TrackedSession.closed == 2
+
+
+def test_abandoned_stream_closes_the_session(api):
+    async def first_chunk():
+        resp = readings.export_csv("a", start=None, end=None)
+        body = resp.body_iterator
+        chunk = await body.__anext__()
+        await body.aclose()
+        return chunk
+
+    chunk = asyncio.run(first_chunk())
+    assert len(parse(chunk)) == 1 + 5
+    gc.collect()
+    assert TrackedSession.closed == 1
+
+
+def test_export_re_imports(api, tmp_path, monkeypatch):
+    body = get(api, "/api/export/a").content
+
+    target = create_engine(f"sqlite:///{tmp_path / 'reimport.db'}")
+    Base.metadata.create_all(bind=target)
+    Target = sessionmaker(bind=target)
+    monkeypatch.setattr(importer, "SessionLocal", Target)
+    monkeypatch.setattr(importer, "device_registry", DeviceRegistry())
+    monkeypatch.setattr(importer, "latest_cache", LatestReadingCache())
+
+    run = BulkImport("csv", dev_eui="a", create_devices=True, batch_size=7)
+    for i in range(0, len(body), 64):
+        run.feed(body[i:i + 64])
+    report = run.close()
+    assert (report["imported"], report["errors"]) == (ROWS, [])
+
+    columns = (SensorReading.timestamp, SensorReading.raw_value, SensorReading.moisture_pct)
+    stmt = select(*columns).order_by(SensorReading.timestamp)
+    with readings.SessionLocal() as src, Target() as dst:
+        assert src.execute(stmt).all() == dst.execute(stmt).all()
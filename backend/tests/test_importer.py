@@ -0,0 +1,231 @@
+# Jakob Balkovec
+# test_importer.py
+# Bulk NDJSON/CSV import: validation, batching, duplicates and the endpoint
+#
+#   python -m pytest tests/test_importer.py
+
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+import app.db.models  # noqa: F401  (register tables)
+from app import importer
+from app.cache import LatestReadingCache
+from app.db.models import Device, SensorReading
+from app.db.session import Base
+from app.importer import BulkImport
+from app.registry import DeviceRegistry
+from app.routers import imports
+from app.rollups import BUCKETS
+from app.security import require_admin
+
+KNOWN = "a1b2c3d4e5f60708"
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'import.db'}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as s:
+        s.add(Device(dev_eui=KNOWN, nickname="known"))
+        s.commit()
+        registry = DeviceRegistry()
+        registry.load(s)
+    monkeypatch.setattr(importer, "SessionLocal", Session)
+    monkeypatch.setattr(importer, "device_registry", registry)
+    monkeypatch.setattr(importer, "latest_cache", LatestReadingCache())
+    return Session
+
+
+def count(Session, model=SensorReading) -> int:
+    with Session() as s:
+        return s.execute(select(func.count()).select_from(model)).scalar()
+
+
+def ndjson(*rows) -> bytes:
+    return b"".join(
+        (r if isinstance(r, bytes) else json.dumps(r).encode()) + b"\n" for r in rows
+    )
+
+
+def test_ndjson_rows_are_validated_and_reported_by_line(db):
+    body = ndjson(
+        {"dev_eui": KNOWN, "timestamp": 1_700_000_000, "raw_value": 11000},
+        b"{not json",
+        {"dev_eui": KNOWN, "timestamp": "2023-11-14T22:13:30Z", "raw_value": "11500.0"},
+        {"dev_eui": KNOWN, "timestamp": 1_700_000_060},
+        {"dev_eui": "ffffffffffffffff", "timestamp": 1_700_000_120, "raw_value": 11000},
+        {"devEUI": KNOWN, "timestamp": 1_700_000_180_000, "raw_value": 12000, "moisture_pct": 42.5},
+    )
+    run = BulkImport("ndjson", batch_size=2)
+    # Chunk boundaries fall mid-line.
+    for i in range(0, len(body), 7):
+        run.feed(body[i:i + 7])
+    report = run.close()
+
+    assert report["imported"] == 3
+    assert report["lines"] == 6
+    assert [e["line"] for e in report["errors"]] == [2, 4, 5]
+    assert "missing raw_value" in report["errors"][1]["error"]
+    assert "unknown device" in report["errors"][2]["error"]
+    with db() as s:
+        rows = s.execute(select(SensorReading).order_by(SensorReading.timestamp)).scalars().all()
+    assert [r.raw_value for r in rows] == [11000, 11500, 12000]
+    assert rows[2].moisture_pct == 42.5
+    assert 0 <= rows[0].moisture_pct <= 100
+    assert count(db, BUCKETS["hour"][0]) == 1
+
+
+def test_csv_export_round_trip_with_default_device(db):
+    body = (
+        "timestamp,moisture_pct,raw_value\n"
+        "2024-01-01T00:00:00+00:00,50.0,11500\n"
+        "2024-01-01T00:15:00+00:00,,11400\n"
+        "2024-01-01T00:30:00+00:00,51.0,oops\n"
+        "2024-01-01T00:45:00+00:00,52.0,11300"  # no trailing newline
+    ).encode()
+    run = BulkImport("csv", dev_eui=KNOWN)
+    run.feed(body)
+    report = run.close()
+
+    assert report["imported"] == 3
+    assert report["errors"] == [{"line": 4, "error": "bad raw_value 'oops'"}]
+
+
+def test_csv_quoted_fields_keep_newlines_across_chunks(db):
+    body = (
+        "timestamp,raw_value,note\n"
+        '2024-01-01T00:00:00Z,11000,"two\nlines"\n'
+        '2024-01-01T00:15:00Z,"11\n00",plain\n'
+        '2024-01-01T00:30:00Z,11200,"say ""hi""\n\nbye"\n'
+        "2024-01-01T00:45:00Z,11300,\n"
+        '2024-01-01T01:00:00Z,11400,"never closed\n'
+    ).encode()
+    run = BulkImport("csv", dev_eui=KNOWN)
+    for i in range(0, len(body), 5):
+        run.feed(body[i:i + 5])
+    report = run.close()
+
+    assert (report["lines"], report["imported"]) == (10, 3)
+    assert report["errors"] == [
+        {"line": 4, "error": "bad raw_value '11\\n00'"},
+        {"line": 10, "error": "unterminated quoted field"},
+    ]
+
+
+def test_only_newlines_end_ndjson_lines(db):
+    # U+2028, U+0085, \x1c and \v are legal unescaped inside JSON strings.
+    odd = "a\u2028b\u0085c\x1cd\x0be\x0cf"
+    body = (
+        ndjson({"dev_eui": KNOWN, "timestamp": 1_700_000_000, "raw_value": 11000, "note": odd})
+        + b'{"dev_eui": "' + KNOWN.encode() + b'", "timestamp": 1700000060}\r\n'
+        + ndjson({"dev_eui": KNOWN, "timestamp": 1_700_000_120, "raw_value": 11000})
+    )
+    run = BulkImport("ndjson")
+    run.feed(body)
+    report = run.close()
+
+    assert (report["lines"], report["imported"]) == (3, 2)
+    assert report["errors"] == [{"line": 2, "error": "missing raw_value"}]
+
+
+def test_out_of_range_raw_value_is_a_row_error(db):
+    rows = [
+        {"dev_eui": KNOWN, "timestamp": 1_700_000_000 + i, "raw_value": 11000} for i in range(50)
+    ]
+    rows.insert(20, {"dev_eui": KNOWN, "timestamp": 1_690_000_000, "raw_value": 2 ** 70})
+    run = BulkImport("ndjson", batch_size=16)
+    run.feed(ndjson(*rows))
+    report = run.close()
+
+    assert report["imported"] == 50
+    assert report["errors"] == [{"line": 21, "error": f"raw_value {2 ** 70} out of range"}]
+    assert count(db) == 50
+
+
+def test_row_the_database_rejects_fails_alone(db, monkeypatch):
+    store = importer.store_sensor_readings
+
+    def strict_store(session, rows, **kwargs):
+        if any(r["raw_value"] == 66666 for r in rows):
+            raise IntegrityError("INSERT", None, Exception("CHECK constraint failed"))
+        return store(session, rows, **kwargs)
+
+    monkeypatch.setattr(importer, "store_sensor_readings", strict_store)
+    rows = [
+        {"dev_eui": KNOWN, "timestamp": 1_700_000_000 + i, "raw_value": 11000} for i in range(40)
+    ]
+    rows[13]["raw_value"] = 66666
+    run = BulkImport("ndjson", batch_size=16)
+    run.feed(ndjson(*rows))
+    report = run.close()
+
+    assert (report["imported"], report["failed"], report["batches"]) == (39, 1, 3)
+    assert report["errors"] == [
+        {"line": 14, "error": "rejected by the database: CHECK constraint failed"}
+    ]
+    assert count(db) == 39
+    hourly = BUCKETS["hour"][0]
+    with db() as s:
+        assert s.execute(select(func.sum(hourly.count))).scalar() == 39
+
+
+def test_csv_header_must_name_required_columns(db):
+    run = BulkImport("csv")
+    with pytest.raises(ValueError, match="dev_eui, raw_value"):
+        run.feed(b"timestamp,value\n1,2\n")
+
+
+def test_create_devices_and_skip_existing(db):
+    rows = [
+        {"dev_eui": "0000000000000001", "timestamp": 1_700_000_000 + i, "raw_value": 11000}
+        for i in range(5)
+    ]
+    first = BulkImport("ndjson", create_devices=True)
+    first.feed(ndjson(*rows))
+    assert first.close()["new_devices"] == 1
+
+    again = BulkImport("ndjson", skip_existing=True)
+    again.feed(ndjson(*rows, rows[0], {**rows[0], "timestamp": 1_800_000_000}))
+    report = again.close()
+    assert (report["imported"], report["duplicates"]) == (1, 6)
+    assert count(db) == 6
+    assert count(db, Device) == 2
+
+
+def test_upload_endpoint_streams_and_reports(db):
+    api = FastAPI()
+    api.include_router(imports.router)
+    api.dependency_overrides[require_admin] = lambda: None
+
+    async def upload():
+        async def body():
+            for i in range(50):
+                yield ndjson(
+                    {"dev_eui": KNOWN, "timestamp": 1_700_000_000 + i * 60, "raw_value": 11000 + i}
+                )
+
+        transport = httpx.ASGITransport(app=api)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            done = await client.post(
+                "/api/import/readings",
+                content=body(),
+                headers={"Content-Type": "application/x-ndjson"},
+            )
+            bad = await client.post("/api/import/readings?format=csv", content=b"a,b\n")
+            jobs = await client.get("/api/import/jobs")
+            return done, bad, jobs
+
+    done, bad, jobs = asyncio.run(upload())
+    assert done.status_code == 200
+    assert done.json()["imported"] == 50 and done.json()["status"] == "done"
+    assert bad.status_code == 400
+    assert [j["status"] for j in jobs.json()][:2] == ["failed", "done"]
+    assert count(db) == 50
@@ -0,0 +1,117 @@
+# Jakob Balkovec
+# test_ingest.py
+# Batched ingest writer: batching, retries, poisoned batches, timestamps
+#
+#   python -m pytest tests/test_ingest.py
+
+import json
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import app.db.models  # noqa: F401  (register tables)
+from app import ingest, mqtt
+from app.cache import LatestReadingCache
+from app.db.models import Device, SensorReading
+from app.db.session import Base
+from app.ingest import IngestWriter
+from app.registry import DeviceRegistry
+
+T0 = 1_700_000_000
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'ingest.db'}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(ingest, "SessionLocal", Session)
+    monkeypatch.setattr(ingest, "device_registry", DeviceRegistry())
+    monkeypatch.setattr(ingest, "latest_cache", LatestReadingCache())
+    return Session
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # Retry backoff, recorded instead of slept.
+    delays = []
+    monkeypatch.setattr(ingest.time, "sleep", delays.append)
+    return delays
+
+
+def count(Session, model=SensorReading) -> int:
+    with Session() as s:
+        return s.execute(select(func.count()).select_from(model)).scalar()
+
+
+def reading(i: int, dev: str = "a1", **extra) -> dict:
+    return {"dev_eui": dev, "timestamp": T0 + i, "raw_value": 11000 + i, **extra}
+
+
+def run(writer: IngestWriter, msgs):
+    for m in msgs:
+        writer.submit(m)
+    writer.start()
+    writer.stop()
+
+
+def test_writer_batches_stores_and_registers_devices(db, monkeypatch):
+    writer = IngestWriter(batch_size=3, max_latency_ms=1000)
+    sizes = []
+    persist = ingest.persist_batch
+    monkeypatch.setattr(ingest, "persist_batch", lambda s, b: sizes.append(len(b)) or persist(s, b))
+
+    run(writer, [reading(i, dev=f"d{i % 2}") for i in range(7)])
+
+    assert sizes == [3, 3, 1]
+    assert writer.stats()["stored"] == 7
+    assert count(db) == 7
+    assert count(db, Device) == 2
+    assert ingest.latest_cache.get("d0")["raw_value"] == 11006
+
+
+def test_transient_errors_are_retried_then_dropped(db, sleeps, monkeypatch):
+    persist = ingest.persist_batch
+    failures = iter([True, False])
+
+    def flaky(session, batch):
+        if next(failures, True):
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return persist(session, batch)
+
+    monkeypatch.setattr(ingest, "persist_batch", flaky)
+    writer = IngestWriter(flush_retries=3)
+    run(writer, [reading(0), reading(1)])
+    assert (writer.stored, writer.retries, writer.dropped) == (2, 1, 0)
+    assert sleeps == [0.5]
+
+    writer = IngestWriter(flush_retries=2)
+    run(writer, [reading(2)])
+    assert (writer.stored, writer.retries, writer.dropped) == (0, 2, 1)
+    assert count(db) == 2
+
+
+def test_bad_reading_is_isolated_without_retries(db, sleeps):
+    msgs = [reading(i) for i in range(5)]
+    msgs[3]["timestamp"] = 1e20
+    writer = IngestWriter(batch_size=10, max_latency_ms=1000)
+    run(writer, msgs)
+
+    assert (writer.stored, writer.dropped, writer.retries) == (4, 1, 0)
+    assert sleeps == []
+    assert count(db) == 4
+
+
+@pytest.mark.parametrize("value", [1e20, -5, "soon", True, [1]])
+def test_parse_message_rejects_bad_timestamps(value):
+    payload = json.dumps({"devEUI": "a1", "timestamp": value, "raw_value": 11000})
+    assert mqtt.parse_message(payload) is None
+
+
+def test_parse_message_converts_timestamps():
+    for value in (T0, float(T0) + 0.7, str(T0)):
+        payload = json.dumps({"devEUI": "a1", "timestamp": value, "raw_value": 11000})
+        assert mqtt.parse_message(payload)["timestamp"] == T0
+    assert mqtt.parse_message(json.dumps({"devEUI": "a1", "raw_value": 1}))["timestamp"] > T0
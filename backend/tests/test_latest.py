@@ -0,0 +1,126 @@
+# Jakob Balkovec
+# test_latest.py
+# Latest reading per device: /api/devices/latest and include_latest
+#
+#   python -m pytest tests/test_latest.py
+
+import asyncio
+import datetime
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import app.db.models  # noqa: F401  (register tables)
+from app.cache import LatestReadingCache, reading_to_dict
+from app.crud import get_latest_reading_async
+from app.db.async_session import get_async_db
+from app.db.models import Device, SensorReading
+from app.db.session import Base
+from app.routers import devices
+
+T0 = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def reading(dev: str, hour: int, raw: int) -> dict:
+    return {
+        "dev_eui": dev,
+        "timestamp": T0 + datetime.timedelta(hours=hour),
+        "raw_value": raw,
+        "moisture_pct": 50.0,
+    }
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    path = tmp_path / "latest.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Device), [{"dev_eui": d} for d in ("a", "b", "quiet")])
+        conn.execute(insert(SensorReading), [
+            # "a": newest reading inserted before older ones.
+            reading("a", 2, 11002),
+            reading("a", 0, 11000),
+            reading("a", 1, 11001),
+            # "b": two readings share the newest timestamp; the later insert wins.
+            reading("b", 0, 12000),
+            reading("b", 3, 12001),
+            reading("b", 3, 12002),
+            # Readings of a device that is not registered.
+            reading("gone", 0, 13000),
+        ])
+
+    Session = async_sessionmaker(create_async_engine(f"sqlite+aiosqlite:///{path}"))
+
+    async def override():
+        async with Session() as db:
+            yield db
+
+    monkeypatch.setattr(devices, "latest_cache", LatestReadingCache())
+    app = FastAPI()
+    app.include_router(devices.router)
+    app.dependency_overrides[get_async_db] = override
+    app.state.Session = Session
+    return app
+
+
+def get(app, url: str):
+    async def call():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            resp = await client.get(url)
+            assert resp.status_code == 200
+            return resp.json()
+
+    return asyncio.run(call())
+
+
+def single_latest(app, dev_eui: str) -> dict:
+    # What /api/readings/latest/{dev_eui} returns on a cache miss.
+    async def read():
+        async with app.state.Session() as db:
+            return reading_to_dict(await get_latest_reading_async(db, dev_eui))
+
+    return jsonable_encoder(asyncio.run(read()))
+
+
+def test_one_row_per_device_newest_wins(api):
+    rows = get(api, "/api/devices/latest")
+    assert [(r["dev_eui"], r["raw_value"]) for r in rows] == [
+        ("a", 11002), ("b", 12002), ("gone", 13000),
+    ]
+    assert rows[0]["timestamp"] == "2025-01-01T02:00:00+00:00"
+
+
+def test_tie_on_timestamp_is_broken_by_insert_order(api):
+    for _ in range(3):
+        (b,) = get(api, "/api/devices/latest?dev_eui=b")
+        assert b["raw_value"] == 12002
+    assert single_latest(api, "b")["id"] == b["id"]
+
+
+def test_repeated_filter_and_unknown_euis(api):
+    rows = get(api, "/api/devices/latest?dev_eui=b&dev_eui=nope&dev_eui=a&dev_eui=b")
+    assert sorted(r["dev_eui"] for r in rows) == ["a", "b"]
+    assert get(api, "/api/devices/latest?dev_eui=nope") == []
+
+
+def test_include_latest_embeds_null_without_readings(api):
+    assert all("latest" not in d for d in get(api, "/api/devices"))
+    listed = {d["dev_eui"]: d for d in get(api, "/api/devices?include_latest=true")}
+    assert set(listed) == {"a", "b", "quiet"}
+    assert listed["quiet"]["latest"] is None
+    assert listed["a"]["latest"]["raw_value"] == 11002
+
+
+def test_shape_matches_the_single_device_endpoint(api):
+    latest = {r["dev_eui"]: r for r in get(api, "/api/devices/latest")}
+    embedded = {d["dev_eui"]: d["latest"] for d in get(api, "/api/devices?include_latest=true")}
+    for dev in ("a", "b"):
+        expected = single_latest(api, dev)
+        assert latest[dev] == expected
+        assert embedded[dev] == expected
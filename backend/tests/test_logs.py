@@ -0,0 +1,102 @@
+# Jakob Balkovec
+# test_logs.py
+# JSON records, event rate limiting and the non-blocking queue handler
+#
+#   python -m pytest tests/test_logs.py
+
+import io
+import json
+import logging
+import queue
+
+from app import logs
+from app.logs import EventLogger, JsonFormatter, RateLimiter, _DroppingQueueHandler
+
+
+class _Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_json_record_has_extra_fields_and_exception():
+    logger = logging.getLogger("test.logs.json")
+    collect = _Collect()
+    logger.addHandler(collect)
+    try:
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("Bad %s payload", "packed_u16", extra={"dev_eui": "a1"})
+    finally:
+        logger.removeHandler(collect)
+
+    entry = json.loads(JsonFormatter().format(collect.records[0]))
+    assert entry["level"] == "ERROR"
+    assert entry["logger"] == "test.logs.json"
+    assert entry["msg"] == "Bad packed_u16 payload"
+    assert entry["dev_eui"] == "a1"
+    assert "ValueError: boom" in entry["exc"]
+
+
+def test_event_logger_rate_limits_per_template():
+    logger = logging.getLogger("test.logs.events")
+    logger.setLevel(logging.DEBUG)
+    collect = _Collect()
+    logger.addHandler(collect)
+    events = EventLogger(logger, RateLimiter(rate=0.001, burst=3))
+    try:
+        for i in range(10):
+            events.warning("Bad payload %d", i)
+        events.warning("Other message")
+        events.limiter._buckets["Bad payload %d"][0] = 1.0  # refill one token
+        events.warning("Bad payload %d", 99)
+    finally:
+        logger.removeHandler(collect)
+
+    messages = [r.getMessage() for r in collect.records]
+    assert messages == [
+        "Bad payload 0", "Bad payload 1", "Bad payload 2", "Other message", "Bad payload 99",
+    ]
+    assert collect.records[-1].suppressed == 7
+    # Caller info points at the logging call, not at EventLogger.
+    assert {r.funcName for r in collect.records} == {"test_event_logger_rate_limits_per_template"}
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = _DroppingQueueHandler(queue.Queue(maxsize=2))
+    logger = logging.getLogger("test.logs.queue")
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        for i in range(5):
+            logger.warning("record %d", i)
+    finally:
+        logger.removeHandler(handler)
+        logger.propagate = True
+
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+    assert handler.queue.get_nowait().msg == "record 0"
+
+
+def test_setup_keeps_existing_root_handlers():
+    root = logging.getLogger()
+    level = root.level
+    collect = _Collect()
+    root.addHandler(collect)
+    out = io.StringIO()
+    try:
+        logs.setup_logging(level="INFO", levels={}, fmt="json", stream=out)
+        logging.getLogger("test.logs.setup").warning("hello")
+        logs.shutdown_logging()
+    finally:
+        root.removeHandler(collect)
+        root.setLevel(level)
+
+    assert [r.getMessage() for r in collect.records] == ["hello"]
+    assert json.loads(out.getvalue())["msg"] == "hello"
+    assert logs._handler not in root.handlers
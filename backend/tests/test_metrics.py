@@ -0,0 +1,67 @@
+# Jakob Balkovec
+# test_metrics.py
+# Per-thread recorders and the Prometheus text rendering
+#
+#   python -m pytest tests/test_metrics.py
+
+import threading
+
+from app.metrics import MetricsRegistry
+
+
+def test_counts_from_many_threads_are_summed():
+    reg = MetricsRegistry()
+    counter = reg.counter("t_events", "events", ("kind",))
+    hist = reg.histogram("t_seconds", "latency", buckets=(0.1, 1.0))
+
+    def work():
+        child = counter.labels("a")
+        for _ in range(10_000):
+            child.inc()
+            hist.observe(0.5)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert counter.labels("a").value() == 80_000
+    text = reg.render()
+    assert 't_events_total{kind="a"} 80000' in text
+    assert 't_seconds_bucket{le="0.1"} 0' in text
+    assert 't_seconds_bucket{le="1"} 80000' in text
+    assert 't_seconds_bucket{le="+Inf"} 80000' in text
+    assert "t_seconds_count 80000" in text
+
+
+def test_render_format():
+    reg = MetricsRegistry()
+    reg.counter("t_plain", "plain counter").inc(2)
+    reg.callback("t_depth", "gauge", "depth", lambda: [({"queue": 'a"b'}, 3)])
+    lines = reg.render().splitlines()
+    assert lines[:3] == [
+        "# HELP t_plain_total plain counter",
+        "# TYPE t_plain_total counter",
+        "t_plain_total 2",
+    ]
+    assert 't_depth{queue="a\\"b"} 3' in lines
+
+
+def test_exited_threads_are_folded_into_the_total():
+    reg = MetricsRegistry()
+    counter = reg.counter("t_churn", "events")
+    hist = reg.histogram("t_churn_seconds", "latency", buckets=(1.0,))
+
+    def work():
+        counter.inc(3)
+        hist.observe(0.5)
+
+    for _ in range(200):
+        t = threading.Thread(target=work)
+        t.start()
+        t.join()
+
+    assert counter.value() == 600
+    assert "t_churn_seconds_count 200" in reg.render()
+    assert len(counter._cells) <= 1
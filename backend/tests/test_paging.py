@@ -0,0 +1,116 @@
+# Jakob Balkovec
+# test_paging.py
+# Time-range filters and keyset pagination of /api/readings/{dev_eui}
+#
+#   python -m pytest tests/test_paging.py
+
+import asyncio
+import datetime
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import app.db.models  # noqa: F401  (register tables)
+from app.cache import reading_to_dict
+from app.db.async_session import get_async_db
+from app.db.models import SensorReading
+from app.db.session import Base
+from app.routers import readings
+from app.utils.time_utils import decode_cursor, encode_cursor
+
+T0 = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def api(tmp_path):
+    path = tmp_path / "paging.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    # Five readings share each timestamp, inserted out of time order.
+    with engine.begin() as conn:
+        conn.execute(insert(SensorReading), [
+            {
+                "dev_eui": dev,
+                "timestamp": T0 + datetime.timedelta(minutes=m),
+                "raw_value": 11000 + m * 10 + k,
+                "moisture_pct": 50.0,
+            }
+            for m in (3, 1, 4, 0, 2)
+            for k in range(5)
+            for dev in ("a", "b")
+        ])
+
+    Session = async_sessionmaker(create_async_engine(f"sqlite+aiosqlite:///{path}"))
+
+    async def override():
+        async with Session() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(readings.router)
+    app.dependency_overrides[get_async_db] = override
+    return app
+
+
+def pages(app, url: str) -> list[list[dict]]:
+    async def walk():
+        out = []
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            cursor = None
+            while True:
+                resp = await client.get(url + (f"&cursor={cursor}" if cursor else ""))
+                assert resp.status_code == 200
+                out.append(resp.json())
+                cursor = resp.headers.get("X-Next-Cursor")
+                if cursor is None:
+                    return out
+
+    return asyncio.run(walk())
+
+
+def test_cursor_round_trip():
+    ts = T0 + datetime.timedelta(microseconds=123)
+    assert decode_cursor(encode_cursor(ts, 42)) == (ts, 42)
+    assert decode_cursor(encode_cursor(ts.replace(tzinfo=None), 42)) == (ts, 42)
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+
+
+def test_pages_cross_equal_timestamps_without_gaps(api):
+    result = pages(api, "/api/readings/a?limit=4")
+    assert [len(p) for p in result] == [4] * 6 + [1]
+
+    rows = [r for p in result for r in p]
+    keys = [(r["timestamp"], r["id"]) for r in rows]
+    assert len(set(keys)) == 25
+    assert keys == sorted(keys, reverse=True)
+    assert {r["dev_eui"] for r in rows} == {"a"}
+
+
+def test_range_filters_and_bad_cursor(api):
+    url = "/api/readings/b?limit=3&from=2025-01-01T00:01:00Z&to=2025-01-01T00:03:00Z"
+    rows = [r for p in pages(api, url) for r in p]
+    assert len(rows) == 15
+    assert {r["raw_value"] // 10 % 10 for r in rows} == {1, 2, 3}
+
+    async def bad():
+        transport = httpx.ASGITransport(app=api)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/api/readings/a?cursor=%%%")
+
+    assert asyncio.run(bad()).status_code == 400
+
+
+def test_timestamps_are_utc_like_the_latest_reading(api):
+    row = SensorReading(id=1, dev_eui="a", timestamp=T0.replace(tzinfo=None), raw_value=1)
+    latest = jsonable_encoder(reading_to_dict(row))["timestamp"]
+    assert latest == "2025-01-01T00:00:00+00:00"
+
+    rows = [r for p in pages(api, "/api/readings/a?limit=100") for r in p]
+    assert rows[-1]["timestamp"] == latest
+    assert all(r["timestamp"].endswith("+00:00") for r in rows)
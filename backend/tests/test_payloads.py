@@ -0,0 +1,84 @@
+# Jakob Balkovec
+# test_payloads.py
+# Packed multi-sample uplinks: layouts, registry and the ingest path
+#
+#   python -m pytest tests/test_payloads.py
+
+import base64
+import json
+
+import pytest
+
+from app import mqtt
+from app.ingest import IngestWriter, decode_readings
+from app.payloads import LAYOUTS, DecoderRegistry
+from app.utils.calibration import convert_to_percentage
+
+TOPIC = "application/soil-v2/device/a1b2c3d4e5f60708/rx"
+
+
+def uplink(data: bytes, ts: int = 1_700_000_000, **extra) -> bytes:
+    body = {"devEUI": "a1b2c3d4e5f60708", "timestamp": ts, "data": base64.b64encode(data).decode()}
+    return json.dumps({**body, **extra}).encode()
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    reg = DecoderRegistry({"soil-v2": "packed_u16"})
+    monkeypatch.setattr(mqtt, "decoder_registry", reg)
+    return reg
+
+
+def test_layout_round_trip_and_timestamps():
+    layout = LAYOUTS["packed_u16"]
+    data = layout.pack([12000, 11500, 11000], interval=600)
+    assert layout.unpack(data, 10_000) == [(8800, 12000), (9400, 11500), (10000, 11000)]
+    assert LAYOUTS["packed_u32"].unpack(LAYOUTS["packed_u32"].pack([70000], 0), 5) == [(5, 70000)]
+
+
+@pytest.mark.parametrize("data", [b"", b"\x02\x00", b"\x02\x00\x3c\x2e\xe0", b"\x00\x00\x3c"])
+def test_layout_rejects_truncated_or_empty(data):
+    with pytest.raises(Exception):
+        LAYOUTS["packed_u16"].unpack(data, 0)
+
+
+def test_registry_resolution():
+    reg = DecoderRegistry({"soil-v2": "packed_u16", "legacy/+/rx": "packed_u32"})
+    assert reg.resolve(TOPIC).name == "packed_u16"
+    assert reg.resolve("application/other/device/x/rx", "soil-v2").name == "packed_u16"
+    assert reg.resolve("legacy/abc/rx").name == "packed_u32"
+    assert reg.resolve("application/soilmoisture/device/x/rx") is None
+    with pytest.raises(ValueError):
+        reg.register("x", "no_such_layout")
+
+
+def test_packed_uplink_parses_to_many_readings(registry):
+    data = LAYOUTS["packed_u16"].pack([12364, 11510, 10656], interval=300)
+    readings = mqtt.parse_message(uplink(data), TOPIC)
+    assert [(r["timestamp"], r["raw_value"]) for r in readings] == [
+        (1_700_000_000 - 600, 12364),
+        (1_700_000_000 - 300, 11510),
+        (1_700_000_000, 10656),
+    ]
+    # By application name when the topic does not identify it.
+    assert len(mqtt.parse_message(uplink(data, applicationName="soil-v2"), "sensor/x")) == 3
+    # Unregistered applications keep the single-value path.
+    single = mqtt.parse_message(uplink(b"\x30\x6c"), "application/soilmoisture/device/x/rx")
+    assert single["payload"] == "MGw="
+    assert mqtt.parse_message(uplink(b"\x03\x00\x3c\x30"), TOPIC) is None
+
+
+def test_packed_readings_reach_writer_as_one_batch(registry, monkeypatch):
+    writer = IngestWriter(batch_size=2, max_latency_ms=0)
+    flushed = []
+    monkeypatch.setattr(writer, "_flush", lambda batch: flushed.append(decode_readings(batch)))
+
+    data = LAYOUTS["packed_u16"].pack([12000, 11800, 11600, 11400], interval=60)
+    writer.submit(mqtt.parse_uplink((TOPIC, uplink(data))))
+    writer.start()
+    writer.stop()
+
+    assert len(flushed) == 1
+    assert [r["moisture_pct"] for r in flushed[0]] == [
+        convert_to_percentage(v) for v in (12000, 11800, 11600, 11400)
+    ]
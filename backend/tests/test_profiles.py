@@ -0,0 +1,124 @@
+# Jakob Balkovec
+# test_profiles.py
+# Calibration profiles: cache lookups and the historical recompute job
+#
+#   python -m pytest tests/test_profiles.py
+
+import datetime
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+
+import app.db.models  # noqa: F401  (register tables)
+from app import profiles
+from app.config import DRY_VALUE, WET_VALUE
+from app.db.models import CalibrationProfile, DeviceCalibration, SensorReading
+from app.db.session import Base
+from app.profiles import CalibrationCache, RecomputeJobs
+from app.rollups import BUCKETS, apply_rollups, backfill_rollups, rollup_to_dict
+from app.utils.calibration import convert_to_percentage
+
+T0 = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def Session(tmp_path, monkeypatch):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'profiles.db'}", connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add(CalibrationProfile(name="clay", dry_value=13000, wet_value=10000))
+        db.add(DeviceCalibration(dev_eui="a", profile="clay"))
+        db.commit()
+    monkeypatch.setattr(profiles, "SessionLocal", Session)
+    monkeypatch.setattr(profiles, "calibration_cache", CalibrationCache())
+    return Session
+
+
+def rows(dev: str, start: int, n: int) -> list[dict]:
+    return [
+        {
+            "dev_eui": dev,
+            "timestamp": T0 + datetime.timedelta(minutes=7 * i),
+            "raw_value": 10000 + (i * 37) % 3000,
+            "moisture_pct": convert_to_percentage(10000 + (i * 37) % 3000),
+        }
+        for i in range(start, start + n)
+    ]
+
+
+def write(Session, batch):
+    with Session() as db:
+        db.execute(insert(SensorReading), batch)
+        apply_rollups(db, batch)
+        db.commit()
+
+
+def rollups(db) -> dict:
+    out = {}
+    for name, (model, _) in BUCKETS.items():
+        for r in db.scalars(select(model)):
+            d = rollup_to_dict(r)
+            d["moisture_mean"] = round(d["moisture_mean"], 9)  # summation order
+            out[name, r.dev_eui, r.bucket_start] = d
+    return out
+
+
+def test_cache_bounds(Session):
+    cache = CalibrationCache()
+    assert cache.bounds(["a", "b"]) == (None, None)
+    with Session() as db:
+        cache.load(db)
+    assert cache.get("a") == (13000, 10000)
+    assert cache.get("b") == (DRY_VALUE, WET_VALUE)
+    dry, wet = cache.bounds(["b", "a"])
+    assert dry.tolist() == [DRY_VALUE, 13000] and wet.tolist() == [WET_VALUE, 10000]
+
+
+def test_recompute_job_rewrites_history_next_to_ingest(Session):
+    write(Session, rows("a", 0, 900) + rows("b", 0, 300))
+    with Session() as db:
+        profiles.calibration_cache.load(db)
+
+    jobs = RecomputeJobs(chunk_size=64)
+    jobs.start()
+    stop = threading.Event()
+
+    def ingest():
+        # Live ingest for both devices while the job runs.
+        i = 900
+        while not stop.is_set():
+            batch = rows("a", i, 5) + rows("b", i, 5)
+            for r in batch:
+                if r["dev_eui"] == "a":
+                    r["moisture_pct"] = convert_to_percentage(r["raw_value"], 13000, 10000)
+            write(Session, batch)
+            i += 5
+            time.sleep(0.001)
+
+    writer = threading.Thread(target=ingest)
+    writer.start()
+    job = jobs.submit(["a"], reason="profile clay changed")
+    deadline = time.monotonic() + 30
+    while jobs.get(job["id"])["status"] in ("queued", "running") and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stop.set()
+    writer.join()
+    jobs.stop()
+
+    done = jobs.get(job["id"])
+    assert done["status"] == "done", done
+    assert done["percent"] == 100.0 and done["done"] >= 900
+
+    with Session() as db:
+        for r in db.scalars(select(SensorReading)):
+            dry, wet = (13000, 10000) if r.dev_eui == "a" else (DRY_VALUE, WET_VALUE)
+            assert r.moisture_pct == convert_to_percentage(r.raw_value, dry, wet)
+        maintained = rollups(db)
+        backfill_rollups(db)
+        assert rollups(db) == maintained
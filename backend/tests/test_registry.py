@@ -0,0 +1,85 @@
+# Jakob Balkovec
+# test_registry.py
+# In-memory device registry and auto-registration on the ingest path
+#
+#   python -m pytest tests/test_registry.py
+
+import pytest
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import sessionmaker
+
+import app.db.models  # noqa: F401  (register tables)
+from app import ingest
+from app.cache import LatestReadingCache
+from app.crud import upsert_devices
+from app.db.models import Device
+from app.db.session import Base
+from app.registry import DeviceRegistry
+
+
+@pytest.fixture
+def Session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'registry.db'}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as s:
+        s.add(Device(dev_eui="known", nickname="bed 1"))
+        s.commit()
+    return Session
+
+
+def test_load_lookup_and_updates(Session):
+    registry = DeviceRegistry()
+    with Session() as s:
+        registry.load(s)
+        dev = Device(dev_eui="added", nickname="bed 2")
+        s.add(dev)
+        s.commit()
+        registry.put(dev)
+
+    assert "known" in registry and len(registry) == 2
+    assert registry.get("known")["nickname"] == "bed 1"
+    assert registry.get("known")["status"] == "active"
+    assert registry.unknown(["new-b", "known", "new-a", "new-b"]) == ["new-a", "new-b"]
+
+    registry.mark_known(["new-a", "known"])
+    assert registry.get("new-a")["nickname"] == "new-a"
+    assert registry.get("known")["nickname"] == "bed 1"  # never overwritten
+    registry.remove("known")
+    assert "known" not in registry and registry.get("known") is None
+
+
+def test_upsert_devices_is_idempotent(Session):
+    with Session() as s:
+        upsert_devices(s, ["known", "x", "x"])
+        upsert_devices(s, ["x"])
+        s.commit()
+        devices = {d.dev_eui: d.nickname for d in s.scalars(select(Device))}
+    assert devices == {"known": "bed 1", "x": "x"}
+
+
+def test_ingest_resolves_known_devices_without_sql(Session, monkeypatch):
+    registry = DeviceRegistry()
+    with Session() as s:
+        registry.load(s)
+    monkeypatch.setattr(ingest, "device_registry", registry)
+    monkeypatch.setattr(ingest, "latest_cache", LatestReadingCache())
+
+    statements = []
+    engine = Session.kw["bind"]
+    event.listen(engine, "before_cursor_execute", lambda *a: statements.append(a[2]))
+
+    def persist(*devs):
+        statements.clear()
+        batch = [
+            {"dev_eui": d, "timestamp": 1_700_000_000 + i, "raw_value": 11000, "moisture_pct": 50.0}
+            for i, d in enumerate(devs)
+        ]
+        with Session() as s:
+            ingest.persist_batch(s, batch)
+        return [sql for sql in statements if "devices" in sql]
+
+    assert persist("known", "known") == []
+    assert len(persist("known", "fresh")) == 1
+    assert "fresh" in registry
+    assert persist("fresh") == []
@@ -0,0 +1,98 @@
+# Jakob Balkovec
+# test_rollups.py
+# Incremental minute/hour/day rollups against a full rebuild
+#
+#   python -m pytest tests/test_rollups.py
+
+import datetime
+import random
+
+import pytest
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+
+import app.db.models  # noqa: F401  (register tables)
+from app.db.models import SensorReading
+from app.db.session import Base
+from app.rollups import BUCKETS, apply_rollups, backfill_rollups, rollup_to_dict
+
+T0 = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def Session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'rollups.db'}")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def readings(n: int, seed: int = 7) -> list[dict]:
+    rng = random.Random(seed)
+    return [
+        {
+            "dev_eui": rng.choice(["a", "b", "c"]),
+            # Two days of readings, arriving out of order.
+            "timestamp": T0 + datetime.timedelta(seconds=rng.randrange(2 * 86400)),
+            "raw_value": rng.randint(10600, 12400),
+            "moisture_pct": round(rng.uniform(0, 100), 3),
+        }
+        for _ in range(n)
+    ]
+
+
+def snapshot(db) -> dict:
+    out = {}
+    for name, (model, _) in BUCKETS.items():
+        for r in db.scalars(select(model)):
+            d = rollup_to_dict(r)
+            d["moisture_mean"] = round(d["moisture_mean"], 9)
+            out[name, r.dev_eui, d["timestamp"]] = d
+    return out
+
+
+def test_incremental_rollups_match_backfill(Session):
+    rows = readings(3000)
+    with Session() as db:
+        for i in range(0, len(rows), 250):
+            batch = rows[i:i + 250]
+            db.execute(insert(SensorReading), batch)
+            apply_rollups(db, batch)
+            db.commit()
+        incremental = snapshot(db)
+
+        assert backfill_rollups(db, chunk_size=400) == 3000
+        assert snapshot(db) == incremental
+
+    assert sum(1 for k in incremental if k[0] == "day") == 6
+    assert sum(d["count"] for k, d in incremental.items() if k[0] == "hour") == 3000
+
+
+def test_bucket_values(Session):
+    rows = [
+        {"dev_eui": "a", "timestamp": T0 + datetime.timedelta(minutes=m),
+         "raw_value": raw, "moisture_pct": pct}
+        for m, raw, pct in [(5, 12000, 20.0), (50, 11000, 80.0), (20, 11500, 50.0)]
+    ]
+    with Session() as db:
+        apply_rollups(db, rows[:2])
+        apply_rollups(db, rows[2:])  # late arrival must not become "last"
+        db.commit()
+        (hour,) = db.scalars(select(BUCKETS["hour"][0])).all()
+
+    d = rollup_to_dict(hour)
+    assert d["timestamp"] == T0
+    assert d["count"] == 3
+    assert (d["moisture_min"], d["moisture_max"], d["moisture_mean"]) == (20.0, 80.0, 50.0)
+    assert (d["raw_min"], d["raw_max"], d["raw_mean"]) == (11000, 12000, 11500)
+    assert (d["moisture_last"], d["raw_last"]) == (80.0, 11000)
+
+
+def test_backfill_one_device_leaves_others(Session):
+    rows = readings(500)
+    with Session() as db:
+        db.execute(insert(SensorReading), rows)
+        apply_rollups(db, rows)
+        db.commit()
+        before = snapshot(db)
+        backfill_rollups(db, dev_eui="b")
+        assert snapshot(db) == before
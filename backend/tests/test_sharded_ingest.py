@@ -0,0 +1,166 @@
+# Jakob Balkovec
+# test_sharded_ingest.py
+# Sharded ingest workers against the local MQTT broker stand-in
+#
+#   python -m pytest tests/test_sharded_ingest.py
+
+import json
+import os
+import signal
+import sqlite3
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+import pytest
+
+from app import mqtt as mqtt_bridge
+from app.cache import LatestReadingCache
+from app.ingest import partition_for
+from app.ingest_workers import IngestSupervisor, client_id_for
+from tests.mqtt_broker import StandInBroker
+
+GROUP = "test-ingest"
+DEVICES = [f"shard{i:04d}" for i in range(12)]
+
+
+def wait_for(pred, timeout: float = 30.0, every: float = 0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if pred():
+            return True
+        time.sleep(every)
+    return False
+
+
+def count_rows(db_path: str) -> int:
+    try:
+        with sqlite3.connect(db_path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM sensor_readings").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+
+
+def publish(port: int, start_ts: int, per_device: int):
+    pub = mqtt.Client(client_id="test-publisher")
+    pub.connect("127.0.0.1", port)
+    pub.loop_start()
+    for i in range(per_device):
+        for dev in DEVICES:
+            payload = {"devEUI": dev, "raw_value": 11000 + i, "timestamp": start_ts + i}
+            pub.publish(f"application/soilmoisture/device/{dev}/rx", json.dumps(payload))
+    pub.loop_stop()
+    pub.disconnect()
+
+
+def joined(broker: StandInBroker, routing: str) -> int:
+    if routing == "partition":
+        return len(broker.subscribers(mqtt_bridge.REAL_TOPIC))
+    return len(broker.group_members(GROUP))
+
+
+@pytest.fixture
+def cluster(request, tmp_path, monkeypatch):
+    # param: (routing, broker strategy)
+    routing, strategy = getattr(request, "param", ("partition", "round_robin"))
+    broker = StandInBroker(strategy=strategy)
+    port = broker.start()
+    db_path = str(tmp_path / "shard.db")
+
+    # Read by the spawned workers when they import app.config.
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{db_path}")
+    monkeypatch.setenv("MQTT_BROKER", "127.0.0.1")
+    monkeypatch.setenv("MQTT_PORT", str(port))
+    monkeypatch.setenv("INGEST_MAX_LATENCY_MS", "50")
+
+    supervisor = IngestSupervisor(workers=2, group=GROUP, routing=routing)
+    supervisor.start()
+    runner = threading.Thread(target=supervisor.run, kwargs={"poll_s": 0.1}, daemon=True)
+    runner.start()
+    assert wait_for(lambda: joined(broker, routing) == 2), "workers never subscribed"
+
+    yield broker, port, db_path, supervisor
+
+    supervisor.stop()
+    runner.join(5)
+    broker.stop()
+
+
+def assert_device_order(db_path: str, per_device: int):
+    # Insert order (id) follows publish order (timestamp) for every device.
+    with sqlite3.connect(db_path) as conn:
+        for dev in DEVICES:
+            ts = [r[0] for r in conn.execute(
+                "SELECT timestamp FROM sensor_readings WHERE dev_eui = ? ORDER BY id", (dev,)
+            )]
+            assert ts == sorted(ts), dev
+            assert len(ts) == per_device
+
+
+def test_partitions_split_devices_on_a_round_robin_broker(cluster):
+    broker, port, db_path, _ = cluster
+    per_device = 40
+    publish(port, 1_700_000_000, per_device)
+
+    total = per_device * len(DEVICES)
+    assert wait_for(lambda: count_rows(db_path) == total), count_rows(db_path)
+    time.sleep(0.3)
+    assert count_rows(db_path) == total  # each uplink stored by one worker only
+
+    # Every worker sees the whole stream and stores only its own devices.
+    received = broker.received_by()
+    assert [received.get(client_id_for(GROUP, i)) for i in range(2)] == [total, total]
+    owners = {partition_for(dev, 2) for dev in DEVICES}
+    assert owners == {0, 1}
+    assert_device_order(db_path, per_device)
+
+
+@pytest.mark.parametrize("cluster", [("broker_hash", "hash_topic")], indirect=True)
+def test_shared_subscription_on_a_topic_hash_broker(cluster):
+    broker, port, db_path, _ = cluster
+    per_device = 40
+    publish(port, 1_700_000_000, per_device)
+
+    total = per_device * len(DEVICES)
+    assert wait_for(lambda: count_rows(db_path) == total), count_rows(db_path)
+
+    received = broker.received_by()
+    shares = [received.get(client_id_for(GROUP, i), 0) for i in range(2)]
+    assert sum(shares) == total
+    assert all(shares), shares
+    assert_device_order(db_path, per_device)
+
+
+def test_supervisor_rejects_bad_sharding():
+    with pytest.raises(ValueError):
+        IngestSupervisor(workers=2, routing="round_robin")
+    with pytest.raises(ValueError):
+        IngestSupervisor(workers=4, total=6, offset=4)
+    supervisor = IngestSupervisor(workers=2, total=4, offset=2)
+    assert [s.index for s in supervisor.slots] == [2, 3] and supervisor.total == 4
+
+
+def test_supervisor_restarts_crashed_worker(cluster):
+    broker, port, db_path, supervisor = cluster
+    victim = supervisor.pids()[0]
+    os.kill(victim, signal.SIGKILL)
+
+    assert wait_for(lambda: supervisor.pids()[0] not in (None, victim) and supervisor.restarts == 1)
+    assert wait_for(lambda: joined(broker, "partition") == 2)
+
+    publish(port, 1_800_000_000, 10)
+    assert wait_for(lambda: count_rows(db_path) == 10 * len(DEVICES)), count_rows(db_path)
+
+
+def test_relay_keeps_latest_cache_current(monkeypatch):
+    # The API process in sharded mode stores nothing but sees every uplink.
+    cache = LatestReadingCache(ttl_s=0)
+    monkeypatch.setattr(mqtt_bridge, "latest_cache", cache)
+    for ts, raw in ((1_700_000_060, 11500), (1_700_000_000, 12000)):
+        payload = json.dumps({"devEUI": "relay01", "raw_value": raw, "timestamp": ts})
+        mqtt_bridge.relay_to_websocket(mqtt_bridge.parse_message(payload))
+
+    latest = cache.get("relay01")
+    assert latest["raw_value"] == 11500
+    assert latest["timestamp"].timestamp() == 1_700_000_060
+    assert 0 <= latest["moisture_pct"] <= 100
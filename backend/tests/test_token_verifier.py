@@ -0,0 +1,230 @@
+# Jakob Balkovec
+# test_token_verifier.py
+# TokenVerifier against a local stand-in for Google's cert endpoint
+#
+#   python -m pytest tests/test_token_verifier.py
+
+import datetime
+import time
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import crypt
+from google.auth import jwt as google_jwt
+from jose import jwt
+
+from app.security import (
+    DEFAULT_SECRET_KEY,
+    GoogleKeySet,
+    InvalidToken,
+    TokenVerifier,
+    VerifiedTokenCache,
+)
+
+AUDIENCE = "test-client.apps.googleusercontent.com"
+SECRET = "test-secret"
+
+
+def make_key(kid: str) -> tuple[crypt.RSASigner, str]:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, kid)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    pem_key = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    signer = crypt.RSASigner.from_string(pem_key, key_id=kid)
+    return signer, cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+class StandInCerts:
+    """Plays the Google cert endpoint: serves a {kid: pem} map and counts calls."""
+
+    def __init__(self, max_age: int = 3600):
+        self.certs: dict[str, str] = {}
+        self.max_age = max_age
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return dict(self.certs), self.max_age
+
+
+@pytest.fixture(scope="module")
+def signer_a():
+    return make_key("kid-a")
+
+
+@pytest.fixture
+def endpoint(signer_a):
+    ep = StandInCerts()
+    ep.certs["kid-a"] = signer_a[1]
+    return ep
+
+
+@pytest.fixture
+def verifier(endpoint):
+    return TokenVerifier(
+        secret_key=SECRET,
+        audience=AUDIENCE,
+        keys=GoogleKeySet(fetch=endpoint),
+        cache=VerifiedTokenCache(maxsize=16, ttl_s=300),
+    )
+
+
+def google_token(signer, **overrides) -> str:
+    now = int(time.time())
+    claims = {
+        "iss": "https://accounts.google.com",
+        "aud": AUDIENCE,
+        "sub": "1234",
+        "email": "grower@example.com",
+        "name": "Grower",
+        "iat": now,
+        "exp": now + 600,
+    }
+    claims.update(overrides)
+    return google_jwt.encode(signer, claims).decode()
+
+
+def own_token(**overrides) -> str:
+    claims = {"sub": "admin@example.com", "role": "admin", "exp": int(time.time()) + 600}
+    claims.update(overrides)
+    return jwt.encode(claims, SECRET, algorithm="HS256")
+
+
+def test_google_token_verified_locally_and_memoized(verifier, endpoint, signer_a):
+    token = google_token(signer_a[0])
+    user = verifier.user(token)
+    assert user.email == "grower@example.com"
+    assert user.name == "Grower"
+
+    for _ in range(100):
+        verifier.user(token)
+    assert endpoint.calls == 1
+    assert verifier.cache.hits == 100
+
+
+def test_certs_reused_across_tokens(verifier, endpoint, signer_a):
+    verifier.user(google_token(signer_a[0], email="a@example.com"))
+    verifier.user(google_token(signer_a[0], email="b@example.com"))
+    assert endpoint.calls == 1
+    assert verifier.cache.stats()["size"] == 2
+
+
+def test_certs_refetched_after_max_age(signer_a):
+    endpoint = StandInCerts(max_age=0)
+    endpoint.certs["kid-a"] = signer_a[1]
+    keys = GoogleKeySet(fetch=endpoint)
+    keys.verify(google_token(signer_a[0]), AUDIENCE)
+    keys.verify(google_token(signer_a[0]), AUDIENCE)
+    assert endpoint.calls == 2
+
+
+def test_rotated_key_triggers_one_refetch(verifier, endpoint, signer_a):
+    verifier.user(google_token(signer_a[0]))
+    verifier.keys._fetched -= 3600  # past the refetch floor
+
+    signer_b = make_key("kid-b")
+    endpoint.certs["kid-b"] = signer_b[1]
+    assert verifier.user(google_token(signer_b[0])).email == "grower@example.com"
+    assert endpoint.calls == 2
+
+
+def test_unknown_key_refetch_is_rate_limited(verifier, endpoint, signer_a):
+    verifier.user(google_token(signer_a[0]))
+    stranger = make_key("kid-x")
+    for _ in range(5):
+        with pytest.raises(InvalidToken):
+            verifier.user(google_token(stranger[0]))
+    assert endpoint.calls == 1
+
+
+@pytest.mark.parametrize(
+    "overrides",
+    [
+        {"aud": "someone-else"},
+        {"iss": "https://evil.example.com"},
+        {"exp": int(time.time()) - 3600, "iat": int(time.time()) - 7200},
+    ],
+)
+def test_bad_google_claims_rejected(verifier, signer_a, overrides):
+    with pytest.raises(InvalidToken):
+        verifier.user(google_token(signer_a[0], **overrides))
+    assert verifier.cache.stats()["size"] == 0
+
+
+def test_untrusted_signature_rejected(verifier):
+    # Same kid as the trusted key, different private key.
+    impostor = make_key("kid-a")
+    with pytest.raises(InvalidToken):
+        verifier.user(google_token(impostor[0]))
+
+
+def test_own_jwt_verified_with_secret(verifier, endpoint):
+    user = verifier.user(own_token())
+    assert user.email == "admin@example.com"
+    assert endpoint.calls == 0
+
+    with pytest.raises(InvalidToken):
+        verifier.user(jwt.encode({"sub": "x@example.com"}, "wrong", algorithm="HS256"))
+    with pytest.raises(InvalidToken):
+        verifier.user(own_token(exp=int(time.time()) - 10))
+
+
+@pytest.mark.parametrize("secret", [DEFAULT_SECRET_KEY, ""])
+def test_own_jwt_disabled_without_secret(secret, endpoint, signer_a):
+    verifier = TokenVerifier(
+        secret_key=secret, audience=AUDIENCE, keys=GoogleKeySet(fetch=endpoint)
+    )
+    forged = jwt.encode({"sub": "admin@example.com", "role": "admin"}, secret, algorithm="HS256")
+    with pytest.raises(InvalidToken, match="SECRET_KEY"):
+        verifier.user(forged)
+    assert verifier.user(google_token(signer_a[0])).email == "grower@example.com"
+
+
+def test_google_login_rejects_own_jwt(verifier):
+    with pytest.raises(InvalidToken):
+        verifier.verify_google(own_token())
+
+
+def test_cache_entry_expires_with_token():
+    cache = VerifiedTokenCache(maxsize=4, ttl_s=300)
+    cache.put("t", {"exp": time.time() - 1})
+    assert cache.get("t") is None
+
+
+def test_cache_is_lru_bounded():
+    cache = VerifiedTokenCache(maxsize=2, ttl_s=300)
+    cache.put("a", {})
+    cache.put("b", {})
+    cache.get("a")
+    cache.put("c", {})
+    assert cache.get("b") is None
+    assert cache.get("a") == {}
+    assert cache.get("c") == {}
+
+
+def test_cached_verification_is_fast(verifier, signer_a):
+    token = google_token(signer_a[0])
+    verifier.user(token)
+    n = 10000
+    t0 = time.perf_counter()
+    for _ in range(n):
+        verifier.verify(token)
+    per_call_us = (time.perf_counter() - t0) / n * 1e6
+    assert per_call_us < 100, per_call_us
@@ -0,0 +1,73 @@
+# Jakob Balkovec
+# test_uplink_pool.py
+# Parse workers between paho and the writer: overflow, ordering, failures
+#
+#   python -m pytest tests/test_uplink_pool.py
+
+import threading
+
+import pytest
+
+from app.ingest import UplinkPool, partition_for
+
+
+def test_partitioning_is_stable():
+    assert partition_for("a1b2c3d4e5f60708", 4) == partition_for("a1b2c3d4e5f60708", 4)
+    assert {partition_for(f"dev{i}", 4) for i in range(100)} == {0, 1, 2, 3}
+    assert partition_for(None, 4) == partition_for("x", 1) == 0
+
+
+@pytest.mark.parametrize("policy,kept", [("drop_oldest", [2, 3]), ("drop_newest", [0, 1])])
+def test_overflow_policies(policy, kept):
+    out = []
+    pool = UplinkPool(lambda p: p, out.append, workers=1, queue_size=2, overflow_policy=policy)
+    results = [pool.submit(i) for i in range(4)]
+    pool.start()
+    pool.stop()
+
+    assert out == kept
+    assert pool.stats()["overflowed"] == 2
+    assert results == ([True] * 4 if policy == "drop_oldest" else [True, True, False, False])
+
+
+def test_block_policy_waits_for_space():
+    out = []
+    pool = UplinkPool(lambda p: p, out.append, workers=1, queue_size=1, overflow_policy="block")
+    producer = threading.Thread(target=lambda: [pool.submit(i) for i in range(50)])
+    producer.start()
+    pool.start()
+    producer.join(5)
+    pool.stop()
+    assert out == list(range(50))
+    assert pool.stats()["overflowed"] == 0
+
+
+def test_per_device_order_and_failure_accounting():
+    out = []
+
+    def parse(item):
+        dev, i = item
+        if i == 3:
+            raise ValueError("bad uplink")
+        if i == 5:
+            return None
+        return [{"dev_eui": dev, "i": i}] * 2 if i == 7 else {"dev_eui": dev, "i": i}
+
+    pool = UplinkPool(parse, out.append, workers=3, queue_size=1000)
+    pool.start()
+    for i in range(20):
+        for dev in ("a", "b", "c", "d"):
+            pool.submit((dev, i), dev)
+    pool.stop()
+
+    for dev in "abcd":
+        seen = [m["i"] for m in out if isinstance(m, dict) and m["dev_eui"] == dev]
+        assert seen == [i for i in range(20) if i not in (3, 5, 7)]
+    stats = pool.stats()
+    assert (stats["received"], stats["parsed"], stats["invalid"]) == (80, 72, 8)
+    assert stats["readings"] == 72 + 4
+
+
+def test_unknown_overflow_policy_is_rejected():
+    with pytest.raises(ValueError):
+        UplinkPool(lambda p: p, print, overflow_policy="spill")
@@ -0,0 +1,183 @@
+# Jakob Balkovec
+# test_websocket.py
+# WebSocket fan-out: per-client queues, subscriptions and coalescing
+#
+#   python -m pytest tests/test_websocket.py
+
+import asyncio
+import json
+
+import pytest
+
+from app.websocket import WebSocketManager
+
+
+class FakeSocket:
+    """Records frames; a closed gate makes the client stall mid-send."""
+
+    def __init__(self, stalled: bool = False):
+        self.frames: list = []
+        self.closed_with: int | None = None
+        self.gate = asyncio.Event()
+        if not stalled:
+            self.gate.set()
+
+    async def send_text(self, frame: str):
+        await self.gate.wait()
+        self.frames.append(json.loads(frame))
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+def reading(i: int, dev: str = "a") -> dict:
+    return {"dev_eui": dev, "timestamp": "2025-01-01T00:00:00Z", "raw_value": i}
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def run(coro):
+    return asyncio.run(coro())
+
+
+def test_slow_client_drops_oldest_without_blocking_others():
+    async def scenario():
+        manager = WebSocketManager(queue_size=3, slow_client_policy="drop_oldest")
+        fast, slow = FakeSocket(), FakeSocket(stalled=True)
+        manager.register(fast)
+        manager.register(slow)
+
+        for i in range(10):
+            await manager.broadcast(reading(i))
+            await settle()
+        assert [f["raw_value"] for f in fast.frames] == list(range(10))
+
+        # The stalled sender holds reading 0; its queue kept the newest three.
+        slow.gate.set()
+        await settle()
+        assert [f["raw_value"] for f in slow.frames] == [0, 7, 8, 9]
+        assert manager.stats()["messages_dropped"] == 6
+        assert manager.clients[slow].dropped == 6
+        return manager
+
+    assert run(scenario).stats()["connections"] == 2
+
+
+def test_slow_client_is_evicted_under_disconnect_policy():
+    async def scenario():
+        manager = WebSocketManager(queue_size=2, slow_client_policy="disconnect")
+        fast, slow = FakeSocket(), FakeSocket(stalled=True)
+        manager.register(fast)
+        manager.register(slow)
+        for i in range(5):
+            await manager.broadcast(reading(i))
+            await settle()
+        return manager, fast, slow
+
+    manager, fast, slow = run(scenario)
+    assert slow.closed_with == 1013
+    assert slow not in manager.clients
+    assert len(fast.frames) == 5
+    assert manager.stats()["clients_evicted"] == 1
+
+
+def test_failed_send_unregisters_client():
+    class Broken(FakeSocket):
+        async def send_text(self, frame):
+            raise RuntimeError("socket gone")
+
+    async def scenario():
+        manager = WebSocketManager()
+        manager.register(Broken())
+        await manager.broadcast(reading(1))
+        await settle()
+        return manager
+
+    assert run(scenario).stats()["connections"] == 0
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        WebSocketManager(slow_client_policy="block")
+
+
+def test_subscriptions_route_readings_by_device():
+    async def scenario():
+        manager = WebSocketManager()
+        everything, picky = FakeSocket(), FakeSocket()
+        manager.register(everything)
+        manager.register(picky)
+        manager.handle_message(picky, json.dumps({"action": "unsubscribe", "dev_euis": ["*"]}))
+        manager.handle_message(picky, json.dumps({"action": "subscribe", "dev_euis": ["b", "c"]}))
+        manager.handle_message(picky, json.dumps({"action": "unsubscribe", "dev_euis": "c"}))
+        for i, dev in enumerate("abcb"):
+            await manager.broadcast(reading(i, dev))
+        await settle()
+        return manager, everything, picky
+
+    manager, everything, picky = run(scenario)
+    assert [f["raw_value"] for f in everything.frames] == [0, 1, 2, 3]
+    acks, updates = picky.frames[:3], picky.frames[3:]
+    assert [a["dev_euis"] for a in acks] == [[], ["b", "c"], ["b"]]
+    assert [(f["dev_eui"], f["raw_value"]) for f in updates] == [("b", 1), ("b", 3)]
+    # Emptied device sets are dropped from the index.
+    assert manager.stats()["subscribed_devices"] == 1
+
+
+def test_bad_control_message_gets_an_error_and_keeps_subscriptions():
+    async def scenario():
+        manager = WebSocketManager()
+        ws = FakeSocket()
+        manager.register(ws)
+        for raw in ("not json", '{"action": "mute", "dev_euis": []}', '{"action": "subscribe"}'):
+            manager.handle_message(ws, raw)
+        await manager.broadcast(reading(1))
+        await settle()
+        manager.disconnect(ws)
+        return manager, ws
+
+    manager, ws = run(scenario)
+    assert [f.get("type") for f in ws.frames] == ["error", "error", "error", None]
+    assert manager.stats()["wildcard_subscribers"] == 0
+
+
+def test_frames_are_encoded_once_per_broadcast():
+    async def scenario():
+        manager = WebSocketManager()
+        sockets = [FakeSocket() for _ in range(20)]
+        for ws in sockets:
+            manager.register(ws)
+        await manager.broadcast(reading(1))
+        await settle()
+        return manager, sockets
+
+    manager, sockets = run(scenario)
+    assert manager.stats()["frames_encoded"] == 1
+    assert all(ws.frames == [reading(1)] for ws in sockets)
+
+
+def test_coalescing_batches_a_window_into_shared_frames():
+    async def scenario():
+        manager = WebSocketManager(coalesce_ms=20)
+        everything, only_b, also_b, only_c = (FakeSocket() for _ in range(4))
+        for ws, devs in ((everything, None), (only_b, ["b"]), (also_b, ["b"]), (only_c, ["c"])):
+            manager.register(ws)
+            if devs:
+                manager.unsubscribe(ws, ["*"])
+                manager.subscribe(ws, devs)
+        for i, dev in enumerate("abab"):
+            await manager.broadcast(reading(i, dev))
+        await asyncio.sleep(0.05)
+        await manager.broadcast(reading(4, "c"))
+        await asyncio.sleep(0.05)
+        return manager, everything, only_b, also_b, only_c
+
+    manager, everything, only_b, also_b, only_c = run(scenario)
+    assert [[r["raw_value"] for r in f] for f in everything.frames] == [[0, 1, 2, 3], [4]]
+    assert only_b.frames == also_b.frames == [[reading(1, "b"), reading(3, "b")]]
+    assert only_c.frames == [[reading(4, "c")]]
+    # Window 1: wildcard + the shared "b" frame; window 2: wildcard + "c".
+    assert manager.stats()["frames_encoded"] == 4